@@ -0,0 +1,413 @@
+# admin.py
+# 数据库维护命令行：所有修改都按固定大小分批、基于集合的 SQL 执行，
+# 每批一个短事务并可在批次间休眠，服务运行期间也可以安全执行
+#
+# 用法：
+#   python admin.py init
+#   python admin.py stats
+#   python admin.py clean --sessions test default_user --dry-run
+#   python admin.py repair-timestamps --batch 500 --sleep 0.05
+#   python admin.py reindex
+#   python admin.py vacuum [--incremental PAGES]
+#   python admin.py integrity [--full] [--repair]
+#   python admin.py backfill-users --known robot-1 robot-2 --default default_user
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+
+from database import engine, shard_engines, init_db, SessionLocal
+from session_store import mark_sessions_deleted, backfill_sessions, next_seq, _preview
+
+DEFAULT_BATCH = 1000
+DEFAULT_SLEEP = 0.05
+
+
+def _targets() -> List[Tuple[str, Engine]]:
+    """主库和各消息分片（单分片时只有主库）"""
+    targets = [("main", engine)]
+    for i, shard_engine in enumerate(shard_engines):
+        if shard_engine is not engine:
+            targets.append((f"shard{i}", shard_engine))
+    return targets
+
+
+def _message_targets() -> List[Tuple[str, Engine]]:
+    """存放 chat_messages 的数据库"""
+    return [(f"shard{i}" if e is not engine else "main", e) for i, e in enumerate(shard_engines)]
+
+
+def _file_size(target_engine: Engine) -> int:
+    path = target_engine.url.database
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def run_batches(target_engine: Engine, label: str, count_sql, batch_sql, params: dict,
+                batch: int, sleep: float, dry_run: bool) -> int:
+    """
+    反复执行 batch_sql（每次最多修改 batch 行）直到没有剩余，返回修改的行数。
+    每批单独提交，批次之间休眠 sleep 秒，让在线请求有机会拿到写锁。
+    """
+    with target_engine.connect() as conn:
+        pending = conn.execute(count_sql, params).scalar() or 0
+    if dry_run or pending == 0:
+        print(f"[Admin] {label}: {pending} 行待处理{'（dry-run，未修改）' if dry_run and pending else ''}")
+        return 0
+
+    done = 0
+    start = time.perf_counter()
+    while True:
+        with target_engine.begin() as conn:
+            changed = conn.execute(batch_sql, {**params, "batch": batch}).rowcount
+        done += changed
+        print(f"[Admin] {label}: {done}/{pending} ({time.perf_counter() - start:.1f}s)")
+        if changed < batch:
+            break
+        if sleep:
+            time.sleep(sleep)
+    return done
+
+
+def cmd_init(args):
+    init_db()
+
+
+def cmd_clean(args):
+    """删除指定会话的消息和归档数据，并在会话元数据中记为已删除"""
+    params = {"ids": args.sessions}
+    total = 0
+    for name, target in _message_targets():
+        total += run_batches(
+            target, f"{name} 清理消息",
+            text("SELECT COUNT(*) FROM chat_messages WHERE session_id IN :ids")
+            .bindparams(bindparam("ids", expanding=True)),
+            text("DELETE FROM chat_messages WHERE id IN ("
+                 "SELECT id FROM chat_messages WHERE session_id IN :ids LIMIT :batch)")
+            .bindparams(bindparam("ids", expanding=True)),
+            params, args.batch, args.sleep, args.dry_run
+        )
+        run_batches(
+            target, f"{name} 清理归档",
+            text("SELECT COUNT(*) FROM archived_sessions WHERE session_id IN :ids")
+            .bindparams(bindparam("ids", expanding=True)),
+            text("DELETE FROM archived_sessions WHERE session_id IN ("
+                 "SELECT session_id FROM archived_sessions WHERE session_id IN :ids LIMIT :batch)")
+            .bindparams(bindparam("ids", expanding=True)),
+            params, args.batch, args.sleep, args.dry_run
+        )
+
+    if not args.dry_run:
+        db = SessionLocal()
+        try:
+            mark_sessions_deleted(db, args.sessions)
+            db.commit()
+        finally:
+            db.close()
+        print(f"[Admin] 已删除 {total} 条消息")
+
+
+def cmd_repair_timestamps(args):
+    """把 created_at 为空的消息补上当前时间"""
+    total = 0
+    for name, target in _message_targets():
+        total += run_batches(
+            target, f"{name} 修复时间戳",
+            text("SELECT COUNT(*) FROM chat_messages WHERE created_at IS NULL"),
+            text("UPDATE chat_messages SET created_at = :now WHERE id IN ("
+                 "SELECT id FROM chat_messages WHERE created_at IS NULL LIMIT :batch)"),
+            {"now": datetime.utcnow()}, args.batch, args.sleep, args.dry_run
+        )
+    if not args.dry_run:
+        print(f"[Admin] 已修复 {total} 条记录")
+
+
+def _memory_sessions(user_id: str) -> List[str]:
+    """从长期记忆索引的元数据中找出该用户说过话的会话"""
+    from memory import index_paths
+    _, meta_path = index_paths(user_id)
+    if not os.path.exists(meta_path):
+        return []
+    with open(meta_path, encoding="utf-8") as f:
+        return list({json.loads(line)["session_id"] for line in f if line.strip()})
+
+
+def cmd_backfill_users(args):
+    """
+    为没有所属用户的旧会话补上 user_id：
+    1. --known 中的用户：其长期记忆索引里出现过的会话，以及会话ID就是用户ID的会话（旧版以 user_id 作会话ID）
+    2. 其余会话归到 --default（与 /api/chat 未传 user_id 时的默认值一致）
+    """
+    init_db()  # 确保旧库已经加上 user_id 列和索引
+    total = 0
+    for user_id in args.known:
+        session_ids = _memory_sessions(user_id) + [user_id]
+        for i in range(0, len(session_ids), args.batch):
+            total += run_batches(
+                engine, f"用户 {user_id} 的会话",
+                text("SELECT COUNT(*) FROM chat_sessions WHERE user_id IS NULL AND session_id IN :ids")
+                .bindparams(bindparam("ids", expanding=True)),
+                text("UPDATE chat_sessions SET user_id = :user_id WHERE session_id IN ("
+                     "SELECT session_id FROM chat_sessions WHERE user_id IS NULL AND session_id IN :ids "
+                     "LIMIT :batch)")
+                .bindparams(bindparam("ids", expanding=True)),
+                {"ids": session_ids[i:i + args.batch], "user_id": user_id}, args.batch, args.sleep, args.dry_run
+            )
+
+    if args.default:
+        total += run_batches(
+            engine, f"其余会话 -> {args.default}",
+            text("SELECT COUNT(*) FROM chat_sessions WHERE user_id IS NULL"),
+            text("UPDATE chat_sessions SET user_id = :user_id WHERE session_id IN ("
+                 "SELECT session_id FROM chat_sessions WHERE user_id IS NULL LIMIT :batch)"),
+            {"user_id": args.default}, args.batch, args.sleep, args.dry_run
+        )
+    if not args.dry_run:
+        print(f"[Admin] 已为 {total} 个会话补上所属用户")
+
+
+def _each_target(label: str, action: Callable, args):
+    for name, target in _targets():
+        start = time.perf_counter()
+        if args.dry_run:
+            print(f"[Admin] {name} {label}（dry-run，未执行）")
+            continue
+        action(name, target)
+        print(f"[Admin] {name} {label}完成 ({time.perf_counter() - start:.1f}s)")
+        if args.sleep:
+            time.sleep(args.sleep)
+
+
+def cmd_reindex(args):
+    """逐个索引重建（每个索引一个短事务），最后更新查询规划器统计"""
+    def action(name, target):
+        with target.connect() as conn:
+            indexes = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+            )).scalars().all()
+        for index in indexes:
+            with target.begin() as conn:
+                conn.execute(text(f'REINDEX "{index}"'))
+            print(f"[Admin] {name} 已重建索引 {index}")
+            if args.sleep:
+                time.sleep(args.sleep)
+        with target.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
+    _each_target("重建索引", action, args)
+
+
+def cmd_vacuum(args):
+    """
+    默认执行完整 VACUUM（期间独占数据库，应在低峰执行）。
+    --incremental N 在 auto_vacuum=INCREMENTAL 的库上每批回收 N 页，可在线执行。
+    """
+    def action(name, target):
+        before = _file_size(target)
+        with target.connect() as conn:
+            if args.incremental:
+                mode = conn.execute(text("PRAGMA auto_vacuum")).scalar()
+                if mode != 2:
+                    print(f"[Admin] {name} 未启用 auto_vacuum=INCREMENTAL，请先执行一次完整 VACUUM 并设置")
+                    return
+                while conn.execute(text("PRAGMA freelist_count")).scalar():
+                    conn.exec_driver_sql(f"PRAGMA incremental_vacuum({args.incremental})")
+                    if args.sleep:
+                        time.sleep(args.sleep)
+            else:
+                if args.enable_incremental:
+                    conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        print(f"[Admin] {name} {before / 1024 / 1024:.2f} MB -> {_file_size(target) / 1024 / 1024:.2f} MB")
+
+    _each_target("VACUUM ", action, args)
+
+
+def cmd_integrity(args):
+    """SQLite 完整性检查，并核对会话元数据与消息分片是否一致"""
+    pragma = "integrity_check" if args.full else "quick_check"
+    ok = True
+    for name, target in _targets():
+        with target.connect() as conn:
+            result = conn.execute(text(f"PRAGMA {pragma}")).scalars().all()
+        status = "ok" if result == ["ok"] else "; ".join(result[:10])
+        ok = ok and status == "ok"
+        print(f"[Admin] {name} {pragma}: {status}")
+
+    with engine.connect() as conn:
+        catalog = dict(conn.execute(text(
+            "SELECT session_id, message_count FROM chat_sessions WHERE deleted = 0"
+        )).all())
+    actual = {}
+    for _, target in _message_targets():
+        with target.connect() as conn:
+            actual.update(conn.execute(text(
+                "SELECT session_id, COUNT(*) FROM chat_messages GROUP BY session_id"
+            )).all())
+            actual.update(conn.execute(text(
+                "SELECT session_id, message_count FROM archived_sessions"
+            )).all())
+
+    missing = [sid for sid in actual if sid not in catalog]
+    mismatched = [sid for sid, count in catalog.items() if actual.get(sid, 0) != count]
+    print(f"[Admin] 会话元数据: {len(catalog)} 个会话，缺少元数据 {len(missing)} 个，消息数不一致 {len(mismatched)} 个")
+    if missing or mismatched:
+        if args.repair:
+            created = 0
+            if missing:
+                from database import ShardSet
+                shards = ShardSet()
+                try:
+                    created = backfill_sessions(shards.catalog, [shards.shard(i) for i in range(shards.count)], force=True)
+                finally:
+                    shards.close()
+            changed = _repair_sessions(mismatched) if mismatched else 0
+            print(f"[Admin] 补建会话元数据 {created} 个，修正 {changed} 个")
+        else:
+            ok = False
+            print("[Admin] 可加 --repair 重建会话元数据")
+    return ok
+
+
+STATS_CHUNK = 500
+
+SHARD_STATS_SQL = text(
+    "SELECT session_id, COUNT(*), MIN(created_at), MAX(created_at), "
+    "(SELECT content FROM chat_messages f WHERE f.session_id = m.session_id AND f.role = 'user' "
+    " ORDER BY f.created_at, f.id LIMIT 1), "
+    "(SELECT content FROM chat_messages l WHERE l.session_id = m.session_id "
+    " ORDER BY l.created_at DESC, l.id DESC LIMIT 1) "
+    "FROM chat_messages m WHERE session_id IN :ids GROUP BY session_id"
+).bindparams(bindparam("ids", expanding=True))
+
+ARCHIVE_STATS_SQL = text(
+    "SELECT session_id, message_count, last_activity, last_message "
+    "FROM archived_sessions WHERE session_id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+
+# 只更新与分片统计不一致的行（IS NOT 对 NULL 也成立），rowcount 即实际修正的会话数；
+# 归档会话没有标题和首条消息时间，沿用原值
+REPAIR_SESSIONS_SQL = text("""
+    UPDATE chat_sessions SET
+        message_count = s.message_count,
+        created_at = COALESCE(s.first_at, chat_sessions.created_at),
+        last_activity = COALESCE(s.last_at, chat_sessions.last_activity),
+        title = COALESCE(s.title, chat_sessions.title),
+        last_message = COALESCE(s.last_message, chat_sessions.last_message),
+        change_seq = :seq
+    FROM session_stats AS s
+    WHERE chat_sessions.session_id = s.session_id AND chat_sessions.deleted = 0
+      AND (chat_sessions.message_count IS NOT s.message_count
+           OR chat_sessions.created_at IS NOT COALESCE(s.first_at, chat_sessions.created_at)
+           OR chat_sessions.last_activity IS NOT COALESCE(s.last_at, chat_sessions.last_activity)
+           OR chat_sessions.title IS NOT COALESCE(s.title, chat_sessions.title)
+           OR chat_sessions.last_message IS NOT COALESCE(s.last_message, chat_sessions.last_message))
+""")
+
+
+def _repair_sessions(session_ids: List[str]) -> int:
+    """
+    按分片中的消息（及归档）重新统计这些会话的消息数、首末活动时间、标题和预览，
+    写入主库的临时表后用一条 UPDATE ... FROM 修正元数据，返回实际修改的行数
+    """
+    stats = {sid: {"session_id": sid, "message_count": 0, "first_at": None, "last_at": None,
+                   "title": None, "last_message": None} for sid in session_ids}
+    for _, target in _message_targets():
+        with target.connect() as conn:
+            for start in range(0, len(session_ids), STATS_CHUNK):
+                ids = session_ids[start:start + STATS_CHUNK]
+                for sid, count, first_at, last_at, first_user, last_content in conn.execute(SHARD_STATS_SQL, {"ids": ids}):
+                    stats[sid].update(message_count=count, first_at=first_at, last_at=last_at,
+                                      title=_preview(first_user, 50) if first_user else None,
+                                      last_message=_preview(last_content, 100))
+                for sid, count, last_at, last_message in conn.execute(ARCHIVE_STATS_SQL, {"ids": ids}):
+                    stats[sid].update(message_count=count, last_at=last_at, last_message=last_message)
+
+    db = SessionLocal()
+    try:
+        db.execute(text(
+            "CREATE TEMP TABLE session_stats (session_id TEXT PRIMARY KEY, message_count INTEGER, "
+            "first_at TIMESTAMP, last_at TIMESTAMP, title TEXT, last_message TEXT)"
+        ))
+        try:
+            db.execute(text(
+                "INSERT INTO session_stats VALUES "
+                "(:session_id, :message_count, :first_at, :last_at, :title, :last_message)"
+            ), list(stats.values()))
+            changed = db.execute(REPAIR_SESSIONS_SQL, {"seq": next_seq(db)}).rowcount
+        finally:
+            db.execute(text("DROP TABLE temp.session_stats"))
+        if changed:
+            db.commit()
+        else:
+            db.rollback()  # 没有修改时不推进变更序号
+        return changed
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def cmd_stats(args):
+    for name, target in _targets():
+        with target.connect() as conn:
+            tables = conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )).scalars().all()
+            page_size = conn.execute(text("PRAGMA page_size")).scalar()
+            pages = conn.execute(text("PRAGMA page_count")).scalar()
+            free = conn.execute(text("PRAGMA freelist_count")).scalar()
+            counts = {t: conn.execute(text(f'SELECT COUNT(*) FROM "{t}"')).scalar() for t in tables}
+        print(f"[Admin] {name}: {_file_size(target) / 1024 / 1024:.2f} MB，"
+              f"{pages} 页 x {page_size} B，空闲页 {free} ({free / pages:.1%})" if pages else f"[Admin] {name}: 空库")
+        for table, count in counts.items():
+            print(f"    {table:<20} {count:>10} 行")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="AI桌面机器人数据库维护工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add(name, func, help_text, mutating=True):
+        p = sub.add_parser(name, help=help_text)
+        p.set_defaults(func=func)
+        if mutating:
+            p.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="每批最多处理的行数")
+            p.add_argument("--sleep", type=float, default=DEFAULT_SLEEP, help="批次之间休眠的秒数")
+            p.add_argument("--dry-run", action="store_true", help="只统计，不修改")
+        return p
+
+    add("init", cmd_init, "创建数据表并补建会话元数据", mutating=False)
+    p = add("clean", cmd_clean, "删除指定会话（默认清理测试会话）")
+    p.add_argument("--sessions", nargs="+", default=["test", "default_user"], help="要删除的会话ID")
+    add("repair-timestamps", cmd_repair_timestamps, "修复 created_at 为空的消息")
+    add("reindex", cmd_reindex, "逐个重建索引并 ANALYZE")
+    p = add("vacuum", cmd_vacuum, "回收空闲空间")
+    p.add_argument("--incremental", type=int, default=0, metavar="PAGES", help="增量回收，每批页数")
+    p.add_argument("--enable-incremental", action="store_true", help="完整 VACUUM 时顺便开启 auto_vacuum=INCREMENTAL")
+    p = add("integrity", cmd_integrity, "完整性检查", mutating=False)
+    p.add_argument("--full", action="store_true", help="使用 integrity_check（较慢）代替 quick_check")
+    p.add_argument("--repair", action="store_true", help="会话元数据不一致时重建")
+    p = add("backfill-users", cmd_backfill_users, "为旧会话补上所属用户")
+    p.add_argument("--known", nargs="*", default=[], help="已知的用户ID，按长期记忆索引匹配其会话")
+    p.add_argument("--default", default="default_user", help="其余会话归属的用户，传空字符串则不处理")
+    add("stats", cmd_stats, "各数据库文件的大小和行数", mutating=False)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    for _, target in _targets():
+        target.echo = False
+    result = args.func(args)
+    return 1 if result is False else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
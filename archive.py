@@ -0,0 +1,255 @@
+# archive.py
+# 冷会话归档：长时间不活跃的会话从 chat_messages 移入按会话压缩的 archived_sessions，
+# 打开会话时直接从归档读取（只读），继续对话时再透明地还原回热表
+#
+# 用法：
+#   python archive.py --dry-run        # 只统计可归档的会话
+#   python archive.py --days 7         # 归档 7 天未活跃的会话
+import argparse
+import asyncio
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session, aliased
+
+from config import ArchiveConfig
+from database import ShardSet
+from fast_response import dumps
+from models import ChatMessage, ChatSession, ArchivedSession
+from session_store import next_seq, _preview
+
+try:
+    import zstandard
+except ImportError:  # 未安装时使用标准库 zlib
+    zstandard = None
+
+
+def active_codec() -> str:
+    if ArchiveConfig.CODEC == "zstd" and zstandard is not None:
+        return "zstd"
+    return "zlib"
+
+
+def pack_messages(messages: List[ChatMessage]) -> Tuple[str, bytes, int]:
+    """把按时间排好序的消息压缩成一个数据块，返回 (算法, 数据, 原始字节数)"""
+    raw = dumps([
+        [m.role, m.content, m.created_at.isoformat() if m.created_at else None, m.id]
+        for m in messages
+    ])
+    codec = active_codec()
+    if codec == "zstd":
+        payload = zstandard.ZstdCompressor(level=ArchiveConfig.ZSTD_LEVEL).compress(raw)
+    else:
+        payload = zlib.compress(raw, ArchiveConfig.ZLIB_LEVEL)
+    return codec, payload, len(raw)
+
+
+def unpack_messages(codec: str, payload: bytes, session_id: str) -> List[ChatMessage]:
+    """还原出的消息带有归档前的ID（较早的归档没有保存ID，为 None）"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("该会话使用 zstd 归档，需要安装 zstandard 才能还原")
+        raw = zstandard.ZstdDecompressor().decompress(payload)
+    else:
+        raw = zlib.decompress(payload)
+    return [
+        ChatMessage(
+            id=message_id[0] if message_id else None,
+            session_id=session_id,
+            role=role,
+            content=content,
+            created_at=datetime.fromisoformat(created_at) if created_at else datetime.utcnow()
+        )
+        for role, content, created_at, *message_id in json.loads(raw)
+    ]
+
+
+def load_archived(db: Session, session_id: str) -> Optional[List[ChatMessage]]:
+    """只读地取出归档会话的消息（不写库，对象不加入 db）；会话未归档返回 None"""
+    archived = db.get(ArchivedSession, session_id)
+    if archived is None:
+        return None
+    return unpack_messages(archived.codec, archived.payload, session_id)
+
+
+def archive_shard(db: Session, cutoff: datetime, limit: int, dry_run: bool = False) -> List[dict]:
+    """归档单个分片中最后一条消息早于 cutoff 的会话（调用方负责提交）"""
+    candidates = db.query(
+        ChatMessage.session_id
+    ).group_by(ChatMessage.session_id).having(
+        func.max(ChatMessage.created_at) < cutoff
+    ).limit(limit).all()
+
+    archived = []
+    for (session_id,) in candidates:
+        messages = db.query(ChatMessage).filter(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).all()
+        if not messages:
+            continue
+
+        codec, payload, raw_size = pack_messages(messages)
+        stats = {
+            "session_id": session_id,
+            "messages": len(messages),
+            "raw_size": raw_size,
+            "stored_size": len(payload)
+        }
+        if dry_run:
+            archived.append(stats)
+            continue
+
+        # 只删除已打包的消息，并且要求会话在打包后没有变化（没有新消息、没有被删除）：
+        # 一条语句内完成检查和删除，否则跳过该会话，下一轮再判断是否仍然冷
+        last_id = max(m.id for m in messages)
+        other = aliased(ChatMessage)
+        newer = db.query(other.id).filter(other.session_id == session_id, other.id > last_id).exists()
+        packed = db.query(func.count(other.id)).filter(
+            other.session_id == session_id, other.id <= last_id
+        ).scalar_subquery()
+        moved = db.query(ChatMessage).filter(
+            ChatMessage.session_id == session_id,
+            ChatMessage.id <= last_id,
+            ~newer,
+            packed == len(messages)
+        ).delete(synchronize_session=False)
+        if moved != len(messages):
+            print(f"[Archive] 会话 {session_id} 在归档期间有变化，本轮跳过")
+            continue
+
+        archived.append(stats)
+        db.merge(ArchivedSession(
+            session_id=session_id,
+            codec=codec,
+            payload=payload,
+            message_count=len(messages),
+            raw_size=raw_size,
+            last_activity=messages[-1].created_at,
+            last_message=_preview(messages[-1].content, 100),
+            archived_at=datetime.utcnow()
+        ))
+
+    return archived
+
+
+def _bump_sessions(catalog: Session, session_ids: List[str]):
+    """归档 / 还原会改变会话列表中的条目，推进变更序号使缓存失效"""
+    if not session_ids:
+        return
+    seq = next_seq(catalog)
+    catalog.query(ChatSession).filter(
+        ChatSession.session_id.in_(session_ids)
+    ).update({ChatSession.change_seq: seq}, synchronize_session=False)
+
+
+async def archive_inactive(shards: ShardSet, inactive_days: float = ArchiveConfig.INACTIVE_DAYS,
+                           limit: int = ArchiveConfig.BATCH_SIZE, dry_run: bool = False) -> List[dict]:
+    """在所有分片上归档冷会话，返回每个被归档会话的统计"""
+    cutoff = datetime.utcnow() - timedelta(days=inactive_days)
+    results = await shards.scatter(lambda db: archive_shard(db, cutoff, limit, dry_run))
+    archived = [item for shard_result in results for item in shard_result]
+
+    if not dry_run:
+        _bump_sessions(shards.catalog, [item["session_id"] for item in archived])
+        shards.commit()
+    return archived
+
+
+def rehydrate_session(shards: ShardSet, session_id: str) -> int:
+    """
+    如果会话已归档，把消息还原到热表并提交，返回还原的消息数；未归档返回 0。
+    先删除归档行再写入消息，并发还原同一会话时只有一方会成功。
+    消息沿用归档前的ID；ID 已被占用（分片中的ID被复用，或重新分片后）时分配新ID。
+    """
+    db = shards.for_session(session_id)
+    archived = db.get(ArchivedSession, session_id)
+    if archived is None:
+        return 0
+
+    messages = unpack_messages(archived.codec, archived.payload, session_id)
+    claimed = db.query(ArchivedSession).filter(
+        ArchivedSession.session_id == session_id
+    ).delete(synchronize_session=False)
+    if not claimed:
+        db.rollback()
+        return 0
+
+    ids = [m.id for m in messages if m.id is not None]
+    taken = set()
+    for start in range(0, len(ids), 500):
+        taken.update(i for (i,) in db.query(ChatMessage.id).filter(ChatMessage.id.in_(ids[start:start + 500])))
+    for message in messages:
+        if message.id in taken:
+            message.id = None
+
+    # 先写入沿用原ID的消息，新分配的ID才不会与它们冲突
+    db.add_all([m for m in messages if m.id is not None])
+    db.flush()
+    db.add_all([m for m in messages if m.id is None])
+    _bump_sessions(shards.catalog, [session_id])
+    shards.commit()
+    print(f"[Archive] 会话 {session_id} 已还原 {len(messages)} 条消息")
+    return len(messages)
+
+
+def delete_archived(db: Session, session_ids: Optional[List[str]] = None,
+                    keep: Optional[List[str]] = None) -> int:
+    """删除归档数据（规则同 mark_sessions_deleted），返回其中包含的消息数（调用方负责提交）"""
+    query = db.query(ArchivedSession)
+    if session_ids is not None:
+        if not session_ids:
+            return 0
+        query = query.filter(ArchivedSession.session_id.in_(session_ids))
+    if keep:
+        query = query.filter(~ArchivedSession.session_id.in_(keep))
+    count = query.with_entities(func.coalesce(func.sum(ArchivedSession.message_count), 0)).scalar()
+    query.delete(synchronize_session=False)
+    return count
+
+
+async def auto_archive_loop():
+    """按 ArchiveConfig.AUTO_ARCHIVE_INTERVAL 定期归档冷会话"""
+    while True:
+        await asyncio.sleep(ArchiveConfig.AUTO_ARCHIVE_INTERVAL)
+        shards = ShardSet()
+        try:
+            archived = await archive_inactive(shards)
+            if archived:
+                print(f"[Archive] 已归档 {len(archived)} 个冷会话")
+        except Exception as e:
+            shards.rollback()
+            print(f"[Archive] 自动归档失败: {e}")
+        finally:
+            shards.close()
+
+
+def _report(archived: List[dict], dry_run: bool):
+    raw = sum(item["raw_size"] for item in archived)
+    stored = sum(item["stored_size"] for item in archived)
+    messages = sum(item["messages"] for item in archived)
+    verb = "可归档" if dry_run else "已归档"
+    print(f"[Archive] {verb} {len(archived)} 个会话，{messages} 条消息")
+    if raw:
+        print(f"[Archive] 原始 {raw / 1024:.1f} KB -> 压缩后 {stored / 1024:.1f} KB "
+              f"({stored / raw:.1%}，算法 {active_codec()})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="归档长时间不活跃的会话")
+    parser.add_argument("--days", type=float, default=ArchiveConfig.INACTIVE_DAYS, help="不活跃天数")
+    parser.add_argument("--limit", type=int, default=ArchiveConfig.BATCH_SIZE, help="每个分片最多归档的会话数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不归档")
+    args = parser.parse_args()
+
+    from database import shard_engines
+    for shard_engine in shard_engines:
+        shard_engine.echo = False
+
+    shard_set = ShardSet()
+    try:
+        _report(asyncio.run(archive_inactive(shard_set, args.days, args.limit, args.dry_run)), args.dry_run)
+    finally:
+        shard_set.close()
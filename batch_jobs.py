@@ -0,0 +1,371 @@
+# batch_jobs.py
+# 批量对话任务：一次提交多条提示词 / 多段对话，由固定数量的后台 worker 以低于交互式对话的优先级
+# 调用 LLM，结果攒批写入数据库，调用方轮询或流式读取
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert, or_, update
+from starlette.concurrency import run_in_threadpool
+
+from config import BatchConfig
+from database import SessionLocal
+from models import BatchJob, BatchItem
+from llm_client import get_llm_client, track_usage
+from prompt_cache import system_prefix, normalize_usage
+from session_scheduler import scheduler
+
+FINAL_STATUSES = ("completed", "cancelled")
+
+
+def item_messages(item: dict) -> List[Dict]:
+    """
+    把提交的一项转换成发给模型的消息：{"prompt": "..."} 或 {"messages": [...]}。
+    与交互式对话使用相同的系统提示前缀，批量请求之间也能命中前缀缓存。
+    """
+    if item.get("messages"):
+        messages = [{"role": m["role"], "content": m["content"]} for m in item["messages"]]
+        if messages[0]["role"] != "system":
+            messages = system_prefix() + messages
+        return messages
+    if item.get("prompt"):
+        return system_prefix() + [{"role": "user", "content": item["prompt"]}]
+    raise ValueError("每一项需要包含 prompt 或 messages")
+
+
+def create_job(items: List[dict], max_tokens: Optional[int] = None) -> BatchJob:
+    """任务和全部条目在一个事务中批量插入"""
+    if not items:
+        raise ValueError("items 不能为空")
+    if len(items) > BatchConfig.MAX_ITEMS:
+        raise ValueError(f"单个任务最多 {BatchConfig.MAX_ITEMS} 项")
+    rows = [json.dumps(item_messages(item), ensure_ascii=False) for item in items]
+
+    job = BatchJob(job_id=str(uuid.uuid4()), status="queued", total=len(rows),
+                   max_tokens=max_tokens, created_at=datetime.utcnow())
+    db = SessionLocal()
+    try:
+        db.add(job)
+        db.flush()
+        db.execute(insert(BatchItem), [
+            {"job_id": job.job_id, "item_index": i, "messages": messages, "status": "pending"}
+            for i, messages in enumerate(rows)
+        ])
+        db.commit()
+        db.refresh(job)
+        db.expunge(job)
+        return job
+    finally:
+        db.close()
+
+
+def job_entry(job: BatchJob) -> dict:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "total": job.total,
+        "succeeded": job.succeeded,
+        "failed": job.failed,
+        "pending": job.total - job.succeeded - job.failed if job.status != "cancelled" else 0,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def item_entry(item: BatchItem) -> dict:
+    return {
+        "index": item.item_index,
+        "status": item.status,
+        "reply": item.reply,
+        "error": item.error,
+        "usage": json.loads(item.usage) if item.usage else None,
+        "latency_ms": item.latency_ms,
+        "seq": item.done_seq
+    }
+
+
+class BatchRunner:
+    """
+    所有批量任务共享的 worker 池，与交互式对话共用同一个 LLM 客户端，每条的 usage 单独记录。
+    有交互式对话在进行时，同时处理的条数降到 WORKERS_WHEN_BUSY。
+    结果先放在内存缓冲里，按条数或时间批量写库，一次事务更新多条结果和任务计数。
+
+    多个进程共用一个数据库时，任务先以租约（owner + lease_until）原子地认领再入队，
+    同一任务只由一个进程执行；持有者定期续约，退出后租约过期才由其他进程接手。
+    """
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.cancelled: set = set()
+        self.buffer: List[dict] = []
+        self.done_counts: Dict[str, int] = {}  # 任务已完成条数，用于分配 done_seq
+        self.outstanding: Dict[str, int] = {}  # 任务还在队列中或正在调用的条数
+        self.flush_needed: Optional[asyncio.Event] = None
+        self.flushed: Optional[asyncio.Event] = None  # 每次写库后替换，供流式读取等待
+
+    @property
+    def started(self) -> bool:
+        return bool(self.tasks)
+
+    def start(self):
+        """启动 worker 和写库协程，并恢复重启前未完成的任务"""
+        if self.started:
+            return
+        self.queue = asyncio.Queue()
+        self.flush_needed = asyncio.Event()
+        self.flushed = asyncio.Event()
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(BatchConfig.WORKERS)]
+        self.tasks.append(asyncio.create_task(self._flusher()))
+        self.tasks.append(asyncio.create_task(self._lease_keeper()))
+        self._resume()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self._flush()
+        # 正常退出时释放租约，重启后（或其他进程）立即接手，不必等租约过期
+        if self.outstanding:
+            await run_in_threadpool(_update_leases, self.owner, list(self.outstanding),
+                                    {"owner": None, "lease_until": None})
+            self.outstanding.clear()
+            self.done_counts.clear()
+            self.cancelled.clear()
+
+    def _resume(self):
+        """认领没有持有者或租约已过期的未完成任务（重启前的任务、已退出进程的任务）"""
+        db = SessionLocal()
+        try:
+            jobs = db.query(BatchJob).filter(
+                BatchJob.status.in_(("queued", "running")),
+                or_(BatchJob.owner.is_(None), BatchJob.lease_until < datetime.utcnow()),
+                BatchJob.job_id.notin_(list(self.outstanding))
+            ).all()
+            resumed = [job for job in jobs if self.enqueue(job, db)]
+            if resumed:
+                print(f"[Batch] 恢复 {len(resumed)} 个未完成的批量任务")
+        finally:
+            db.close()
+
+    def _claim(self, db, job_id: str) -> bool:
+        """原子地认领任务：只有没有持有者或租约已过期时才成功"""
+        now = datetime.utcnow()
+        claimed = db.execute(update(BatchJob).where(
+            BatchJob.job_id == job_id,
+            BatchJob.status.in_(("queued", "running")),
+            or_(BatchJob.owner.is_(None), BatchJob.lease_until < now)
+        ).values(
+            owner=self.owner, lease_until=now + timedelta(seconds=BatchConfig.LEASE_SECONDS)
+        ).execution_options(synchronize_session=False)).rowcount
+        db.commit()
+        return claimed == 1
+
+    def enqueue(self, job: BatchJob, db=None) -> bool:
+        """认领任务并把未完成的条目放入队列；任务已由其他进程持有时返回 False"""
+        own = db is None
+        db = db or SessionLocal()
+        try:
+            if not self._claim(db, job.job_id):
+                print(f"[Batch] 任务 {job.job_id} 已由其他进程执行，跳过")
+                return False
+            pending = db.query(BatchItem.id, BatchItem.messages).filter(
+                BatchItem.job_id == job.job_id, BatchItem.status == "pending"
+            ).order_by(BatchItem.item_index).all()
+        finally:
+            if own:
+                db.close()
+        if pending:
+            self.done_counts[job.job_id] = job.succeeded + job.failed
+            self.outstanding[job.job_id] = self.outstanding.get(job.job_id, 0) + len(pending)
+        for item_id, messages in pending:
+            self.queue.put_nowait((job.job_id, item_id, messages, job.max_tokens))
+        print(f"[Batch] 任务 {job.job_id} 入队 {len(pending)} 条")
+        return True
+
+    def cancel(self, job_id: str) -> bool:
+        """取消任务：未开始的条目标记为 cancelled，正在调用的条目结果照常保存"""
+        db = SessionLocal()
+        try:
+            job = db.get(BatchJob, job_id)
+            if job is None:
+                return False
+            if job.status in FINAL_STATUSES:
+                return True
+            if job_id in self.outstanding:
+                self.cancelled.add(job_id)
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+            db.execute(update(BatchItem).where(
+                BatchItem.job_id == job_id, BatchItem.status == "pending"
+            ).values(status="cancelled"))
+            db.commit()
+        finally:
+            db.close()
+        self._notify()
+        print(f"[Batch] 任务 {job_id} 已取消")
+        return True
+
+    def _limit(self) -> int:
+        return BatchConfig.WORKERS_WHEN_BUSY if scheduler.active_sessions else BatchConfig.WORKERS
+
+    async def _worker(self, index: int):
+        while True:
+            job_id, item_id, messages, max_tokens = await self.queue.get()
+            if job_id in self.cancelled:
+                self._item_done(job_id)
+                continue
+            # 交互式对话优先：有对话进行时让出大部分并发
+            while self.running >= self._limit():
+                await asyncio.sleep(0.05)
+            if job_id in self.cancelled:
+                self._item_done(job_id)
+                continue
+
+            client = get_llm_client()
+            self.running += 1
+            start = time.perf_counter()
+            result = {"id": item_id, "job_id": job_id}
+            usage = track_usage()
+            try:
+                reply = await asyncio.wait_for(
+                    client.chat(json.loads(messages), max_tokens), BatchConfig.ITEM_TIMEOUT
+                )
+                usage = normalize_usage(usage)
+                result.update(status="succeeded", reply=reply,
+                              usage=json.dumps(usage) if usage else None)
+            except Exception as e:
+                print(f"[Batch] 任务 {job_id} 条目 {item_id} 失败: {type(e).__name__}: {e}")
+                result.update(status="failed", error=f"{type(e).__name__}: {e}"[:500])
+            finally:
+                self.running -= 1
+            result.update(latency_ms=int((time.perf_counter() - start) * 1000),
+                          finished_at=datetime.utcnow())
+            self._add_result(result)
+            self._item_done(job_id)
+
+    def _add_result(self, result: dict):
+        job_id = result["job_id"]
+        self.done_counts[job_id] = self.done_counts.get(job_id, 0) + 1
+        result["done_seq"] = self.done_counts[job_id]
+        self.buffer.append(result)
+        if len(self.buffer) >= BatchConfig.FLUSH_SIZE:
+            self.flush_needed.set()
+
+    def _item_done(self, job_id: str):
+        """
+        条目处理完或因取消被跳过。任务的条目全部离开队列时任务已进入最终状态
+        （全部完成即 completed，否则是 cancelled），清理它在内存中的记录
+        """
+        left = self.outstanding.get(job_id, 1) - 1
+        if left > 0:
+            self.outstanding[job_id] = left
+            return
+        self.outstanding.pop(job_id, None)
+        self.done_counts.pop(job_id, None)
+        self.cancelled.discard(job_id)
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_needed.wait(), BatchConfig.FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_needed.clear()
+            await self._flush()
+
+    async def _lease_keeper(self):
+        """为正在执行的任务续约，并接手租约已过期的任务"""
+        while True:
+            await asyncio.sleep(BatchConfig.LEASE_SECONDS / 3)
+            try:
+                if self.outstanding:
+                    await run_in_threadpool(
+                        _update_leases, self.owner, list(self.outstanding),
+                        {"lease_until": datetime.utcnow() + timedelta(seconds=BatchConfig.LEASE_SECONDS)})
+                self._resume()
+            except Exception as e:
+                print(f"[Batch] 续约失败: {type(e).__name__}: {e}")
+
+    async def _flush(self):
+        if not self.buffer:
+            return
+        rows, self.buffer = self.buffer, []
+        try:
+            await run_in_threadpool(_write_results, rows)
+        except Exception as e:
+            print(f"[Batch] 写入结果失败，下次重试: {type(e).__name__}: {e}")
+            self.buffer = rows + self.buffer
+            return
+        self._notify()
+
+    def _notify(self):
+        if self.flushed is not None:
+            self.flushed.set()
+            self.flushed = asyncio.Event()
+
+    async def wait_for_update(self, timeout: float):
+        """等待下一次结果写库或任务状态变化"""
+        if self.flushed is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self.flushed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _update_leases(owner: str, job_ids: List[str], values: dict):
+    """更新本进程仍持有的任务的租约"""
+    db = SessionLocal()
+    try:
+        db.execute(update(BatchJob).where(
+            BatchJob.job_id.in_(job_ids), BatchJob.owner == owner
+        ).values(values).execution_options(synchronize_session=False))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _write_results(rows: List[dict]):
+    """一个事务内按主键批量更新条目，并累加各任务的计数"""
+    counts: Dict[str, List[int]] = {}
+    for row in rows:
+        counts.setdefault(row["job_id"], [0, 0])[0 if row["status"] == "succeeded" else 1] += 1
+
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.execute(update(BatchItem), [
+            {key: row.get(key) for key in
+             ("id", "status", "reply", "error", "usage", "latency_ms", "done_seq", "finished_at")}
+            for row in rows
+        ])
+        for job in db.query(BatchJob).filter(BatchJob.job_id.in_(counts)):
+            succeeded, failed = counts[job.job_id]
+            job.succeeded += succeeded
+            job.failed += failed
+            job.started_at = job.started_at or now
+            if job.status == "cancelled":
+                continue
+            if job.succeeded + job.failed >= job.total:
+                job.status = "completed"
+                job.finished_at = now
+                print(f"[Batch] 任务 {job.job_id} 完成：成功 {job.succeeded}，失败 {job.failed}")
+            else:
+                job.status = "running"
+        db.commit()
+    finally:
+        db.close()
+
+
+batch_runner = BatchRunner()
@@ -0,0 +1,111 @@
+# bench_archive.py
+# 对比归档冷会话前后的数据库体积和热查询耗时
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, text
+from sqlalchemy.orm import sessionmaker
+
+import archive
+from models import Base, ChatMessage
+
+COLD_SESSIONS = 2000
+HOT_SESSIONS = 100
+MESSAGES_PER_SESSION = 20
+ROUNDS = 20
+
+
+def build(db):
+    random.seed(0)
+    words = "机器人 语音 模块 电机 控制 传感器 融合 路径 规划 今天 天气 怎么样 帮我 写 一段 代码 hello robot".split()
+    now = datetime.utcnow()
+    rows = []
+    for i in range(COLD_SESSIONS + HOT_SESSIONS):
+        start = now - (timedelta(days=random.randint(2, 90)) if i < COLD_SESSIONS else timedelta(minutes=30))
+        for j in range(MESSAGES_PER_SESSION):
+            role = "user" if j % 2 == 0 else "assistant"
+            length = 15 if role == "user" else 200
+            rows.append(ChatMessage(
+                session_id=f"{'cold' if i < COLD_SESSIONS else 'hot'}-{i}",
+                role=role,
+                content=" ".join(random.choice(words) for _ in range(length)),
+                created_at=start + timedelta(seconds=j * 30)
+            ))
+    db.add_all(rows)
+    db.commit()
+
+
+def hot_queries(db):
+    """会话列表聚合查询 + 读取一个热会话的全部消息"""
+    def run():
+        db.query(
+            ChatMessage.session_id,
+            func.max(ChatMessage.created_at),
+            func.count(ChatMessage.id)
+        ).group_by(ChatMessage.session_id).order_by(func.max(ChatMessage.created_at).desc()).limit(20).all()
+        db.query(ChatMessage).filter(
+            ChatMessage.session_id == f"hot-{COLD_SESSIONS}"
+        ).order_by(ChatMessage.created_at.asc()).all()
+
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        run()
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def table_size(engine, table):
+    """表和其索引占用的字节数（需要 SQLite 编译了 dbstat），不可用时返回 None"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(text(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name = :t OR name IN "
+                "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t)"
+            ), {"t": table}).scalar() or 0
+        except Exception:
+            return None
+
+
+def report(label, engine, path, db):
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+    hot = table_size(engine, "chat_messages")
+    cold = table_size(engine, "archived_sessions")
+    print(f"{label}: 文件 {os.path.getsize(path) / 1024 / 1024:6.2f} MB"
+          + (f"，chat_messages+索引 {hot / 1024 / 1024:6.2f} MB，归档表 {cold / 1024 / 1024:5.2f} MB"
+             if hot is not None else "")
+          + f"，热查询 {hot_queries(db):6.2f} ms")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        build(db)
+        print(f"{COLD_SESSIONS} 个冷会话 + {HOT_SESSIONS} 个热会话，每个 {MESSAGES_PER_SESSION} 条消息，"
+              f"压缩算法 {archive.active_codec()}")
+        report("归档前", engine, path, db)
+
+        start = time.perf_counter()
+        archived = archive.archive_shard(db, datetime.utcnow() - timedelta(days=1), COLD_SESSIONS)
+        db.commit()
+        elapsed = time.perf_counter() - start
+        raw = sum(item["raw_size"] for item in archived)
+        stored = sum(item["stored_size"] for item in archived)
+        print(f"归档 {len(archived)} 个会话耗时 {elapsed:.2f} s，"
+              f"原始 {raw / 1024 / 1024:.2f} MB -> 压缩 {stored / 1024 / 1024:.2f} MB ({stored / raw:.1%})")
+        report("归档后", engine, path, db)
+
+        # 还原单个会话的解压开销
+        from models import ArchivedSession
+        row = db.get(ArchivedSession, "cold-0")
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            archive.unpack_messages(row.codec, row.payload, row.session_id)
+        print(f"解压一个会话: {(time.perf_counter() - start) / ROUNDS * 1000:.3f} ms")
+        db.close()
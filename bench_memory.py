@@ -0,0 +1,47 @@
+# bench_memory.py
+# 测量长期记忆的向量化和检索耗时（不同索引规模）
+import random
+import tempfile
+import time
+
+from config import MemoryConfig
+
+SIZES = (1000, 10000, 50000)
+QUERIES = 50
+
+
+def random_sentence(rng):
+    subjects = ["我", "我妈妈", "我的猫", "机器人", "我们公司", "小明"]
+    facts = ["喜欢吃川菜", "住在杭州西湖边", "下周三要去北京出差", "对花生过敏", "每天早上七点起床",
+             "在学习 Python 和 FastAPI", "养了一只叫豆豆的狗", "最近在准备考研", "生日是十月二十号"]
+    filler = "今天 明天 天气 怎么样 帮我 看看 一下 还有 那个 电机 传感器 语音".split()
+    return rng.choice(subjects) + rng.choice(facts) + "，" + "".join(rng.choice(filler) for _ in range(rng.randint(3, 15)))
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as workdir:
+        MemoryConfig.DIR = workdir
+        import memory
+
+        sentences = [random_sentence(rng) for _ in range(2000)]
+        start = time.perf_counter()
+        for s in sentences:
+            memory.embed(s)
+        print(f"向量化: {(time.perf_counter() - start) / len(sentences) * 1000:.3f} ms/条 (DIM={MemoryConfig.DIM})")
+
+        for size in SIZES:
+            index = memory.UserMemoryIndex(f"bench-{size}")
+            start = time.perf_counter()
+            for i in range(size):
+                index.add(f"s-{i // 20}", "user", sentences[i % len(sentences)] + str(i))
+            add_ms = (time.perf_counter() - start) / size * 1000
+
+            queries = [random_sentence(rng) for _ in range(QUERIES)]
+            start = time.perf_counter()
+            for q in queries:
+                results = index.search(q, MemoryConfig.TOP_K)
+            search_ms = (time.perf_counter() - start) / QUERIES * 1000
+            print(f"{size:6d} 条: 追加 {add_ms:.3f} ms/条，检索 top-{MemoryConfig.TOP_K} {search_ms:.2f} ms/次")
+
+        print("示例:", queries[-1], "->", [r["text"][:20] for r in results])
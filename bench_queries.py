@@ -0,0 +1,192 @@
+# bench_queries.py
+# 存储层查询微基准：对 gen_dataset.py 生成的数据集逐个调用 server.py 的接口，
+# 统计耗时（其中数据库耗时和查询次数取自 Server-Timing），并对接口发出的每条 SQL 执行 EXPLAIN QUERY PLAN，
+# 标出全表扫描和临时 B 树排序，方便用数字比较索引和表结构的改动。
+#
+# 用法：
+#   python bench_queries.py --db bench_data/robot.db --rounds 5
+#   python bench_queries.py --db bench_data/robot.db --json before.json
+#   python bench_queries.py --db bench_data/robot.db --destructive   # 额外测量删除路径（会修改数据集）
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+
+def _percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def _server_timing(header: str):
+    """从 Server-Timing 中取出数据库耗时和查询次数"""
+    match = re.search(r'db;dur=([\d.]+);desc="(\d+) queries"', header or "")
+    return (float(match.group(1)), int(match.group(2))) if match else (0.0, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="存储层查询微基准")
+    parser.add_argument("--db", default="bench_data/robot.db", help="gen_dataset.py 生成的数据集")
+    parser.add_argument("--rounds", type=int, default=5, help="每个用例的测量轮数（另有一轮预热）")
+    parser.add_argument("--json", help="把结果写入 JSON 文件，便于前后对比")
+    parser.add_argument("--no-plans", action="store_true", help="不输出查询计划")
+    parser.add_argument("--destructive", action="store_true", help="同时测量删除路径（会删除数据集中的会话）")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"[Bench] 找不到 {args.db}，请先运行 gen_dataset.py")
+        return 1
+
+    # 必须在导入 server 之前设置：数据库位置、使用模拟 LLM、关闭限流 / 长期记忆 / 语音等无关开销
+    os.environ["ROBOT_DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.environ["LLM_PROVIDER"] = "mock"
+    import config
+    config.RateLimitConfig.ENABLED = False
+    config.MemoryConfig.ENABLED = False
+    config.SpeechConfig.ENABLED = False
+    config.ProfilingConfig.SERVER_TIMING = True
+
+    import database
+    from sqlalchemy import event, text
+    engines = list({id(e): e for e in [database.engine, *database.shard_engines]}.values())
+    for e in engines:
+        e.echo = False
+
+    captured = []
+    capturing = [False]
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if capturing[0] and not executemany:
+            captured.append((conn.engine, statement, parameters))
+
+    for e in engines:
+        event.listen(e, "before_cursor_execute", capture)
+
+    from fastapi.testclient import TestClient
+    import server
+
+    with database.engine.connect() as conn:
+        sessions = conn.execute(text(
+            "SELECT session_id, message_count FROM chat_sessions WHERE deleted = 0 ORDER BY message_count DESC"
+        )).all()
+        owner = conn.execute(text(
+            "SELECT user_id FROM chat_sessions WHERE session_id = :sid"), {"sid": sessions[0][0]}
+        ).scalar() if sessions else None
+    if not sessions:
+        print("[Bench] 数据集中没有会话")
+        return 1
+    largest, _ = sessions[0]
+    # 最长会话中间位置的消息ID，作为向前翻页的游标
+    with database.shard_engines[database.router.shard_for(largest)].connect() as conn:
+        ids = conn.execute(text(
+            "SELECT id FROM chat_messages WHERE session_id = :sid ORDER BY id"), {"sid": largest}
+        ).scalars().all()
+    largest_mid_id = ids[len(ids) // 2]
+    median, _ = sessions[len(sessions) // 2]
+    total_messages = sum(count for _, count in sessions)
+    print(f"[Bench] 数据集: {len(sessions)} 个会话，{total_messages} 条消息；"
+          f"最长会话 {sessions[0][1]} 条，中位数 {sessions[len(sessions) // 2][1]} 条")
+
+    # (名称, 方法, 路径或每轮生成路径的函数, 请求体)
+    cases = [
+        ("会话列表 按最近活跃", "GET", "/api/sessions?page=1&page_size=20", None),
+        ("会话列表 按消息数", "GET", "/api/sessions?page=1&page_size=20&sort_by=message_count", None),
+        ("会话列表 深分页", "GET", "/api/sessions?page=200&page_size=20", None),
+        ("会话统计", "GET", "/api/sessions/stats", None),
+        ("单个用户 会话列表", "GET", f"/api/users/{owner}/sessions?page=1&page_size=20", None),
+        ("单个用户 统计", "GET", f"/api/users/{owner}/stats", None),
+        ("消息 最长会话", "GET", f"/api/sessions/{largest}/messages?limit=100", None),
+        ("消息 中位会话", "GET", f"/api/sessions/{median}/messages?limit=100", None),
+        ("消息 最长会话 最新一页", "GET", f"/api/sessions/{largest}/messages?limit=50&tail=true", None),
+        ("消息 最长会话 向前翻页", "GET", f"/api/sessions/{largest}/messages?limit=50&before_id={largest_mid_id}", None),
+        ("会话摘要", "GET", f"/api/sessions/{largest}/summary", None),
+        # 对话路径包含历史窗口查询和两次写入，每轮向最长会话追加 2 条消息
+        ("对话 最长会话", "POST", "/api/chat", {"message": "bench", "session_id": largest}),
+    ]
+    if args.destructive:
+        victims = iter(sid for sid, _ in reversed(sessions[1:]))
+        cases.append(("删除单个会话", "DELETE", lambda: f"/api/sessions/{next(victims)}", None))
+
+    results = []
+    with TestClient(server.app) as client:
+        for name, method, path, body in cases:
+            times, db_times, queries = [], [], 0
+            for round_index in range(args.rounds + 1):
+                url = path() if callable(path) else path
+                # 只记录最后一轮发出的 SQL
+                capturing[0] = round_index == args.rounds
+                if capturing[0]:
+                    captured.clear()
+                start = time.perf_counter()
+                response = client.request(method, url, json=body)
+                elapsed = (time.perf_counter() - start) * 1000
+                capturing[0] = False
+                if response.status_code >= 400:
+                    print(f"[Bench] {name}: HTTP {response.status_code} {response.text[:200]}")
+                    break
+                if round_index == 0:
+                    continue  # 预热
+                db_ms, queries = _server_timing(response.headers.get("server-timing"))
+                times.append(elapsed)
+                db_times.append(db_ms)
+            if not times:
+                continue
+
+            plans = []
+            seen = set()
+            for e, statement, parameters in list(captured):
+                if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")) or statement in seen:
+                    continue
+                seen.add(statement)
+                with e.connect() as conn:
+                    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).all()
+                plans.append({"sql": " ".join(statement.split()), "plan": [row[-1] for row in rows]})
+
+            results.append({
+                "name": name,
+                "p50_ms": round(_percentile(times, 0.5), 2),
+                "p95_ms": round(_percentile(times, 0.95), 2),
+                "db_ms": round(_percentile(db_times, 0.5), 2),
+                "queries": queries,
+                "plans": plans
+            })
+
+        if args.destructive:
+            start = time.perf_counter()
+            response = client.delete("/api/sessions", params={
+                "action": "keep_latest", "keep_latest": len(sessions) // 2, "confirm": "CONFIRM_DELETE"})
+            db_ms, queries = _server_timing(response.headers.get("server-timing"))
+            results.append({"name": "保留最近一半会话（单轮）",
+                            "p50_ms": round((time.perf_counter() - start) * 1000, 2),
+                            "p95_ms": None, "db_ms": db_ms, "queries": queries, "plans": []})
+
+    print(f"\n{'用例':<24} {'p50(ms)':>10} {'p95(ms)':>10} {'数据库(ms)':>10} {'查询数':>6}")
+    for r in results:
+        p95 = f"{r['p95_ms']:>10.1f}" if r["p95_ms"] is not None else f"{'-':>10}"
+        print(f"{r['name']:<24} {r['p50_ms']:>10.1f} {p95} {r['db_ms']:>10.1f} {r['queries']:>6}")
+
+    if not args.no_plans:
+        for r in results:
+            if not r["plans"]:
+                continue
+            print(f"\n== {r['name']}")
+            for p in r["plans"]:
+                print(f"  {p['sql'][:160]}")
+                for step in p["plan"]:
+                    # 子查询结果（anon_N）上的 SCAN 不是表扫描
+                    full_scan = re.match(r"SCAN (?!anon_)\w+$", step)
+                    warn = "  <-- 全表扫描" if full_scan else ("  <-- 临时排序" if "TEMP B-TREE" in step else "")
+                    print(f"      {step}{warn}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"db": args.db, "sessions": len(sessions), "messages": total_messages,
+                       "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n[Bench] 结果已写入 {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+# bench_serialization.py
+# 对比大会话消息列表在不同序列化 / 压缩方式下的耗时和体积
+import json
+import random
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+import fast_response
+from config import ResponseConfig
+
+N_MESSAGES = 500
+REPLY_CHARS = 2000
+ROUNDS = 20
+
+
+def build_payload():
+    random.seed(0)
+    chars = "我们今天讨论一下机器人的语音模块和电机控制方案，包括传感器融合与路径规划。abcdefghij0123456789，。！？\n"
+    messages = []
+    for i in range(N_MESSAGES):
+        role = "user" if i % 2 == 0 else "assistant"
+        length = 60 if role == "user" else REPLY_CHARS
+        messages.append({
+            "id": i + 1,
+            "role": role,
+            "content": "".join(random.choice(chars) for _ in range(length)),
+            "session_id": "bench-session",
+            "created_at": "2026-01-01T12:00:00.000000"
+        })
+    return {"session_id": "bench-session", "messages": messages, "count": len(messages), "status": "success"}
+
+
+def timeit(fn):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        result = fn()
+    return (time.perf_counter() - start) / ROUNDS * 1000, result
+
+
+def main():
+    payload = build_payload()
+
+    # 改动前：路由返回 dict，FastAPI 先 jsonable_encoder 再用标准库 json 序列化
+    def baseline():
+        return json.dumps(jsonable_encoder(payload), ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+
+    # 改动后：直接返回 FastJSONResponse / MsgPackResponse，跳过 jsonable_encoder
+    def fast_json():
+        return fast_response.dumps(payload)
+
+    results = [("jsonable_encoder + json", *timeit(baseline)),
+               (f"fast json ({'orjson' if fast_response.orjson else 'json'})", *timeit(fast_json))]
+    if fast_response.msgpack:
+        results.append(("msgpack", *timeit(lambda: fast_response.msgpack.packb(payload, use_bin_type=True))))
+
+    print(f"负载: {N_MESSAGES} 条消息，助手回复约 {REPLY_CHARS} 字\n")
+    print(f"{'方式':<28}{'耗时(ms)':>10}{'体积(KB)':>12}")
+    for name, ms, body in results:
+        print(f"{name:<28}{ms:>10.2f}{len(body) / 1024:>12.1f}")
+
+    body = fast_json()
+    print()
+    ms, gz = timeit(lambda: fast_response.compress(body, "gzip"))
+    print(f"{'gzip -' + str(ResponseConfig.GZIP_LEVEL):<28}{ms:>10.2f}{len(gz) / 1024:>12.1f}")
+    if fast_response.brotli:
+        ms, br = timeit(lambda: fast_response.compress(body, "br"))
+        print(f"{'br q' + str(ResponseConfig.BROTLI_QUALITY):<28}{ms:>10.2f}{len(br) / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# bench_sharding.py
+# 测量 /api/chat 写入路径在不同分片数下的吞吐：多个 worker 进程模拟多台机器人同时对话，
+# 每轮走真实的 run_chat_turn（读历史、写用户消息、调用模拟AI、写回复），
+# 对比会话元数据逐条同步写主库与由 catalog_writer 在后台合并写入两种方式
+import asyncio
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+
+WORKERS = 4  # 相当于 uvicorn 的 worker 进程数
+CONCURRENCY = 4  # 每个 worker 同时处理的请求数
+SESSIONS_PER_WORKER = 16
+TURNS_PER_WORKER = 300
+SHARD_COUNTS = (1, 2, 4)
+
+
+def _setup(database_url, shard_count):
+    """在独立进程中按分片数导入配置并建表（分片数在导入 database 时确定）"""
+    os.environ["ROBOT_DATABASE_URL"] = database_url
+    os.environ["LLM_PROVIDER"] = "mock"
+    import config
+    config.ShardConfig.SHARD_COUNT = shard_count
+    config.ShardConfig.SHARD_URL_TEMPLATE = database_url[:-len(".db")] + "_shard_{index}.db"
+    config.MemoryConfig.ENABLED = False
+    config.SpeechConfig.ENABLED = False
+    import database
+    database.engine.echo = False
+    for shard_engine in database.shard_engines:
+        shard_engine.echo = False
+    return database
+
+
+def _init(database_url, shard_count):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _setup(database_url, shard_count).init_db()
+
+
+def _worker(database_url, shard_count, batched, start_event, results):
+    with contextlib.redirect_stdout(io.StringIO()):
+        database = _setup(database_url, shard_count)
+        from chat_service import run_chat_turn
+        from session_store import catalog_writer
+
+        user_id = f"robot-{uuid.uuid4().hex[:8]}"
+        sessions = [str(uuid.uuid4()) for _ in range(SESSIONS_PER_WORKER)]
+
+        async def turn(i):
+            shards = database.ShardSet()
+            try:
+                await run_chat_turn(shards, sessions[i % len(sessions)], f"你好 {i}", user_id=user_id)
+            finally:
+                shards.close()
+
+        async def client(offset):
+            for i in range(offset, TURNS_PER_WORKER, CONCURRENCY):
+                await turn(i)
+
+        async def main():
+            if batched:
+                catalog_writer.start()
+            start_event.wait()
+            start = time.perf_counter()
+            await asyncio.gather(*(client(c) for c in range(CONCURRENCY)))
+            await catalog_writer.stop()  # 计入最后一批元数据的写入
+            return time.perf_counter() - start
+
+        elapsed = asyncio.run(main())
+    results.put(elapsed)
+
+
+def run(shard_count, batched, workdir):
+    ctx = multiprocessing.get_context("spawn")
+    name = f"bench_{shard_count}_{'batched' if batched else 'sync'}"
+    database_url = f"sqlite:///{os.path.join(workdir, name)}.db"
+    init = ctx.Process(target=_init, args=(database_url, shard_count))
+    init.start()
+    init.join()
+
+    start_event = ctx.Event()
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_worker, args=(database_url, shard_count, batched, start_event, results))
+        for _ in range(WORKERS)
+    ]
+    for p in procs:
+        p.start()
+    time.sleep(3)  # 等所有 worker 完成导入
+
+    start = time.perf_counter()
+    start_event.set()
+    elapsed = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall = time.perf_counter() - start
+    # 每轮写入两条消息
+    return WORKERS * TURNS_PER_WORKER * 2 / max(wall, max(elapsed))
+
+
+if __name__ == "__main__":
+    print(f"{WORKERS} 个 worker 进程 x {CONCURRENCY} 个并发请求，每个 worker {TURNS_PER_WORKER} 轮对话")
+    with tempfile.TemporaryDirectory() as workdir:
+        baseline = None
+        for shard_count in SHARD_COUNTS:
+            for batched in (False, True):
+                throughput = run(shard_count, batched, workdir)
+                baseline = baseline or throughput
+                mode = "后台合并写元数据" if batched else "逐条同步写元数据"
+                print(f"{shard_count} 个分片, {mode}: {throughput:8.0f} 条消息/秒  ({throughput / baseline:.2f}x)")
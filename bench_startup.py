@@ -0,0 +1,50 @@
+# bench_startup.py
+# 比较 LLM 客户端模块在不同用法下的导入耗时和进程常驻内存（各场景在独立子进程中测量）
+import subprocess
+import sys
+
+ROUNDS = 5
+
+PROBE = """
+import resource, sys, time
+start = time.perf_counter()
+{code}
+elapsed = (time.perf_counter() - start) * 1000
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(f"{{elapsed:.1f}} {{rss:.1f}}")
+"""
+
+BASELINE = "import os, json, asyncio"
+
+SCENARIOS = [
+    ("空进程（只导入标准库）", BASELINE),
+    ("旧方式：模块导入时加载 httpx + openai",
+     BASELINE + "\nimport httpx\nfrom openai import AsyncOpenAI\nimport llm_client"),
+    ("新方式：只导入 llm_client", BASELINE + "\nimport llm_client"),
+    ("新方式：创建 mock 客户端", BASELINE + "\nimport llm_client\nllm_client.get_llm_client('mock')"),
+    ("新方式：创建 deepseek 客户端（加载 httpx）",
+     BASELINE + "\nimport os\nos.environ['DEEPSEEK_API_KEY'] = 'x'\nimport llm_client\nllm_client.get_llm_client('deepseek')"),
+    ("新方式：创建 mimo 客户端（加载 openai）",
+     BASELINE + "\nimport os\nos.environ['MIMO_API_KEY'] = 'x'\nimport llm_client\nllm_client.get_llm_client('mimo')"),
+]
+
+
+def measure(code):
+    times, rss = [], []
+    for _ in range(ROUNDS):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(code=code)],
+            capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        t, r = out.split()
+        times.append(float(t))
+        rss.append(float(r))
+    times.sort()
+    return times[len(times) // 2], max(rss)
+
+
+if __name__ == "__main__":
+    print(f"{'场景':<40} {'导入耗时(中位数)':>14} {'峰值RSS':>10}")
+    for label, code in SCENARIOS:
+        elapsed, rss = measure(code)
+        print(f"{label:<40} {elapsed:>11.1f} ms {rss:>7.1f} MB")
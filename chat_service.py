@@ -0,0 +1,277 @@
+# chat_service.py
+# 单轮对话的核心流程，HTTP 接口和 WebSocket 通道共用
+import asyncio
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import ShardSet, SessionLocal
+from models import ChatMessage, ChatSession, CancelledTurn
+from llm_client import get_llm_client, track_usage, LLMError
+from session_store import session_entry, catalog_writer
+from session_scheduler import scheduler, message_key, QueueTimeout
+from archive import rehydrate_session
+from config import MemoryConfig, DeadlineConfig
+from memory import long_term_memory, build_memory_message
+from prompt_cache import history_window_start, build_messages, cache_stats
+from speech import open_speech
+from profiling import timed
+from deadline import Deadline, DeadlineExceeded, current_deadline, set_deadline, reset_deadline
+from idempotency import idempotency_store
+
+
+
+def resolve_session_id(session_id: Optional[str], user_id: str = "default_user") -> str:
+    """优先使用 session_id，如果没有则使用 user_id；首次对话时生成新的会话ID"""
+    session_id = session_id or user_id
+
+    if session_id == "default_user" or session_id == "test":
+        session_id = str(uuid.uuid4())
+        print(f"[Session] 生成新会话ID: {session_id}")
+
+    return session_id
+
+
+def save_message(shards: ShardSet, message: ChatMessage, user_id: Optional[str] = None):
+    """
+    消息只在所属分片的事务中提交；主库中的会话元数据（新会话记录所属用户）
+    交给 catalog_writer 与其他消息合并后写入，不占用主库写锁
+    """
+    db = shards.for_session(message.session_id)
+    db.add(message)
+    db.commit()
+    catalog_writer.record(message, user_id)
+
+
+async def run_chat_turn(
+        shards: ShardSet,
+        session_id: str,
+        message: str,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+        user_id: str = "default_user",
+        deadline: Optional[Deadline] = None
+) -> dict:
+    """
+    执行一轮对话：读取历史和长期记忆、保存用户消息、调用AI、保存回复。
+    传入 on_chunk 时以流式方式调用AI，每收到一块回复就回调一次。
+
+    同一会话的轮次按提交顺序串行执行，不同会话并行；
+    同一会话中内容相同、仍在进行中的重复提交共享同一个结果，只调用一次AI。
+
+    整轮（含排队）受 deadline 限制，未指定时使用请求级时限或 DeadlineConfig.CHAT_TIMEOUT；
+    超时抛出 DeadlineExceeded。超时或被取消时未完成的回复记入 cancelled_turns，不保存为AI消息。
+    """
+    deadline = deadline or current_deadline() or Deadline(DeadlineConfig.CHAT_TIMEOUT)
+    token = set_deadline(deadline)
+    queued_at = time.perf_counter()
+    try:
+        # 排队等会话锁的时间也受时限约束，前一轮迟迟不结束时按时返回
+        return await scheduler.submit(
+            session_id,
+            message_key(message),
+            lambda: _run_chat_turn(shards, session_id, message, on_chunk, user_id, deadline),
+            timeout=deadline.remaining()
+        )
+    except QueueTimeout:
+        record_cancellation(session_id, "deadline", "queued", "", queued_at)
+        raise DeadlineExceeded("queued")
+    finally:
+        reset_deadline(token)
+
+
+async def run_keyed_chat_turn(
+        idempotency_key: str,
+        session_id: str,
+        message: str,
+        user_id: str = "default_user",
+        requested_session_id: Optional[str] = None
+) -> Tuple[dict, bool]:
+    """
+    带 Idempotency-Key 的一轮对话，返回 (结果, 是否为重放)。
+    同一个键只调用一次AI；这一轮使用自己的数据库会话，发起请求的客户端断开后也会执行完并保存结果，
+    重试直接拿到保存的响应，不会重复写入消息。
+    """
+    async def turn():
+        shards = ShardSet()
+        try:
+            return await run_chat_turn(shards, session_id, message, user_id=user_id)
+        except BaseException:
+            shards.rollback()
+            raise
+        finally:
+            shards.close()
+
+    # 摘要用客户端提交的 session_id（未指定时服务端每次会生成新的会话ID）
+    fingerprint = message_key(user_id, requested_session_id or "", message)
+    return await idempotency_store.run(user_id, idempotency_key, fingerprint, turn)
+
+
+async def _run_chat_turn(
+        shards: ShardSet,
+        session_id: str,
+        message: str,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None,
+        user_id: str = "default_user",
+        deadline: Optional[Deadline] = None
+) -> dict:
+    turn_start = time.perf_counter()
+    deadline = deadline or Deadline(DeadlineConfig.CHAT_TIMEOUT)
+    # 在会话队列中等待的时间也计入时限，已超时就不再调用AI
+    try:
+        deadline.check("queued")
+    except DeadlineExceeded:
+        record_cancellation(session_id, "deadline", "queued", "", turn_start)
+        raise
+
+    db = shards.for_session(session_id)
+    session_messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+
+    total = session_messages.count()
+
+    # 没有热数据时可能是已归档的冷会话，先还原再继续对话
+    if total == 0 and rehydrate_session(shards, session_id):
+        total = session_messages.count()
+
+    # 查询历史窗口内的消息（按时间正序排列），窗口起点按块对齐，保持请求前缀稳定
+    history_messages = session_messages \
+        .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()) \
+        .offset(history_window_start(total)) \
+        .all()
+
+    # 长期记忆：检索与当前消息相关、但不在近期上下文中的历史消息
+    memory_message = recall_memories(user_id, message, history_messages, session_id)
+
+    # 固定系统提示 + 只追加的历史 + 本轮记忆和用户消息
+    messages_for_ai = build_messages(history_messages, message, memory_message)
+
+    print(f"[Context] 会话ID: {session_id}, 准备 {len(messages_for_ai)} 条上下文消息。")
+
+    # 保存用户消息到数据库
+    user_msg = ChatMessage(
+        session_id=session_id,
+        role="user",
+        content=message,
+        created_at=datetime.utcnow()
+    )
+    save_message(shards, user_msg, user_id)
+    if long_term_memory is not None:
+        long_term_memory.remember(user_id, session_id, "user", message, user_msg.created_at.isoformat())
+
+    # 调用AI获取回复
+    print(f"[LLM] 调用AI，消息数量: {len(messages_for_ai)}")
+    print(f"[LLM] 最后一条用户消息: {message}")
+
+    client = get_llm_client()
+    usage = track_usage()
+    llm_start = time.perf_counter()
+
+    # 语音输出需要边生成边切句，启用时即使调用方不需要流式回复也走流式接口
+    speech = open_speech(session_id)
+    parts = []
+
+    async def emit(delta: str):
+        parts.append(delta)
+        if speech is not None:
+            speech.feed(delta)
+        if on_chunk is not None:
+            await on_chunk(delta)
+
+    async def call_llm():
+        # 提供者调用失败时把提示作为回复（流式时作为最后一块）返回给用户
+        try:
+            if on_chunk is None and speech is None:
+                return await client.chat(messages_for_ai)
+            async for delta in client.stream_chat(messages_for_ai):
+                await emit(delta)
+        except LLMError as e:
+            if on_chunk is None and speech is None:
+                return str(e)
+            await emit(str(e))
+        return "".join(parts)
+
+    # 超时或被取消（客户端断开等）时立即放弃上游请求，不完整的回复不保存为AI消息
+    try:
+        with timed("llm"):
+            ai_reply = await asyncio.wait_for(call_llm(), deadline.remaining())
+    except asyncio.TimeoutError:
+        record_cancellation(session_id, "deadline", "llm", "".join(parts), turn_start)
+        raise DeadlineExceeded("llm")
+    except asyncio.CancelledError as e:
+        reason = str(e.args[0]) if e.args and e.args[0] else "cancelled"
+        record_cancellation(session_id, reason, "llm", "".join(parts), turn_start)
+        raise
+    finally:
+        if speech is not None:
+            speech.close()
+    cache_stats.record(session_id, usage or None, (time.perf_counter() - llm_start) * 1000)
+
+    print(f"[LLM] AI回复长度: {len(ai_reply)} 字符")
+    print(f"[LLM] AI回复前200字符: {ai_reply[:200]}")
+
+    # 保存AI回复
+    ai_msg = ChatMessage(
+        session_id=session_id,
+        role="assistant",
+        content=ai_reply,
+        created_at=datetime.utcnow()
+    )
+    save_message(shards, ai_msg, user_id)
+
+    return {
+        "reply": ai_reply,
+        "session_id": session_id,
+        "history_length": len(history_messages) + 2,
+        "status": "success",
+        "reply_length": len(ai_reply)  # 添加回复长度便于调试
+    }
+
+
+def record_cancellation(session_id: str, reason: str, stage: str, partial_reply: str, started: float):
+    """记录被取消 / 超时的轮次；使用独立的数据库会话，不受本轮未提交状态影响"""
+    db = SessionLocal()
+    try:
+        db.add(CancelledTurn(
+            session_id=session_id,
+            reason=reason[:20],
+            stage=stage,
+            partial_reply=partial_reply or None,
+            elapsed_ms=int((time.perf_counter() - started) * 1000),
+            created_at=datetime.utcnow()
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"[Cancel] 记录取消失败: {type(e).__name__}: {e}")
+    finally:
+        db.close()
+    print(f"[Cancel] 会话 {session_id} 的对话已终止（{reason}，阶段 {stage}，已生成 {len(partial_reply)} 字符）")
+
+
+def recall_memories(user_id: str, message: str, history_messages,
+                    session_id: Optional[str] = None) -> Optional[dict]:
+    """检索长期记忆并拼成一条 system 消息（删除会话时其记忆已从索引中清除）"""
+    if long_term_memory is None:
+        return None
+
+    start = time.perf_counter()
+    candidates = long_term_memory.recall(
+        user_id, message,
+        exclude_texts={msg.content for msg in history_messages} | {message},
+        k=MemoryConfig.TOP_K,
+        session_id=session_id
+    )
+
+    memory_message = build_memory_message(candidates)
+    print(f"[Memory] 检索到 {len(candidates)} 条相关记忆，耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+    return memory_message
+
+
+def get_session_entry(db: Session, session_id: str) -> Optional[dict]:
+    """获取单个会话在会话列表中的条目，格式与 /api/sessions 一致"""
+    meta = db.get(ChatSession, session_id)
+    if meta is None or meta.deleted:
+        return None
+    return {**session_entry(meta), "change_seq": meta.change_seq}
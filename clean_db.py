@@ -1,18 +1,12 @@
 # clean_db.py
-from database import SessionLocal
-from models import ChatMessage
+# 兼容旧用法，实际由 admin.py clean 分批执行
+import admin
+
 
 def clean_test_data():
-    db = SessionLocal()
-    try:
-        # 删除所有会话ID为'test'或'default_user'的记录
-        count = db.query(ChatMessage)\
-            .filter(ChatMessage.session_id.in_(['test', 'default_user']))\
-            .delete()
-        db.commit()
-        print(f"已删除 {count} 条测试记录")
-    finally:
-        db.close()
+    # 删除所有会话ID为'test'或'default_user'的记录
+    admin.main(["clean", "--sessions", "test", "default_user"])
+
 
 if __name__ == "__main__":
-    clean_test_data()
\ No newline at end of file
+    clean_test_data()
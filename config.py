@@ -24,4 +24,295 @@ class SessionConfig:
     MAX_SESSIONS = 100
 
     # 最大消息数量限制
-    MAX_MESSAGES_PER_SESSION = 1000
\ No newline at end of file
+    MAX_MESSAGES_PER_SESSION = 1000
+
+    # 批量获取会话摘要时单次请求的最大会话数
+    MAX_SUMMARY_BATCH = 200
+
+    # 消息写入后，会话元数据在后台合并写入主库：最长间隔（秒）和触发立即写入的待写会话数
+    CATALOG_FLUSH_INTERVAL = 0.05
+    CATALOG_FLUSH_SIZE = 200
+
+
+class WebSocketConfig:
+    # 服务端发送心跳的间隔（秒）
+    HEARTBEAT_INTERVAL = 15
+
+    # 超过该时间没有收到客户端任何消息则断开（秒）
+    HEARTBEAT_TIMEOUT = 45
+
+    # 断线后保留通道以便重连续传的时间（秒）
+    RESUME_TTL = 120
+
+    # 每个通道保留用于重放的最近事件数
+    REPLAY_BUFFER_SIZE = 500
+
+    # 每个连接的发送队列长度，队列满即视为慢客户端
+    SEND_QUEUE_SIZE = 256
+
+    # 发送队列持续满载超过该时间则断开慢客户端（秒）
+    SEND_TIMEOUT = 10
+
+    # 每个连接同时进行的对话轮数上限
+    MAX_INFLIGHT_TURNS = 2
+
+
+class ChangeFeedConfig:
+    # 长轮询最长等待时间（秒）
+    MAX_WAIT_SECONDS = 30
+
+    # 长轮询期间检查数据库的间隔（秒），用于感知其他 worker 的写入
+    POLL_INTERVAL = 1.0
+
+    # 单次返回的最大变更数
+    MAX_CHANGES = 500
+
+    # 已删除会话墓碑的保留时间（天）
+    TOMBSTONE_RETENTION_DAYS = 7
+
+    # 后台清理过期墓碑的间隔（秒），0 表示不自动清理
+    TOMBSTONE_PRUNE_INTERVAL = 3600
+
+
+class HttpCacheConfig:
+    # 可被缓存的 GET 接口的 Cache-Control：允许反向代理缓存，但每次使用前必须带 If-None-Match 回源验证
+    CACHE_CONTROL = "public, no-cache"
+
+    # 响应内容随这些请求头变化（Accept 用于 MessagePack 内容协商）
+    VARY = "Accept, Accept-Encoding"
+
+    # 响应格式变化时递增，使旧的 ETag 全部失效
+    ETAG_VERSION = 1
+
+
+class ResponseConfig:
+    # 小于该字节数的响应不压缩（压缩收益抵不过开销）
+    COMPRESS_MIN_SIZE = 1024
+
+    # gzip 压缩级别（1-9）；对 1MB 级的消息列表，3 级体积接近 6 级而耗时约为其三分之一
+    GZIP_LEVEL = 3
+
+    # brotli 压缩质量（0-11），偏向速度
+    BROTLI_QUALITY = 3
+
+    # 值得压缩的内容类型前缀
+    COMPRESSIBLE_TYPES = ("application/json", "application/x-msgpack", "text/")
+
+
+class RateLimitConfig:
+    # 是否启用限流
+    ENABLED = True
+
+    # 令牌桶存储："sqlite" 为多 worker 共享（文件锁），"memory" 仅在单进程内有效
+    BACKEND = "sqlite"
+
+    # 共享令牌桶所用的 SQLite 文件
+    SQLITE_PATH = "./ratelimit.db"
+
+    # 需要限流的接口（POST）
+    PATHS = ["/api/chat"]
+
+    # 各维度的令牌桶：capacity 为突发上限，per_seconds 内补满
+    RULES = {
+        "ip": {"capacity": 60, "per_seconds": 60},
+        "user": {"capacity": 30, "per_seconds": 60},
+        "session": {"capacity": 10, "per_seconds": 60},
+    }
+
+    # 是否信任反向代理传入的 X-Forwarded-For
+    TRUST_FORWARDED_FOR = False
+
+    # 内存后端最多保留的令牌桶数量
+    MEMORY_MAX_KEYS = 100000
+
+    # SQLite 后端定期删除长时间未使用的桶（超过最长补满时间后与新桶无异）：清理间隔和闲置时间（秒）
+    PURGE_INTERVAL = 600
+    PURGE_IDLE_SECONDS = 3600
+
+
+class ShardConfig:
+    # 消息分片数量；为 1 时所有数据都在主库 robot.db 中
+    SHARD_COUNT = 1
+
+    # 分片数据库文件模板（SHARD_COUNT > 1 时使用）
+    SHARD_URL_TEMPLATE = "sqlite:///./robot_shard_{index}.db"
+
+    # 一致性哈希环上每个分片的虚拟节点数
+    VIRTUAL_NODES = 64
+
+    # 使用 WAL 日志模式，读写互不阻塞
+    USE_WAL = True
+
+
+class ArchiveConfig:
+    # 最后活跃时间早于该天数的会话视为冷会话，可以归档
+    INACTIVE_DAYS = 1
+
+    # 压缩算法："zstd"（需安装 zstandard，未安装时回退到 zlib）或 "zlib"
+    CODEC = "zstd"
+    ZSTD_LEVEL = 9
+    ZLIB_LEVEL = 6
+
+    # 每轮最多归档的会话数，避免长时间占用写锁
+    BATCH_SIZE = 200
+
+    # 后台自动归档的间隔（秒），0 表示不自动归档，只通过 archive.py 手动执行
+    AUTO_ARCHIVE_INTERVAL = 0
+
+
+class MemoryConfig:
+    # 是否启用长期记忆检索
+    ENABLED = True
+
+    # 向量索引存放目录（每个用户一个 .vec 向量文件和一个 .jsonl 元数据文件）
+    DIR = "./memory"
+
+    # 哈希 n-gram 向量维度和使用的 n（中文按字切分，1~3 字组合）
+    DIM = 512
+    NGRAM_RANGE = (1, 3)
+
+    # 建立索引的消息角色
+    INDEX_ROLES = ("user",)
+
+    # 未指定 user_id 的客户端共用的默认用户，其索引只在当前会话内检索
+    SHARED_USER_ID = "default_user"
+
+    # 检索条数、最低相似度和注入上下文的 token 预算
+    TOP_K = 3
+    MIN_SCORE = 0.3
+    TOKEN_BUDGET = 300
+
+    # 向量文件初始容量（条），写满后按倍数扩容
+    INITIAL_CAPACITY = 1024
+
+
+class PromptConfig:
+    # 固定的系统提示和人设，每轮都放在最前面，保证请求前缀稳定以命中服务端前缀缓存
+    SYSTEM_PROMPT = "你是一个友好的AI助手，请直接回答用户的问题，保持对话自然流畅。"
+    PERSONA = ""
+
+    # 至少保留的最近历史消息数
+    MIN_HISTORY_MESSAGES = 6
+
+    # 历史窗口起点按该消息数对齐跳动，窗口内只追加，前缀在若干轮内保持不变
+    HISTORY_BLOCK = 6
+
+    # 缓存命中的输入 token 单价相对未命中的比例，用于估算节省的输入费用
+    CACHE_HIT_PRICE_RATIO = 0.1
+
+    # 内存中保留缓存统计的会话数上限
+    MAX_TRACKED_SESSIONS = 10000
+
+
+class SpeechConfig:
+    # 是否把回复切成句子送给语音输出（TTS）。启用后非流式请求也会改走流式接口，
+    # 默认关闭，接入语音输出端（或需要用 null 输出端测量切句延迟）时再打开
+    ENABLED = False
+
+    # 语音输出：null（丢弃，只统计延迟）或 file（写入本地文件，便于调试）
+    SINK = "null"
+    FILE_DIR = "./speech_out"
+
+    # 句子过短时与下一句合并，过长时在逗号等次级标点处提前切开
+    MIN_SEGMENT_CHARS = 2
+    MAX_SEGMENT_CHARS = 80
+
+    # 内存中保留的最近延迟样本数
+    STATS_WINDOW = 1000
+
+
+class LLMConfig:
+    # 未设置环境变量 LLM_PROVIDER 时使用的提供者
+    DEFAULT_PROVIDER = "deepseek"
+
+    # 第三方提供者插件注册所用的 entry point 组名，值为 "模块:类"
+    ENTRY_POINT_GROUP = "ai_desktop_robot.llm_providers"
+
+    # 各提供者的默认参数，构造客户端时传入
+    PROVIDERS = {
+        "deepseek": {
+            "model": "deepseek-chat",
+            "base_url": "https://api.deepseek.com/v1/chat/completions",
+            "max_tokens": 2000,
+            "temperature": 0.7,
+            "timeout": 60.0,
+        },
+        "mimo": {
+            "model": "mimo-v2-flash",
+            "base_url": "https://api.xiaomimimo.com/v1",
+            "max_tokens": 2000,
+            "temperature": 0.8,
+            "top_p": 0.95,
+        },
+        "mock": {},
+    }
+
+
+class ProfilingConfig:
+    # 每个响应都带 Server-Timing 头（数据库耗时 / 查询次数、LLM、序列化）。
+    # 耗时会暴露给所有客户端，默认关闭；关闭时只有开启了 cProfile 的请求（见下）才带这个头
+    SERVER_TIMING = False
+
+    # 是否允许按请求开启 cProfile（请求头 X-Profile: 1 或查询参数 ?profile=1）
+    ALLOW_PROFILING = False
+
+    # 设置后请求头 / 查询参数的值必须等于该令牌才会开启 cProfile
+    TOKEN = None
+
+    # cProfile 结果（.prof，可用 snakeviz / pstats 查看）保存目录
+    DIR = "./profiles"
+
+
+class BatchConfig:
+    # 单个任务最多包含的提示词数
+    MAX_ITEMS = 10000
+
+    # 并发调用 LLM 的 worker 数（所有批量任务共享）
+    WORKERS = 4
+
+    # 有交互式对话正在进行时，批量任务最多同时处理的条数（让出优先级）
+    WORKERS_WHEN_BUSY = 1
+
+    # 结果攒够多少条或隔多少秒批量写入一次数据库
+    FLUSH_SIZE = 50
+    FLUSH_INTERVAL = 2.0
+
+    # 单条提示词的 LLM 调用超时（秒）
+    ITEM_TIMEOUT = 120
+
+    # 任务租约时长（秒）：执行中的进程每隔三分之一租约续期一次；
+    # 进程退出后租约过期，其他进程（或重启后的进程）才会接手未完成的条目
+    LEASE_SECONDS = 60
+
+
+class DeadlineConfig:
+    # 客户端可以用这个请求头指定本次请求的总时限（秒）
+    HEADER = "x-request-timeout"
+
+    # 未指定时限时，一轮对话（排队 + 数据库 + LLM）的默认时限（秒）
+    CHAT_TIMEOUT = 90.0
+
+    # 客户端指定的时限上限（秒）
+    MAX_TIMEOUT = 300.0
+
+    # SQLite 默认的锁等待时间（秒）；有时限的请求会缩短到剩余时间以内
+    DB_BUSY_TIMEOUT = 5.0
+
+    # 检测 HTTP 客户端断开后取消正在进行的对话
+    CANCEL_ON_DISCONNECT = True
+
+
+class IdempotencyConfig:
+    # 客户端重试同一条消息时带上相同的请求头，服务端只调用一次AI
+    HEADER = "idempotency-key"
+    MAX_KEY_LENGTH = 255
+
+    # 已完成请求的响应保留多久（秒），期间的重试直接重放
+    TTL_SECONDS = 24 * 3600
+
+    # 其他 worker 正在处理的键超过这个时间仍未完成，视为该 worker 已退出，允许接管（秒）
+    PROCESSING_TIMEOUT = 300
+
+    # 过期记录的清理间隔（秒）和每次最多删除的行数
+    PURGE_INTERVAL = 60
+    PURGE_BATCH = 1000
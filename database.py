@@ -1,20 +1,58 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from models import Base  # 从models导入Base
+import asyncio
+import os
+from typing import Callable, Dict, List
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, Session
+from starlette.concurrency import run_in_threadpool
+
+from models import Base, ChatMessage, ChatSession, ArchivedSession, BatchJob  # 从models导入Base
+from config import ShardConfig
+from sharding import ShardRouter, shard_url
+
+# SQLite数据库路径（可用环境变量 ROBOT_DATABASE_URL 指向其他库，例如压测数据集）
+DATABASE_URL = os.getenv("ROBOT_DATABASE_URL", "sqlite:///./robot.db")
+
+# 只存放在消息分片中的表，其余表（会话元数据等）都在主库
+SHARDED_TABLES = [ChatMessage.__table__, ArchivedSession.__table__]
+
+
+def _create_engine(url: str, echo: bool):
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        echo=echo
+    )
+
+    if ShardConfig.USE_WAL:
+        @event.listens_for(new_engine, "connect")
+        def _set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    return new_engine
 
-# SQLite数据库路径
-DATABASE_URL = "sqlite:///./robot.db"
 
 # 创建数据库引擎
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-    echo=True  # 设置为False可以减少日志输出
-)
+engine = _create_engine(DATABASE_URL, echo=True)  # 设置为False可以减少日志输出
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 消息分片：单分片时与主库共用同一个引擎
+router = ShardRouter(ShardConfig.SHARD_COUNT)
+shard_engines = [
+    engine if ShardConfig.SHARD_COUNT == 1 else _create_engine(
+        shard_url(i, ShardConfig.SHARD_COUNT, DATABASE_URL), echo=engine.echo)
+    for i in range(ShardConfig.SHARD_COUNT)
+]
+ShardSessionLocal = [
+    sessionmaker(autocommit=False, autoflush=False, bind=e) for e in shard_engines
+]
+
+
 def get_db():
     """依赖注入，获取数据库会话"""
     db = SessionLocal()
@@ -23,7 +61,125 @@ def get_db():
     finally:
         db.close()
 
+
+class ShardSet:
+    """
+    一次请求用到的数据库会话集合：主库（catalog）加按需打开的消息分片。
+    单分片时分片会话就是主库会话。
+    """
+
+    def __init__(self, catalog: Session = None):
+        self.catalog = catalog or SessionLocal()
+        self._shards: Dict[int, Session] = {}
+
+    @property
+    def count(self) -> int:
+        return ShardConfig.SHARD_COUNT
+
+    def shard(self, index: int) -> Session:
+        if shard_engines[index] is engine:
+            return self.catalog
+        db = self._shards.get(index)
+        if db is None:
+            db = self._shards[index] = ShardSessionLocal[index]()
+        return db
+
+    def for_session(self, session_id: str) -> Session:
+        return self.shard(router.shard_for(session_id))
+
+    def commit(self):
+        """先提交各分片，再提交主库元数据；元数据提交失败时可由 backfill 修复"""
+        for db in self._shards.values():
+            db.commit()
+        self.catalog.commit()
+
+    def rollback(self):
+        for db in self._shards.values():
+            db.rollback()
+        self.catalog.rollback()
+
+    def close(self):
+        for db in self._shards.values():
+            db.close()
+        self._shards.clear()
+        self.catalog.close()
+
+    async def _gather(self, jobs: Dict[int, Callable[[Session], object]]) -> List:
+        if self.count == 1:
+            # 单分片直接使用主库会话，由调用方决定何时提交
+            return [job(self.catalog) for job in jobs.values()]
+
+        def run(index: int, job):
+            db = ShardSessionLocal[index]()
+            try:
+                result = job(db)
+                db.commit()
+                return result
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+
+        return list(await asyncio.gather(
+            *(run_in_threadpool(run, index, job) for index, job in jobs.items())
+        ))
+
+    async def scatter(self, fn: Callable[[Session], object]) -> List:
+        """
+        在所有分片上并发执行 fn(db)，返回按分片顺序排列的结果。
+        多分片时每个分片在线程池中使用独立的会话，fn 内的写操作在返回后提交。
+        """
+        return await self._gather({i: fn for i in range(self.count)})
+
+    async def scatter_by_session(self, session_ids, fn: Callable[[Session, List[str]], object]) -> List:
+        """把会话ID按分片分组，只在涉及的分片上并发执行 fn(db, 该分片的会话ID)"""
+        groups = router.group(session_ids)
+        return await self._gather({
+            i: (lambda db, ids=group: fn(db, ids))
+            for i, group in enumerate(groups) if group
+        })
+
+
+def get_shards():
+    """依赖注入，获取主库和消息分片的会话集合"""
+    shards = ShardSet()
+    try:
+        yield shards
+    finally:
+        shards.close()
+
+
+def add_missing_columns(target_engine, table):
+    """
+    create_all 不会修改已存在的表：为旧表补上模型中新增的（可为空的）列，并创建缺少的索引
+    """
+    with target_engine.begin() as conn:
+        existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=target_engine.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+                print(f"[Migrate] {table.name} 新增列 {column.name}")
+    for index in table.indexes:
+        index.create(target_engine, checkfirst=True)
+
+
 def init_db():
     """初始化数据库，创建所有表"""
     Base.metadata.create_all(bind=engine)
-    print("✅ 数据库表已初始化")
\ No newline at end of file
+    add_missing_columns(engine, ChatSession.__table__)
+    add_missing_columns(engine, BatchJob.__table__)
+    for shard_engine in shard_engines:
+        if shard_engine is not engine:
+            Base.metadata.create_all(bind=shard_engine, tables=SHARDED_TABLES)
+
+    # 为旧数据补建会话元数据
+    from session_store import backfill_sessions
+    shards = ShardSet()
+    try:
+        backfill_sessions(shards.catalog, [shards.shard(i) for i in range(shards.count)])
+    finally:
+        shards.close()
+
+    print("✅ 数据库表已初始化")
@@ -0,0 +1,141 @@
+# deadline.py
+# 端到端请求时限和取消：时限来自请求头或配置，数据库锁等待和 LLM 调用都压缩到剩余时间以内；
+# HTTP 客户端断开时取消正在进行的对话，不再等待上游 LLM
+import asyncio
+import contextvars
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+from config import DeadlineConfig
+
+
+class DeadlineExceeded(Exception):
+    """请求时限已到"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"请求超时（{stage}）")
+        self.stage = stage
+
+
+class ClientDisconnected(Exception):
+    """HTTP 客户端在回复完成前断开"""
+
+
+class Deadline:
+    """以单调时钟表示的截止时间"""
+
+    __slots__ = ("timeout", "expires_at")
+
+    def __init__(self, timeout: float):
+        self.timeout = min(max(timeout, 0.0), DeadlineConfig.MAX_TIMEOUT)
+        self.expires_at = time.monotonic() + self.timeout
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def check(self, stage: str):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded(stage)
+
+    def cap(self, seconds: float) -> float:
+        """把某一步自己的超时压缩到剩余时间以内"""
+        return min(seconds, self.remaining())
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+def set_deadline(deadline: Optional[Deadline]):
+    return _current.set(deadline)
+
+
+def reset_deadline(token):
+    _current.reset(token)
+
+
+def parse_timeout(value) -> Optional[float]:
+    """解析客户端给出的时限（秒），无效时返回 None"""
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout if timeout > 0 else None
+
+
+# 每次从连接池取出连接时，按当前请求的剩余时间设置 SQLite 的锁等待时间
+@event.listens_for(Pool, "checkout")
+def _apply_busy_timeout(dbapi_connection, connection_record, connection_proxy):
+    deadline = _current.get()
+    seconds = DeadlineConfig.DB_BUSY_TIMEOUT if deadline is None else deadline.cap(DeadlineConfig.DB_BUSY_TIMEOUT)
+    busy_ms = max(int(seconds * 1000), 1)
+    if connection_record.info.get("busy_timeout") != busy_ms:
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {busy_ms}")
+        cursor.close()
+        connection_record.info["busy_timeout"] = busy_ms
+
+
+class DeadlineMiddleware:
+    """请求带 X-Request-Timeout 时为整个请求建立时限（数据库锁等待随之缩短）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        value = dict(scope["headers"]).get(DeadlineConfig.HEADER.encode("latin-1"))
+        timeout = parse_timeout(value.decode("latin-1")) if value else None
+        if timeout is None:
+            await self.app(scope, receive, send)
+            return
+
+        token = _current.set(Deadline(timeout))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+
+async def _wait_for_disconnect(request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(request, coro):
+    """
+    执行 coro，同时监听客户端断开；断开时以 "disconnect" 为原因取消它并抛出 ClientDisconnected。
+    请求体必须已经读取完毕（路由参数解析之后调用）。
+    """
+    task = asyncio.ensure_future(coro)
+    if not DeadlineConfig.CANCEL_ON_DISCONNECT:
+        return await task
+
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if not task.done():
+        task.cancel("disconnect")
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+        raise ClientDisconnected()
+    return task.result()
@@ -0,0 +1,180 @@
+# fast_response.py
+# 更快的响应序列化（orjson / MessagePack）和按大小阈值的 gzip / br 压缩
+import gzip
+import json
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+from config import ResponseConfig
+from profiling import timed
+
+try:
+    import orjson
+except ImportError:  # 未安装时回退到标准库 json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MSGPACK_MEDIA_TYPES = ("application/x-msgpack", "application/msgpack")
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"无法序列化类型 {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """用 orjson 序列化的 JSON 响应，未安装 orjson 时使用紧凑的标准库输出"""
+
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return dumps(content)
+
+
+class MsgPackResponse(Response):
+    media_type = "application/x-msgpack"
+
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+def wants_msgpack(request: Request) -> bool:
+    accept = request.headers.get("accept", "")
+    return msgpack is not None and any(t in accept for t in MSGPACK_MEDIA_TYPES)
+
+
+def negotiate_response(request: Request, content, status_code: int = 200,
+                       headers: Optional[dict] = None) -> Response:
+    """
+    按 Accept 头选择 MessagePack 或 JSON。
+    直接返回 Response 对象，跳过 FastAPI 对返回值的 jsonable_encoder 遍历。
+    """
+    if wants_msgpack(request):
+        return MsgPackResponse(content, status_code=status_code, headers=headers)
+    return FastJSONResponse(content, status_code=status_code, headers=headers)
+
+
+def _parse_accept_encoding(header: str) -> dict:
+    encodings = {}
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        encodings[token.lower()] = q
+    return encodings
+
+
+def choose_encoding(header: str) -> Optional[str]:
+    """根据 Accept-Encoding 选择压缩算法，同等权重下优先 br"""
+    encodings = _parse_accept_encoding(header)
+    candidates = []
+    if brotli is not None and encodings.get("br", 0) > 0:
+        candidates.append((encodings["br"], 1, "br"))
+    if encodings.get("gzip", 0) > 0:
+        candidates.append((encodings["gzip"], 0, "gzip"))
+    if not candidates:
+        return None
+    return max(candidates)[2]
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=ResponseConfig.BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=ResponseConfig.GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    对超过阈值的完整响应体做 gzip / br 压缩。
+    流式响应（分多块发送）原样透传，避免缓冲和延迟。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict((k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"])
+        encoding = choose_encoding(headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            # http.response.body
+            body = message.get("body", b"")
+            response_headers = dict(
+                (k.decode("latin-1").lower(), v.decode("latin-1")) for k, v in start_message["headers"]
+            )
+            content_type = response_headers.get("content-type", "")
+
+            if (message.get("more_body", False)
+                    or "content-encoding" in response_headers
+                    or len(body) < ResponseConfig.COMPRESS_MIN_SIZE
+                    or not content_type.startswith(ResponseConfig.COMPRESSIBLE_TYPES)):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            with timed("compress"):
+                compressed = compress(body, encoding)
+            new_headers = [
+                (k, v) for k, v in start_message["headers"]
+                if k.lower() not in (b"content-length", b"vary")
+            ]
+            vary = response_headers.get("vary")
+            if vary and "accept-encoding" not in vary.lower():
+                vary = vary + ", Accept-Encoding"
+            new_headers += [
+                (b"content-encoding", encoding.encode("latin-1")),
+                (b"content-length", str(len(compressed)).encode("latin-1")),
+                (b"vary", (vary or "Accept-Encoding").encode("latin-1")),
+            ]
+            start_message["headers"] = new_headers
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
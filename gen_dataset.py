@@ -0,0 +1,181 @@
+# gen_dataset.py
+# 生成压测用的合成数据集：按对数正态分布的会话长度批量写入 chat_messages，并同步生成会话元数据。
+# 写入前先删除消息表的二级索引，写完再重建，千万级消息也能在几分钟内生成。
+# 多分片时按 ShardConfig 路由，分片文件位置由 SHARD_URL_TEMPLATE 决定。
+#
+# 用法（写入独立的库，不要指向正在使用的 robot.db）：
+#   python gen_dataset.py --db bench_data/robot.db --sessions 10000 --messages 10000000
+#   python bench_queries.py --db bench_data/robot.db
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+CHUNK = 50000
+
+USER_PHRASES = [
+    "你好", "今天天气怎么样", "帮我写一段 Python 代码", "解释一下这个错误", "讲个笑话吧",
+    "明天提醒我开会", "这个函数为什么这么慢", "推荐几本书", "翻译成英文", "总结一下上面的内容",
+    "what does this mean", "can you help me debug this", "谢谢", "再详细一点", "换一种说法",
+]
+ASSISTANT_PHRASES = [
+    "好的，我来帮你看一下。", "这是一个很好的问题。", "可以按照下面的步骤来做：",
+    "首先需要确认输入的数据格式是否正确。", "其次，检查数据库查询有没有用到索引。",
+    "如果还有问题，可以把完整的报错信息发给我。", "Here is a short example:",
+    "总的来说，这种写法更简洁，也更容易维护。", "希望这些信息对你有帮助！",
+]
+
+
+def _content_pool(rng: random.Random, phrases, min_parts, max_parts, size=2000):
+    """预先拼好一批长短不一的消息内容，生成时直接按下标取用"""
+    return [
+        "".join(rng.choice(phrases) for _ in range(rng.randint(min_parts, max_parts)))
+        for _ in range(size)
+    ]
+
+
+def _session_lengths(rng: random.Random, sessions: int, messages: int):
+    """对数正态分布的会话长度：多数会话很短，少数会话很长，总和约等于 messages"""
+    weights = [rng.lognormvariate(0, 1.2) for _ in range(sessions)]
+    scale = messages / sum(weights)
+    return [max(1, round(w * scale)) for w in weights]
+
+
+def _fmt(ts: datetime) -> str:
+    # 与 SQLAlchemy 在 SQLite 中保存 DateTime 的格式一致
+    return ts.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def generate(args):
+    os.environ["ROBOT_DATABASE_URL"] = f"sqlite:///{args.db}"
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+
+    import database
+    from models import ChatMessage
+    database.engine.echo = False
+    for shard_engine in database.shard_engines:
+        shard_engine.echo = False
+    database.init_db()
+
+    # 消息分布在各分片上，逐个分片统计
+    existing = 0
+    for shard_engine in database.shard_engines:
+        with shard_engine.connect() as conn:
+            existing += conn.exec_driver_sql("SELECT COUNT(*) FROM chat_messages").scalar()
+    if existing and not args.append:
+        print(f"[Dataset] {args.db} 已有 {existing} 条消息，加 --append 继续追加，或换一个文件")
+        return 1
+
+    rng = random.Random(f"{args.seed}-{existing}")  # 追加时换一组会话ID
+    user_pool = _content_pool(rng, USER_PHRASES, 1, 3)
+    assistant_pool = _content_pool(rng, ASSISTANT_PHRASES, 2, 12)
+    lengths = _session_lengths(rng, args.sessions, args.messages)
+    now = datetime.utcnow()
+
+    # 导入期间去掉二级索引、关闭同步写盘，完成后重建
+    indexes = list(ChatMessage.__table__.indexes)
+    conns = []
+    for shard_engine in database.shard_engines:
+        for index in indexes:
+            index.drop(shard_engine, checkfirst=True)
+        conn = shard_engine.raw_connection()
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -200000")
+        conns.append(conn)
+
+    catalog = database.engine.raw_connection()
+    with database.engine.connect() as conn:
+        seq = conn.exec_driver_sql("SELECT seq FROM change_counter WHERE id = 1").scalar() or 0
+
+    start = time.perf_counter()
+    written = 0
+    pending = [[] for _ in conns]
+    session_rows = []
+
+    def flush(index):
+        conns[index].executemany(
+            "INSERT INTO chat_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            pending[index]
+        )
+        conns[index].commit()
+        pending[index].clear()
+
+    for n, length in enumerate(lengths):
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        user_id = f"robot-{rng.randrange(args.users)}"
+        shard = database.router.shard_for(session_id)
+        # 会话开始时间均匀分布在最近 days 天内，轮次之间间隔约 1 分钟
+        ts = now - timedelta(seconds=rng.uniform(0, args.days * 86400))
+        title = None
+        content = None
+        first_ts = ts
+        for i in range(length):
+            if i % 2 == 0:
+                role, content = "user", user_pool[rng.randrange(len(user_pool))]
+                title = title or content
+                ts += timedelta(seconds=rng.expovariate(1 / 60))
+            else:
+                role, content = "assistant", assistant_pool[rng.randrange(len(assistant_pool))]
+                ts += timedelta(seconds=rng.uniform(1, 8))
+            ts = min(ts, now)
+            pending[shard].append((session_id, role, content, _fmt(ts)))
+            if len(pending[shard]) >= CHUNK:
+                flush(shard)
+        written += length
+
+        seq += 1
+        session_rows.append((session_id, user_id, title[:50], content[:100], length, _fmt(first_ts), _fmt(ts), seq))
+        if (n + 1) % 1000 == 0:
+            elapsed = time.perf_counter() - start
+            print(f"[Dataset] {n + 1}/{args.sessions} 个会话，{written} 条消息 "
+                  f"({written / elapsed:.0f} 条/秒)", flush=True)
+
+    for index in range(len(conns)):
+        if pending[index]:
+            flush(index)
+
+    catalog.executemany(
+        "INSERT INTO chat_sessions (session_id, user_id, title, last_message, message_count, created_at, "
+        "last_activity, change_seq, deleted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+        session_rows
+    )
+    catalog.execute("UPDATE change_counter SET seq = ? WHERE id = 1", (seq,))
+    catalog.commit()
+    catalog.close()
+    for conn in conns:
+        conn.close()
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for shard_engine in database.shard_engines:
+        for index in indexes:
+            index.create(shard_engine, checkfirst=True)
+    print(f"[Dataset] 写入 {written} 条消息 / {len(lengths)} 个会话用时 {load_time:.1f}s "
+          f"({written / load_time:.0f} 条/秒)，重建索引 {time.perf_counter() - start:.1f}s")
+
+    if args.analyze:
+        for shard_engine in {id(e): e for e in [database.engine, *database.shard_engines]}.values():
+            with shard_engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+        print("[Dataset] 已执行 ANALYZE")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成合成聊天数据集（按 ShardConfig 分片）")
+    parser.add_argument("--db", default="bench_data/robot.db", help="目标 SQLite 文件")
+    parser.add_argument("--sessions", type=int, default=10000, help="会话数")
+    parser.add_argument("--messages", type=int, default=1000000, help="消息总数（近似）")
+    parser.add_argument("--users", type=int, default=100, help="会话随机分给多少个用户（robot-N）")
+    parser.add_argument("--days", type=int, default=90, help="消息时间分布在最近多少天内")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子，相同参数生成相同的数据")
+    parser.add_argument("--append", action="store_true", help="目标库已有数据时继续追加")
+    parser.add_argument("--analyze", action="store_true", help="生成后执行 ANALYZE（服务端默认不执行）")
+    return generate(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
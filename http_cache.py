@@ -0,0 +1,54 @@
+# http_cache.py
+# 基于会话变更序号的廉价校验器：ETag 计算、If-None-Match 判断和 304 响应
+import hashlib
+
+from fastapi import Request, Response
+
+from config import HttpCacheConfig
+from fast_response import wants_msgpack
+
+
+def make_etag(*parts) -> str:
+    """由版本信息生成弱 ETag（响应可能被压缩，按语义而非字节比较）"""
+    raw = ":".join(str(p) for p in (HttpCacheConfig.ETAG_VERSION,) + parts)
+    return 'W/"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20] + '"'
+
+
+def make_negotiated_etag(request: Request, *parts) -> str:
+    """
+    按 Accept 协商格式（JSON / MessagePack）的接口使用：ETag 中带上实际返回的格式，
+    同一资源的两种表示不会互相命中 304
+    """
+    return make_etag(*parts, "msgpack" if wants_msgpack(request) else "json")
+
+
+def cache_headers(etag: str) -> dict:
+    return {
+        "ETag": etag,
+        "Cache-Control": HttpCacheConfig.CACHE_CONTROL,
+        "Vary": HttpCacheConfig.VARY
+    }
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较）"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    target = opaque(etag)
+    return any(opaque(tag) == target for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def apply_cache_headers(response: Response, etag: str):
+    response.headers.update(cache_headers(etag))
@@ -0,0 +1,170 @@
+# idempotency.py
+# /api/chat 的幂等键：同一个 Idempotency-Key 只处理一次。
+# 处理中的重复请求在进程内等待同一个结果，完成后的重试直接重放保存的响应，都不会再调用AI
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.exc import IntegrityError
+
+from config import IdempotencyConfig
+from database import SessionLocal
+from models import IdempotencyRecord
+
+
+PURGE_EXPIRED_SQL = text(
+    "DELETE FROM idempotency_keys WHERE rowid IN ("
+    "SELECT rowid FROM idempotency_keys WHERE expires_at < :now LIMIT :batch)"
+).bindparams(bindparam("now", type_=DateTime()))
+
+
+class IdempotencyConflict(Exception):
+    """幂等键无法使用：键被用于不同的请求（422），或其他 worker 正在处理（409）"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class IdempotencyStore:
+    """
+    进程内：键 -> (请求摘要, 正在执行的任务)，并发的重复请求等待同一个任务。
+    数据库：processing 记录让其他 worker 知道键已被占用，completed 记录保存响应供重放，
+    执行失败时删除记录，之后的重试重新处理。
+    """
+
+    def __init__(self):
+        self.inflight: Dict[Tuple[str, str], Tuple[str, asyncio.Task]] = {}
+        self.last_purge = 0.0
+
+    def validate_key(self, key: str) -> str:
+        key = key.strip()
+        if not key or len(key) > IdempotencyConfig.MAX_KEY_LENGTH:
+            raise IdempotencyConflict(400, f"Idempotency-Key 长度应为 1-{IdempotencyConfig.MAX_KEY_LENGTH} 个字符")
+        return key
+
+    async def run(self, user_id: str, key: str, fingerprint: str,
+                  factory: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """
+        返回 (响应, 是否为重放)。factory 只会在键第一次出现时执行；
+        它在独立任务中运行，发起请求的客户端断开也会执行完并保存结果，供重试重放。
+        """
+        ident = (user_id, key)
+        inflight = self.inflight.get(ident)
+        if inflight is not None:
+            if inflight[0] != fingerprint:
+                raise IdempotencyConflict(422, "该 Idempotency-Key 已用于内容不同的请求")
+            print(f"[Idempotency] 键 {key} 正在处理，等待同一结果")
+            return await asyncio.shield(inflight[1]), True
+
+        # 检查和登记之间没有 await，同一进程内的并发请求不会重复登记
+        stored = self._claim(user_id, key, fingerprint)
+        if stored is not None:
+            print(f"[Idempotency] 键 {key} 已完成，重放保存的响应")
+            return stored, True
+
+        task = asyncio.ensure_future(self._execute(user_id, key, factory))
+        self.inflight[ident] = (fingerprint, task)
+        task.add_done_callback(lambda _: self.inflight.pop(ident, None))
+        # 没有等待者取走异常时避免 "exception was never retrieved" 警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task), False
+
+    async def _execute(self, user_id: str, key: str, factory) -> dict:
+        try:
+            result = await factory()
+        except BaseException:
+            self._release(user_id, key)
+            raise
+        self._complete(user_id, key, result)
+        return result
+
+    def _claim(self, user_id: str, key: str, fingerprint: str) -> Optional[dict]:
+        """登记 processing 记录；键已完成时返回保存的响应"""
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            self._purge_expired(db)
+            record = db.get(IdempotencyRecord, (user_id, key))
+            if record is not None and record.expires_at < now:
+                db.delete(record)
+                db.flush()
+                record = None
+
+            if record is not None:
+                if record.fingerprint != fingerprint:
+                    raise IdempotencyConflict(422, "该 Idempotency-Key 已用于内容不同的请求")
+                if record.status == "completed":
+                    return json.loads(record.response)
+                if now - record.created_at < timedelta(seconds=IdempotencyConfig.PROCESSING_TIMEOUT):
+                    raise IdempotencyConflict(409, "相同 Idempotency-Key 的请求正在处理，请稍后重试", retry_after=1)
+                # 处理它的 worker 已经退出，接管
+                record.created_at = now
+                db.commit()
+                return None
+
+            db.add(IdempotencyRecord(
+                user_id=user_id, key=key, fingerprint=fingerprint, status="processing",
+                created_at=now, expires_at=now + timedelta(seconds=IdempotencyConfig.TTL_SECONDS)
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                raise IdempotencyConflict(409, "相同 Idempotency-Key 的请求正在处理，请稍后重试", retry_after=1)
+            return None
+        finally:
+            db.close()
+
+    def _complete(self, user_id: str, key: str, result: dict):
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.user_id == user_id, IdempotencyRecord.key == key
+            ).update({
+                IdempotencyRecord.status: "completed",
+                IdempotencyRecord.response: json.dumps(result, ensure_ascii=False),
+                IdempotencyRecord.expires_at: now + timedelta(seconds=IdempotencyConfig.TTL_SECONDS)
+            }, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[Idempotency] 保存响应失败: {type(e).__name__}: {e}")
+        finally:
+            db.close()
+
+    def _release(self, user_id: str, key: str):
+        db = SessionLocal()
+        try:
+            db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.user_id == user_id,
+                IdempotencyRecord.key == key,
+                IdempotencyRecord.status == "processing"
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[Idempotency] 释放键失败: {type(e).__name__}: {e}")
+        finally:
+            db.close()
+
+    def _purge_expired(self, db):
+        """按间隔删除一批过期记录，一条 DELETE 完成"""
+        if time.monotonic() - self.last_purge < IdempotencyConfig.PURGE_INTERVAL:
+            return
+        self.last_purge = time.monotonic()
+        purged = db.execute(PURGE_EXPIRED_SQL, {
+            "now": datetime.utcnow(), "batch": IdempotencyConfig.PURGE_BATCH
+        }).rowcount
+        if purged:
+            db.commit()
+            print(f"[Idempotency] 清理 {purged} 条过期记录")
+
+
+idempotency_store = IdempotencyStore()
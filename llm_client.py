@@ -1,32 +1,75 @@
 import os
-from typing import List, Dict
-import httpx
+import asyncio
 import json
-from openai import AsyncOpenAI  # 新增：用于小米MiMo
+from contextvars import ContextVar
+from typing import Callable, List, Dict, AsyncIterator, Optional, Union
+
+from config import LLMConfig
+
+# httpx / openai 等 SDK 只在对应提供者的客户端第一次创建时导入，
+# 只用其中一个提供者时不必为其他 SDK 付出启动时间和内存
+
+# 客户端按提供者共享，usage 不能保存在实例上：调用方先用 track_usage() 登记一个字典，
+# 客户端收到 usage 时用 record_usage() 写入当前调用方的字典（asyncio 任务会复制上下文，字典本身共享）
+_usage: ContextVar[Optional[Dict]] = ContextVar("llm_usage", default=None)
+
+
+class LLMError(Exception):
+    """调用提供者失败（超时、HTTP 错误等）。str(e) 是可以直接展示给用户的提示"""
+
+
+def track_usage() -> Dict:
+    """为接下来的一次调用准备 usage 字典，调用结束后其中是该次请求的 usage（没有则为空）"""
+    usage = {}
+    _usage.set(usage)
+    return usage
+
+
+def record_usage(usage: Optional[Dict]):
+    """供客户端实现调用：记录本次请求的 usage（含 prompt_cache_hit_tokens / prompt_cache_miss_tokens）"""
+    target = _usage.get()
+    if target is not None and usage:
+        target.clear()
+        target.update(usage)
 
 
 class DeepSeekClient:
     """DeepSeek API 客户端"""
 
-    def __init__(self):
+    def __init__(self, model: str = "deepseek-chat",
+                 base_url: str = "https://api.deepseek.com/v1/chat/completions",
+                 max_tokens: int = 2000, temperature: float = 0.7, timeout: float = 60.0):
         self.api_key = os.getenv("DEEPSEEK_API_KEY")
         if not self.api_key:
             raise ValueError("未找到 DEEPSEEK_API_KEY 环境变量")
-        self.base_url = "https://api.deepseek.com/v1/chat/completions"
+        import httpx
+        self.httpx = httpx
+        self.base_url = base_url
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # 所有请求共用一个连接池，复用与 API 服务器之间的连接
+        self.http = httpx.AsyncClient(timeout=timeout)
+
+    async def aclose(self):
+        await self.http.aclose()
 
-    async def chat(self, messages: List[Dict], max_tokens: int = 2000) -> str:
+    async def chat(self, messages: List[Dict], max_tokens: Optional[int] = None) -> str:
         """发送消息给Deepseek并获取回复"""
+        httpx = self.httpx
+        max_tokens = max_tokens or self.max_tokens
 
         # 准备请求数据
         data = {
-            "model": "deepseek-chat",
+            "model": self.model,
             "messages": messages,
             "max_tokens": max_tokens,
-            "temperature": 0.7,
+            "temperature": self.temperature,
             "stream": False
         }
 
@@ -35,47 +78,102 @@ class DeepSeekClient:
         print(f"[DeepSeek Client] 发送 {len(messages)} 条上下文消息，共约 {total_chars} 字符，请求 {max_tokens} tokens")
 
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(self.base_url, json=data, headers=self.headers)
-                response.raise_for_status()
-                result = response.json()
+            response = await self.http.post(self.base_url, json=data, headers=self.headers)
+            response.raise_for_status()
+            result = response.json()
 
-                # 提取回复
-                ai_reply = result["choices"][0]["message"]["content"]
-                usage = result.get("usage", {})
+            # 提取回复
+            ai_reply = result["choices"][0]["message"]["content"]
+            usage = result.get("usage", {})
+            record_usage(usage)
 
-                print(f"[DeepSeek Client] 收到回复，长度: {len(ai_reply)} 字符")
-                print(f"[DeepSeek Client] API消耗: {usage.get('total_tokens', 'N/A')} tokens")
-                return ai_reply
+            print(f"[DeepSeek Client] 收到回复，长度: {len(ai_reply)} 字符")
+            print(f"[DeepSeek Client] API消耗: {usage.get('total_tokens', 'N/A')} tokens "
+                  f"(缓存命中 {usage.get('prompt_cache_hit_tokens', 'N/A')} tokens)")
+            return ai_reply
 
-        except httpx.TimeoutException:
+        except httpx.TimeoutException as e:
             print("[DeepSeek Client] 错误: 请求超时")
-            return "请求超时，请稍后重试。"
+            raise LLMError("请求超时，请稍后重试。") from e
         except httpx.HTTPStatusError as e:
             print(f"[DeepSeek Client] 错误: API返回 HTTP {e.response.status_code}")
-            return f"[API错误] 状态码 {e.response.status_code}"
+            raise LLMError(f"[API错误] 状态码 {e.response.status_code}") from e
         except Exception as e:
             print(f"[DeepSeek Client] 未预期错误: {type(e).__name__}: {e}")
-            return "处理AI回复时发生未知错误。"
+            raise LLMError("处理AI回复时发生未知错误。") from e
+
+    async def stream_chat(self, messages: List[Dict], max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """以流式方式发送消息给Deepseek，逐块产出回复文本"""
+        httpx = self.httpx
+
+        data = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": max_tokens or self.max_tokens,
+            "temperature": self.temperature,
+            "stream": True,
+            # 最后一个数据块带上 usage，用于统计前缀缓存命中
+            "stream_options": {"include_usage": True}
+        }
+
+        print(f"[DeepSeek Client] 流式请求，{len(messages)} 条上下文消息")
+
+        try:
+            async with self.http.stream("POST", self.base_url, json=data, headers=self.headers) as response:
+                response.raise_for_status()
+                # SSE 格式: 每行 "data: {...}"，以 "data: [DONE]" 结束
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    if chunk.get("usage"):
+                        record_usage(chunk["usage"])
+                    if not chunk.get("choices"):
+                        continue
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+        except httpx.TimeoutException as e:
+            print("[DeepSeek Client] 错误: 流式请求超时")
+            raise LLMError("请求超时，请稍后重试。") from e
+        except httpx.HTTPStatusError as e:
+            print(f"[DeepSeek Client] 错误: API返回 HTTP {e.response.status_code}")
+            raise LLMError(f"[API错误] 状态码 {e.response.status_code}") from e
+        except Exception as e:
+            print(f"[DeepSeek Client] 流式未预期错误: {type(e).__name__}: {e}")
+            raise LLMError("处理AI回复时发生未知错误。") from e
 
 
 class MiMoClient:
     """小米MiMo API 客户端"""
 
-    def __init__(self):
+    def __init__(self, model: str = "mimo-v2-flash", base_url: str = "https://api.xiaomimimo.com/v1",
+                 max_tokens: int = 2000, temperature: float = 0.8, top_p: float = 0.95):
         self.api_key = os.getenv("MIMO_API_KEY")
         if not self.api_key:
             raise ValueError("未找到 MIMO_API_KEY 环境变量")
 
-        # 使用OpenAI SDK（兼容MiMo API）
+        # 使用OpenAI SDK（兼容MiMo API）；SDK 体积较大，用到时才导入
+        from openai import AsyncOpenAI
         self.client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url="https://api.xiaomimimo.com/v1"
+            base_url=base_url
         )
-        self.model = "mimo-v2-flash"
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+
+    async def aclose(self):
+        await self.client.close()
 
-    async def chat(self, messages: List[Dict], max_tokens: int = 2000) -> str:
+    async def chat(self, messages: List[Dict], max_tokens: Optional[int] = None) -> str:
         """发送消息给小米MiMo并获取回复"""
+        max_tokens = max_tokens or self.max_tokens
 
         # 调试日志
         total_chars = sum(len(msg.get("content", "")) for msg in messages)
@@ -87,8 +185,8 @@ class MiMoClient:
                 model=self.model,
                 messages=messages,
                 max_completion_tokens=min(max_tokens, 4096),  # MiMo可能有token限制
-                temperature=0.8,
-                top_p=0.95,
+                temperature=self.temperature,
+                top_p=self.top_p,
                 stream=False,
                 stop=None,
                 frequency_penalty=0,
@@ -104,6 +202,7 @@ class MiMoClient:
             # 如果有使用量信息，打印出来
             if hasattr(response, 'usage'):
                 usage = response.usage
+                record_usage(usage.model_dump() if usage else None)
                 print(f"[MiMo Client] API消耗: {usage.total_tokens if usage else 'N/A'} tokens")
 
             return ai_reply
@@ -114,19 +213,53 @@ class MiMoClient:
             # 提供更友好的错误信息
             error_msg = str(e)
             if "401" in error_msg or "403" in error_msg:
-                return "认证失败，请检查API密钥是否正确。"
+                raise LLMError("认证失败，请检查API密钥是否正确。") from e
             elif "429" in error_msg:
-                return "请求过于频繁，请稍后重试。"
+                raise LLMError("请求过于频繁，请稍后重试。") from e
             elif "timeout" in error_msg.lower():
-                return "请求超时，请检查网络连接。"
+                raise LLMError("请求超时，请检查网络连接。") from e
             else:
-                return f"小米MiMo服务暂时不可用: {error_msg[:100]}"
+                raise LLMError(f"小米MiMo服务暂时不可用: {error_msg[:100]}") from e
+
+    async def stream_chat(self, messages: List[Dict], max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """以流式方式发送消息给小米MiMo，逐块产出回复文本"""
+
+        print(f"[MiMo Client] 流式请求，{len(messages)} 条上下文消息")
+
+        try:
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                max_completion_tokens=min(max_tokens or self.max_tokens, 4096),
+                temperature=self.temperature,
+                top_p=self.top_p,
+                stream=True,
+                extra_body={
+                    "thinking": {"type": "disabled"}
+                }
+            )
+
+            async for chunk in response:
+                if getattr(chunk, "usage", None):
+                    record_usage(chunk.usage.model_dump())
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+
+        except Exception as e:
+            print(f"[MiMo Client] 流式错误: {type(e).__name__}: {e}")
+            raise LLMError(f"小米MiMo服务暂时不可用: {str(e)[:100]}") from e
 
 
 class MockAIClient:
     """模拟AI客户端，用于无API密钥时测试"""
 
-    async def chat(self, messages: List[Dict], max_tokens: int = 2000) -> str:
+    def __init__(self, **options):
+        pass
+
+    async def chat(self, messages: List[Dict], max_tokens: Optional[int] = None) -> str:
         user_msg = messages[-1]["content"].lower()
         if "你好" in user_msg:
             return "你好！我是你的AI桌面机器人，正在开发中。"
@@ -135,31 +268,102 @@ class MockAIClient:
         else:
             return "这是一个模拟回复。要获取真实AI回复，请在'.env' 文件中配置有效的API密钥。"
 
+    async def stream_chat(self, messages: List[Dict], max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        # 把完整回复切成小块，模拟真实的流式输出
+        reply = await self.chat(messages, max_tokens)
+        for i in range(0, len(reply), 4):
+            await asyncio.sleep(0.02)
+            yield reply[i:i + 4]
 
-def get_llm_client():
-    """根据配置返回对应的AI客户端"""
-    provider = os.getenv("LLM_PROVIDER", "deepseek").lower().strip()
 
-    print(f"[LLM Client] 请求的提供者是：'{provider}'")
+# 提供者名称 -> 客户端类，或者尚未加载的 "模块:类" 字符串 / entry point
+_providers: Dict[str, Union[Callable, str, object]] = {
+    "deepseek": DeepSeekClient,
+    "mimo": MiMoClient,
+    "mock": MockAIClient,
+}
+_entry_points_loaded = False
 
-    if provider == "deepseek":
-        print("[LLM Client] 正在使用 DeepSeek 客户端。")
-        try:
-            return DeepSeekClient()
-        except ValueError as e:
-            print(f"[LLM Client] 警告: {e}")
-            print("[LLM Client] 回退到模拟客户端。")
-            return MockAIClient()
-
-    elif provider == "mimo":
-        print("[LLM Client] 正在使用 小米MiMo 客户端。")
-        try:
-            return MiMoClient()
-        except ValueError as e:
-            print(f"[LLM Client] 警告: {e}")
-            print("[LLM Client] 回退到模拟客户端。")
-            return MockAIClient()
+# 提供者名称 -> 已创建的客户端，每个提供者只创建一次
+_clients: Dict[str, object] = {}
+
+
+def register_provider(name: str, target: Union[Callable, str]):
+    """
+    注册提供者。target 可以是客户端类 / 工厂函数，也可以是 "模块:类" 字符串，
+    字符串形式在第一次使用时才导入。客户端需实现 chat / stream_chat，缺少密钥时抛出 ValueError，
+    调用失败时抛出 LLMError；
+    实例会被并发的请求共用，usage 用 record_usage() 上报，需要释放连接时实现 aclose()。
+    """
+    _providers[name.lower()] = target
+    _clients.pop(name.lower(), None)
 
-    else:
+
+def _load_entry_points():
+    """只在遇到未知提供者时扫描一次已安装插件的 entry point"""
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    from importlib.metadata import entry_points
+    for ep in entry_points(group=LLMConfig.ENTRY_POINT_GROUP):
+        _providers.setdefault(ep.name.lower(), ep)
+
+
+def _resolve(name: str) -> Optional[Callable]:
+    target = _providers.get(name)
+    if target is None:
+        _load_entry_points()
+        target = _providers.get(name)
+    if target is None:
+        return None
+
+    if isinstance(target, str):
+        import importlib
+        module_name, _, attr = target.partition(":")
+        target = getattr(importlib.import_module(module_name), attr)
+    elif hasattr(target, "load") and not callable(target):
+        target = target.load()  # importlib.metadata.EntryPoint
+    _providers[name] = target
+    return target
+
+
+def available_providers() -> List[str]:
+    _load_entry_points()
+    return sorted(_providers)
+
+
+def get_llm_client(provider: Optional[str] = None):
+    """根据配置返回对应的AI客户端；同一提供者的客户端（及其连接池）只创建一次，之后复用"""
+    provider = (provider or os.getenv("LLM_PROVIDER", LLMConfig.DEFAULT_PROVIDER)).lower().strip()
+    client = _clients.get(provider)
+    if client is None:
+        client = _clients[provider] = _create_client(provider)
+    return client
+
+
+async def close_clients():
+    """关闭所有已创建客户端的连接"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        if hasattr(client, "aclose"):
+            await client.aclose()
+
+
+def _create_client(provider: str):
+    print(f"[LLM Client] 请求的提供者是：'{provider}'")
+
+    factory = _resolve(provider)
+    if factory is None:
         print(f"[LLM Client] 警告: 未知的提供者 '{provider}'，使用模拟客户端。")
-        return MockAIClient()
\ No newline at end of file
+        return MockAIClient()
+
+    try:
+        client = factory(**LLMConfig.PROVIDERS.get(provider, {}))
+        print(f"[LLM Client] 正在使用 {provider} 客户端。")
+        return client
+    except ValueError as e:
+        print(f"[LLM Client] 警告: {e}")
+        print("[LLM Client] 回退到模拟客户端。")
+        return MockAIClient()
@@ -0,0 +1,365 @@
+# memory.py
+# 长期记忆：本地哈希 n-gram 向量化（不依赖网络），按用户维护可增量追加的内存映射向量索引，
+# 对话时检索最相关的历史消息注入上下文
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import MemoryConfig
+
+_TOKEN_RE = re.compile(r"[一-鿿]|[a-zA-Z0-9]+")
+_SAFE_NAME_RE = re.compile(r"[^a-zA-Z0-9_-]")
+
+
+def _tokens(text: str) -> List[str]:
+    """中文按字、英文和数字按词切分"""
+    return [t.lower() for t in _TOKEN_RE.findall(text)]
+
+
+def _ngrams(tokens: List[str]) -> Iterable[str]:
+    low, high = MemoryConfig.NGRAM_RANGE
+    for n in range(low, high + 1):
+        for i in range(len(tokens) - n + 1):
+            yield "\x1f".join(tokens[i:i + n])
+
+
+def _bucket(feature: str):
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    # 最高位决定符号，减少哈希冲突带来的偏差
+    return value % MemoryConfig.DIM, 1.0 if value >> 63 else -1.0
+
+
+def embed(text: str) -> np.ndarray:
+    """哈希 n-gram 词频向量（对数缩放、L2 归一化），空文本返回零向量"""
+    vector = np.zeros(MemoryConfig.DIM, dtype=np.float32)
+    for feature, count in Counter(_ngrams(_tokens(text))).items():
+        index, sign = _bucket(feature)
+        vector[index] += sign * (1.0 + math.log(count))
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约一字一个 token，其他字符约四个一个"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def index_paths(user_id: str):
+    """用户索引的向量文件和元数据文件路径"""
+    name = _SAFE_NAME_RE.sub("_", user_id) + "-" + hashlib.md5(user_id.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(MemoryConfig.DIR, name + ".vec"), os.path.join(MemoryConfig.DIR, name + ".jsonl")
+
+
+class UserMemoryIndex:
+    """
+    单个用户的向量索引。
+    向量保存在按容量预分配的 float32 内存映射文件中，元数据逐行追加到 jsonl，
+    两者都只追加，写入一条消息只需写一行向量和一行元数据；删除会话时整体重写（forget）。
+    """
+
+    def __init__(self, user_id: str, paths: Optional[Tuple[str, str]] = None):
+        os.makedirs(MemoryConfig.DIR, exist_ok=True)
+        self.vec_path, self.meta_path = paths or index_paths(user_id)
+        self.lock = threading.Lock()
+
+        self.entries: List[dict] = []
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.entries = [json.loads(line) for line in f if line.strip()]
+
+        capacity = MemoryConfig.INITIAL_CAPACITY
+        if os.path.exists(self.vec_path):
+            capacity = max(capacity, os.path.getsize(self.vec_path) // (MemoryConfig.DIM * 4))
+        while capacity < len(self.entries):
+            capacity *= 2
+        self.vectors = self._open(capacity)
+
+    def _open(self, capacity: int) -> np.memmap:
+        size = capacity * MemoryConfig.DIM * 4
+        mode = "r+" if os.path.exists(self.vec_path) else "w+"
+        if mode == "r+" and os.path.getsize(self.vec_path) < size:
+            with open(self.vec_path, "r+b") as f:
+                f.truncate(size)
+        return np.memmap(self.vec_path, dtype=np.float32, mode=mode, shape=(capacity, MemoryConfig.DIM))
+
+    @property
+    def count(self) -> int:
+        return len(self.entries)
+
+    def add(self, session_id: str, role: str, text: str, created_at: Optional[str] = None):
+        vector = embed(text)
+        if not vector.any():
+            return
+        with self.lock:
+            if self.count >= self.vectors.shape[0]:
+                self.vectors.flush()
+                self.vectors = self._open(self.vectors.shape[0] * 2)
+            self.vectors[self.count] = vector
+            entry = {"session_id": session_id, "role": role, "text": text, "created_at": created_at}
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.entries.append(entry)
+
+    def forget(self, session_ids: Iterable[str]) -> int:
+        """
+        删除属于这些会话的条目，返回删除的条数。
+        保留的向量和元数据先写入临时文件再替换，中途失败时原索引保持不变。
+        """
+        session_ids = set(session_ids)
+        with self.lock:
+            keep = [i for i, entry in enumerate(self.entries) if entry["session_id"] not in session_ids]
+            removed = self.count - len(keep)
+            if not removed:
+                return 0
+
+            capacity = self.vectors.shape[0]
+            tmp_vec, tmp_meta = self.vec_path + ".tmp", self.meta_path + ".tmp"
+            vectors = np.memmap(tmp_vec, dtype=np.float32, mode="w+", shape=(capacity, MemoryConfig.DIM))
+            vectors[:len(keep)] = self.vectors[keep]
+            vectors.flush()
+            del vectors
+            entries = [self.entries[i] for i in keep]
+            with open(tmp_meta, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+
+            del self.vectors
+            os.replace(tmp_vec, self.vec_path)
+            os.replace(tmp_meta, self.meta_path)
+            self.entries = entries
+            self.vectors = self._open(capacity)
+        return removed
+
+    def search(self, query: str, k: int, exclude_texts=frozenset(),
+               session_id: Optional[str] = None) -> List[dict]:
+        """
+        余弦相似度 top-k（向量已归一化，点积即余弦），返回带 score 的条目。
+        指定 session_id 时只在该会话的条目中检索。
+        """
+        count = self.count
+        if count == 0:
+            return []
+        q = embed(query)
+        if not q.any():
+            return []
+
+        if session_id is None:
+            rows = np.arange(count)
+            scores = self.vectors[:count] @ q
+        else:
+            rows = np.array([i for i, entry in enumerate(self.entries[:count]) if entry["session_id"] == session_id],
+                            dtype=np.int64)
+            if rows.size == 0:
+                return []
+            scores = self.vectors[rows] @ q
+        # 多取一些候选，留出被排除条目的余量
+        n = min(rows.size, k * 4)
+        candidates = np.argpartition(-scores, n - 1)[:n]
+        candidates = candidates[np.argsort(-scores[candidates])]
+
+        results = []
+        for c in candidates:
+            score = float(scores[c])
+            i = rows[c]
+            if score < MemoryConfig.MIN_SCORE:
+                break
+            entry = self.entries[i]
+            if entry["text"] in exclude_texts:
+                continue
+            results.append({**entry, "score": score})
+            if len(results) >= k:
+                break
+        return results
+
+
+class LongTermMemory:
+    """按用户懒加载索引"""
+
+    def __init__(self):
+        self.indexes: Dict[str, UserMemoryIndex] = {}
+        self.lock = threading.Lock()
+
+    def index_for(self, user_id: str) -> UserMemoryIndex:
+        with self.lock:
+            index = self.indexes.get(user_id)
+            if index is None:
+                index = self.indexes[user_id] = UserMemoryIndex(user_id)
+            return index
+
+    def remember(self, user_id: str, session_id: str, role: str, text: str, created_at: Optional[str] = None):
+        if role in MemoryConfig.INDEX_ROLES and text.strip():
+            self.index_for(user_id).add(session_id, role, text, created_at)
+
+    def recall(self, user_id: str, query: str, exclude_texts=frozenset(),
+               k: int = MemoryConfig.TOP_K, session_id: Optional[str] = None) -> List[dict]:
+        """未指定 user_id 的客户端共用同一个索引，只检索当前会话，不会召回别人的内容"""
+        if user_id == MemoryConfig.SHARED_USER_ID:
+            return self.index_for(user_id).search(query, k, exclude_texts, session_id=session_id)
+        return self.index_for(user_id).search(query, k, exclude_texts)
+
+    def forget(self, sessions_by_user: Dict[Optional[str], Iterable[str]]) -> int:
+        """
+        删除会话时清除其中的记忆，返回删除的条数。
+        只处理已存在的索引文件；所属用户未知的旧会话检查所有用户的索引。
+        """
+        removed = 0
+        for user_id, session_ids in sessions_by_user.items():
+            session_ids = set(session_ids)
+            for vec_path, meta_path in ([index_paths(user_id)] if user_id is not None else _index_files()):
+                if os.path.exists(meta_path):
+                    removed += self._index_at(vec_path, meta_path).forget(session_ids)
+        return removed
+
+    def _index_at(self, vec_path: str, meta_path: str) -> UserMemoryIndex:
+        """已加载的索引直接使用（与写入共用锁），否则按路径临时打开"""
+        with self.lock:
+            for index in self.indexes.values():
+                if index.meta_path == meta_path:
+                    return index
+        return UserMemoryIndex(None, paths=(vec_path, meta_path))
+
+
+def _index_files() -> List[Tuple[str, str]]:
+    if not os.path.isdir(MemoryConfig.DIR):
+        return []
+    return [
+        (os.path.join(MemoryConfig.DIR, name[:-len(".jsonl")] + ".vec"), os.path.join(MemoryConfig.DIR, name))
+        for name in sorted(os.listdir(MemoryConfig.DIR)) if name.endswith(".jsonl")
+    ]
+
+
+def forget_sessions(sessions_by_user: Dict[Optional[str], Iterable[str]]) -> int:
+    """清除已删除会话的记忆；长期记忆关闭时也清理磁盘上已有的索引，重新开启后不会再出现"""
+    if not sessions_by_user:
+        return 0
+    removed = (long_term_memory or LongTermMemory()).forget(sessions_by_user)
+    if removed:
+        print(f"[Memory] 已清除 {removed} 条已删除会话的记忆")
+    return removed
+
+
+def build_memory_message(memories: List[dict], budget: int = MemoryConfig.TOKEN_BUDGET) -> Optional[dict]:
+    """把检索结果拼成一条 system 消息，总长度不超过 token 预算；没有可用记忆时返回 None"""
+    header = "以下是用户在之前对话中提到过的内容，仅在相关时参考："
+    remaining = budget - estimate_tokens(header)
+    lines = []
+    for memory in memories:
+        line = "- " + memory["text"].strip().replace("\n", " ")
+        cost = estimate_tokens(line)
+        if cost > remaining:
+            # 按比例截断最后一条，太短就放弃
+            keep = int(len(line) * remaining / cost) - 1
+            if keep > 10:
+                lines.append(line[:keep] + "…")
+            break
+        lines.append(line)
+        remaining -= cost
+    if not lines:
+        return None
+    return {"role": "system", "content": header + "\n" + "\n".join(lines)}
+
+
+long_term_memory = LongTermMemory() if MemoryConfig.ENABLED else None
+
+
+def rebuild(user_id: Optional[str] = None, default_user: str = "default_user") -> Dict[str, int]:
+    """
+    用数据库中已有的消息（含归档会话）重建索引，消息按会话所属用户（chat_sessions.user_id）
+    写入各自的索引，返回 {用户: 索引条数}。user_id 为 None 时重建所有用户（先删除全部索引文件），
+    否则只重建该用户。尚未记录所属用户的旧会话归入 default_user，已删除会话的消息不再索引。
+    """
+    from database import ShardSet
+    from models import ChatMessage, ChatSession, ArchivedSession
+    from archive import unpack_messages
+
+    if user_id is None:
+        for paths in _index_files():
+            for path in paths:
+                os.remove(path)
+
+    indexes: Dict[str, UserMemoryIndex] = {}
+
+    def index_of(owner: str) -> UserMemoryIndex:
+        index = indexes.get(owner)
+        if index is None:
+            # 第一次遇到该用户时清空旧索引
+            for path in index_paths(owner):
+                if os.path.exists(path):
+                    os.remove(path)
+            index = indexes[owner] = UserMemoryIndex(owner)
+        return index
+
+    if user_id is not None:
+        index_of(user_id)
+
+    shards = ShardSet()
+    try:
+        owners = {}
+        deleted = set()
+        for session_id, owner, is_deleted in shards.catalog.query(
+                ChatSession.session_id, ChatSession.user_id, ChatSession.deleted).yield_per(1000):
+            if is_deleted:
+                deleted.add(session_id)
+            else:
+                owners[session_id] = owner or default_user
+
+        def add(msg: ChatMessage):
+            if msg.session_id in deleted or msg.role not in MemoryConfig.INDEX_ROLES:
+                return
+            owner = owners.get(msg.session_id, default_user)
+            if user_id is None or owner == user_id:
+                index_of(owner).add(msg.session_id, msg.role, msg.content,
+                                    msg.created_at.isoformat() if msg.created_at else None)
+
+        for i in range(shards.count):
+            db = shards.shard(i)
+            rows = db.query(ChatMessage).filter(
+                ChatMessage.role.in_(MemoryConfig.INDEX_ROLES)
+            ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).yield_per(1000)
+            for msg in rows:
+                add(msg)
+            for archived in db.query(ArchivedSession).yield_per(100):
+                for msg in unpack_messages(archived.codec, archived.payload, archived.session_id):
+                    add(msg)
+    finally:
+        shards.close()
+
+    for index in indexes.values():
+        index.vectors.flush()
+    if long_term_memory is not None:
+        with long_term_memory.lock:
+            if user_id is None:
+                long_term_memory.indexes.clear()
+            else:
+                long_term_memory.indexes.pop(user_id, None)
+    return {owner: index.count for owner, index in indexes.items()}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="长期记忆索引维护")
+    parser.add_argument("--rebuild", action="store_true", help="从数据库重建索引")
+    parser.add_argument("--user", default=None, help="只重建该用户的索引（默认重建所有用户）")
+    parser.add_argument("--default-user", default="default_user", help="尚未记录所属用户的会话归入的用户")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from database import engine, shard_engines
+        engine.echo = False
+        for shard_engine in shard_engines:
+            shard_engine.echo = False
+        counts = rebuild(args.user, args.default_user)
+        for owner, count in sorted(counts.items()):
+            print(f"[Memory] 用户 {owner} 的索引已重建，共 {count} 条")
+        print(f"[Memory] 共重建 {len(counts)} 个用户的索引")
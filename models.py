@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, LargeBinary, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -24,4 +24,127 @@ class ChatMessage(Base):
     )
 
     def __repr__(self):
-        return f"<ChatMessage(session_id='{self.session_id}', role='{self.role}')>"
\ No newline at end of file
+        return f"<ChatMessage(session_id='{self.session_id}', role='{self.role}')>"
+
+
+class ChatSession(Base):
+    """会话元数据，随消息写入由后台合并维护（session_store.CatalogWriter），用于会话列表和增量同步"""
+    __tablename__ = 'chat_sessions'
+
+    session_id = Column(String(255), primary_key=True)
+    user_id = Column(String(255), nullable=True)  # 所属用户（机器人）；旧数据由 admin.py backfill-users 补齐
+    title = Column(String(255), nullable=True)  # 第一条用户消息（截断）
+    last_message = Column(Text, nullable=True)  # 最后一条消息预览（截断）
+    message_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    last_activity = Column(DateTime(timezone=True), nullable=True, index=True)
+    change_seq = Column(Integer, nullable=False, default=0, index=True)  # 最近一次变更的全局序号
+    deleted = Column(Boolean, nullable=False, default=False)  # 已删除会话保留为墓碑，供增量同步使用
+
+    # 按用户列出 / 统计 / 删除会话以及按用户增量同步时，都只扫描该用户的索引区间
+    __table_args__ = (
+        Index("ix_chat_sessions_user_activity", "user_id", "deleted", "last_activity"),
+        Index("ix_chat_sessions_user_count", "user_id", "deleted", "message_count"),
+        Index("ix_chat_sessions_user_seq", "user_id", "change_seq"),
+    )
+
+    def __repr__(self):
+        return f"<ChatSession(session_id='{self.session_id}', change_seq={self.change_seq})>"
+
+
+class ChangeCounter(Base):
+    """全局单调递增的变更序号（单行表）"""
+    __tablename__ = 'change_counter'
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+    pruned_before = Column(Integer, nullable=False, default=0)  # 小于等于该序号的墓碑可能已被清理
+
+
+class ArchivedSession(Base):
+    """冷会话归档：整个会话的消息压缩成一个数据块，与消息存放在同一分片"""
+    __tablename__ = 'archived_sessions'
+
+    session_id = Column(String(255), primary_key=True)
+    codec = Column(String(20), nullable=False)  # 'zstd' 或 'zlib'
+    payload = Column(LargeBinary, nullable=False)  # 压缩后的消息列表
+    message_count = Column(Integer, nullable=False, default=0)
+    raw_size = Column(Integer, nullable=False, default=0)  # 压缩前字节数
+    last_activity = Column(DateTime(timezone=True), nullable=True, index=True)
+    last_message = Column(Text, nullable=True)  # 会话列表中的预览
+    archived_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ArchivedSession(session_id='{self.session_id}', messages={self.message_count})>"
+
+
+class BatchJob(Base):
+    """批量对话任务"""
+    __tablename__ = 'batch_jobs'
+
+    job_id = Column(String(64), primary_key=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued / running / completed / cancelled
+    total = Column(Integer, nullable=False, default=0)
+    succeeded = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    max_tokens = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    owner = Column(String(100), nullable=True)  # 正在执行该任务的进程（租约持有者）
+    lease_until = Column(DateTime(timezone=True), nullable=True)  # 租约到期前其他进程不会接手
+
+    def __repr__(self):
+        return f"<BatchJob(job_id='{self.job_id}', status='{self.status}')>"
+
+
+class BatchItem(Base):
+    """批量任务中的一条提示词及其结果"""
+    __tablename__ = 'batch_items'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(64), nullable=False, index=True)
+    item_index = Column(Integer, nullable=False)  # 提交时的顺序
+    messages = Column(Text, nullable=False)  # JSON：发给模型的消息列表
+    status = Column(String(20), nullable=False, default="pending")  # pending / succeeded / failed
+    reply = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    usage = Column(Text, nullable=True)  # JSON
+    latency_ms = Column(Integer, nullable=True)
+    done_seq = Column(Integer, nullable=True, index=True)  # 在任务内的完成顺序，供流式读取结果
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<BatchItem(job_id='{self.job_id}', item_index={self.item_index}, status='{self.status}')>"
+
+
+class CancelledTurn(Base):
+    """被取消或超时的对话轮次；未完成的回复只记录在这里，不作为正式回复保存"""
+    __tablename__ = 'cancelled_turns'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    session_id = Column(String(255), nullable=False, index=True)
+    reason = Column(String(20), nullable=False)  # disconnect / deadline / client_cancel / cancelled
+    stage = Column(String(20), nullable=False)  # queued：还未调用 LLM；llm：生成过程中
+    partial_reply = Column(Text, nullable=True)
+    elapsed_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<CancelledTurn(session_id='{self.session_id}', reason='{self.reason}')>"
+
+
+class IdempotencyRecord(Base):
+    """带 Idempotency-Key 的对话请求及其响应，过期后清理"""
+    __tablename__ = 'idempotency_keys'
+
+    user_id = Column(String(255), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # 请求内容的摘要，同一个键不能用于不同的请求
+    status = Column(String(20), nullable=False, default="processing")  # processing / completed
+    response = Column(Text, nullable=True)  # JSON
+    created_at = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyRecord(user_id='{self.user_id}', key='{self.key}', status='{self.status}')>"
@@ -0,0 +1,161 @@
+# profiling.py
+# 按请求的耗时分解（Server-Timing：数据库、LLM、序列化）和可选的 cProfile 采样
+import contextvars
+import cProfile
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import ProfilingConfig
+
+
+class RequestTimings:
+    """一次请求内累计的各类耗时；分片查询在线程池中执行，累加时加锁"""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.db_queries = 0
+        self.lock = threading.Lock()
+
+    def add(self, name: str, ms: float):
+        with self.lock:
+            self.durations[name] = self.durations.get(name, 0.0) + ms
+
+    def add_query(self, ms: float):
+        with self.lock:
+            self.durations["db"] = self.durations.get("db", 0.0) + ms
+            self.db_queries += 1
+
+    def header(self, total_ms: float) -> str:
+        metrics = []
+        for name, ms in self.durations.items():
+            if name == "db":
+                metrics.append(f'db;dur={ms:.1f};desc="{self.db_queries} queries"')
+            else:
+                metrics.append(f"{name};dur={ms:.1f}")
+        metrics.append(f"total;dur={total_ms:.1f}")
+        return ", ".join(metrics)
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("request_timings", default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current.get()
+
+
+@contextmanager
+def timed(name: str):
+    """把代码块的耗时记到当前请求的 Server-Timing 中；不在请求内时什么都不做"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - start) * 1000)
+
+
+# 所有引擎（主库和各分片）的 SQL 执行耗时
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    starts = conn.info.get("query_start")
+    if timings is not None and starts:
+        timings.add_query((time.perf_counter() - starts.pop()) * 1000)
+
+
+# cProfile 同一时间只能有一个在运行（它替换的是整个线程的 profile 钩子）
+_profile_lock = threading.Lock()
+_SAFE_PATH_RE = re.compile(r"[^a-zA-Z0-9_-]+")
+
+
+def _profile_requested(scope, headers: Dict[bytes, bytes]) -> bool:
+    if not ProfilingConfig.ALLOW_PROFILING:
+        return False
+    value = headers.get(b"x-profile", b"").decode("latin-1")
+    if not value:
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        value = (query.get("profile") or [""])[0]
+    if not value:
+        return False
+    if ProfilingConfig.TOKEN:
+        return value == ProfilingConfig.TOKEN
+    return value not in ("0", "false")
+
+
+def _profile_path(scope) -> str:
+    os.makedirs(ProfilingConfig.DIR, exist_ok=True)
+    path = _SAFE_PATH_RE.sub("_", scope["path"]).strip("_") or "root"
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{scope['method']}-{path}.prof"
+    return os.path.join(ProfilingConfig.DIR, name)
+
+
+class ProfilingMiddleware:
+    """
+    为每个 HTTP 请求建立耗时记录，SERVER_TIMING 开启时在响应头中加入 Server-Timing。
+    请求带 X-Profile / ?profile 且配置允许时，用 cProfile 记录整个请求并写入 profiles 目录，
+    同时返回该请求的 Server-Timing。
+    注意 cProfile 记录的是事件循环线程上的全部执行，并发请求的调用也会混入其中。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        profiler = None
+        profile_file = None
+        profile_requested = _profile_requested(scope, headers)
+        if profile_requested and _profile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profile_file = _profile_path(scope)
+        send_timing = ProfilingConfig.SERVER_TIMING or profile_requested
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                extra = []
+                if send_timing:
+                    total_ms = (time.perf_counter() - start) * 1000
+                    extra.append((b"server-timing", timings.header(total_ms).encode("latin-1")))
+                if profile_file:
+                    extra.append((b"x-profile-file", os.path.basename(profile_file).encode("latin-1")))
+                if extra:
+                    message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            if profiler is not None:
+                profiler.enable()
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                _profile_lock.release()
+                profiler.dump_stats(profile_file)
+                print(f"[Profiling] {scope['method']} {scope['path']} -> {profile_file}")
+            _current.reset(token)
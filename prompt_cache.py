@@ -0,0 +1,132 @@
+# prompt_cache.py
+# 对前缀缓存友好的提示词组装，以及按会话 / 全局统计服务端前缀缓存命中率
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import PromptConfig
+
+
+def system_prefix() -> List[Dict]:
+    """每轮请求都相同的开头部分"""
+    content = PromptConfig.SYSTEM_PROMPT
+    if PromptConfig.PERSONA:
+        content += "\n\n" + PromptConfig.PERSONA
+    return [{"role": "system", "content": content}]
+
+
+def history_window_start(total: int) -> int:
+    """
+    历史窗口的起点。按 HISTORY_BLOCK 对齐跳动而不是每轮滑动一条，
+    起点不变的几轮之间，新请求只是在上一轮请求末尾追加内容。
+    """
+    overflow = total - PromptConfig.MIN_HISTORY_MESSAGES
+    if overflow <= 0:
+        return 0
+    return overflow // PromptConfig.HISTORY_BLOCK * PromptConfig.HISTORY_BLOCK
+
+
+def build_messages(history, message: str, memory_message: Optional[Dict] = None) -> List[Dict]:
+    """
+    组装发给模型的消息：固定前缀 + 只追加的历史 + 本轮动态内容。
+    每轮都会变化的长期记忆放在历史之后，不破坏可缓存的前缀。
+    """
+    messages = system_prefix()
+    messages.extend({"role": msg.role, "content": msg.content} for msg in history)
+    if memory_message:
+        messages.append(memory_message)
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+def normalize_usage(usage: Optional[Dict]) -> Optional[Dict]:
+    """
+    从接口返回的 usage 中取出缓存命中 / 未命中的 token 数。
+    DeepSeek 返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens，
+    OpenAI 兼容接口返回 prompt_tokens_details.cached_tokens。
+    """
+    if not usage:
+        return None
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    hit = usage.get("prompt_cache_hit_tokens")
+    if hit is None:
+        hit = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    miss = usage.get("prompt_cache_miss_tokens")
+    if miss is None:
+        miss = max(prompt_tokens - hit, 0)
+    return {
+        "prompt_tokens": prompt_tokens or hit + miss,
+        "hit_tokens": hit,
+        "miss_tokens": miss,
+        "completion_tokens": usage.get("completion_tokens") or 0
+    }
+
+
+class _Counter:
+    __slots__ = ("requests", "hit_tokens", "miss_tokens", "completion_tokens", "latency_ms")
+
+    def __init__(self):
+        self.requests = 0
+        self.hit_tokens = 0
+        self.miss_tokens = 0
+        self.completion_tokens = 0
+        self.latency_ms = 0.0
+
+    def add(self, usage: Dict, latency_ms: float):
+        self.requests += 1
+        self.hit_tokens += usage["hit_tokens"]
+        self.miss_tokens += usage["miss_tokens"]
+        self.completion_tokens += usage["completion_tokens"]
+        self.latency_ms += latency_ms
+
+    def to_dict(self) -> Dict:
+        prompt_tokens = self.hit_tokens + self.miss_tokens
+        hit_ratio = self.hit_tokens / prompt_tokens if prompt_tokens else 0.0
+        return {
+            "requests": self.requests,
+            "prompt_tokens": prompt_tokens,
+            "hit_tokens": self.hit_tokens,
+            "miss_tokens": self.miss_tokens,
+            "completion_tokens": self.completion_tokens,
+            "hit_ratio": round(hit_ratio, 4),
+            # 相对全部按未命中计费，输入费用节省的比例
+            "input_cost_saving": round(hit_ratio * (1 - PromptConfig.CACHE_HIT_PRICE_RATIO), 4),
+            "avg_latency_ms": round(self.latency_ms / self.requests, 1) if self.requests else None
+        }
+
+
+class CacheStats:
+    """进程内的前缀缓存统计，会话数超过上限时淘汰最久未更新的会话"""
+
+    def __init__(self, max_sessions: int = PromptConfig.MAX_TRACKED_SESSIONS):
+        self.max_sessions = max_sessions
+        self.total = _Counter()
+        self.sessions: "OrderedDict[str, _Counter]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, session_id: str, usage: Optional[Dict], latency_ms: float):
+        usage = normalize_usage(usage)
+        if usage is None:
+            return
+        with self.lock:
+            self.total.add(usage, latency_ms)
+            counter = self.sessions.get(session_id)
+            if counter is None:
+                counter = self.sessions[session_id] = _Counter()
+            counter.add(usage, latency_ms)
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        print(f"[PromptCache] 会话 {session_id}: 命中 {usage['hit_tokens']} / 未命中 {usage['miss_tokens']} tokens")
+
+    def session(self, session_id: str) -> Optional[Dict]:
+        with self.lock:
+            counter = self.sessions.get(session_id)
+            return counter.to_dict() if counter else None
+
+    def overall(self) -> Dict:
+        with self.lock:
+            return {**self.total.to_dict(), "tracked_sessions": len(self.sessions)}
+
+
+cache_stats = CacheStats()
@@ -0,0 +1,238 @@
+# rate_limit.py
+# 按 IP / 用户 / 会话的令牌桶限流，支持进程内和跨 worker 共享（SQLite）两种存储
+import asyncio
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from config import RateLimitConfig
+
+# (桶的键, 容量, 每秒补充的令牌数)
+BucketSpec = Tuple[str, float, float]
+
+
+def _refill(tokens: float, updated: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _decide(states: List[Tuple[float, float]], specs: List[BucketSpec], now: float, cost: float):
+    """所有桶都有足够令牌时才放行并全部扣减，否则都不扣，返回 (是否放行, 新状态, 需等待秒数)"""
+    refilled = [
+        _refill(tokens, updated, capacity, rate, now)
+        for (tokens, updated), (_, capacity, rate) in zip(states, specs)
+    ]
+    retry_after = 0.0
+    for tokens, (_, capacity, rate) in zip(refilled, specs):
+        if tokens < cost:
+            retry_after = max(retry_after, (cost - tokens) / rate)
+
+    if retry_after > 0:
+        return False, refilled, retry_after
+    return True, [tokens - cost for tokens in refilled], 0.0
+
+
+class MemoryBucketBackend:
+    """进程内令牌桶，按最近使用淘汰以限制内存"""
+
+    def __init__(self, max_keys: int = RateLimitConfig.MEMORY_MAX_KEYS):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, specs: List[BucketSpec], cost: float = 1.0):
+        now = time.time()
+        with self.lock:
+            states = [self.buckets.get(key, (capacity, now)) for key, capacity, _ in specs]
+            allowed, new_tokens, retry_after = _decide(states, specs, now, cost)
+            for (key, _, _), tokens in zip(specs, new_tokens):
+                self.buckets[key] = (tokens, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+class SQLiteBucketBackend:
+    """
+    存放在 SQLite 文件中的令牌桶，多个 uvicorn worker 共享同一份状态。
+    BEGIN IMMEDIATE 取得写锁，保证读-改-写的原子性。
+    """
+
+    def __init__(self, path: str = RateLimitConfig.SQLITE_PATH):
+        self.path = path
+        self.local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def take(self, specs: List[BucketSpec], cost: float = 1.0):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            states = []
+            for key, capacity, _ in specs:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                states.append(row if row else (capacity, now))
+
+            allowed, new_tokens, retry_after = _decide(states, specs, now, cost)
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                [(key, tokens, now) for (key, _, _), tokens in zip(specs, new_tokens)]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def purge(self, idle_seconds: float = RateLimitConfig.PURGE_IDLE_SECONDS) -> int:
+        """清理长时间未使用（早已补满）的桶"""
+        conn = self._connect()
+        cur = conn.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - idle_seconds,))
+        return cur.rowcount
+
+
+class RateLimiter:
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = SQLiteBucketBackend() if RateLimitConfig.BACKEND == "sqlite" else MemoryBucketBackend()
+        self.backend = backend
+
+    @staticmethod
+    def build_specs(ip: Optional[str], user_id: Optional[str], session_id: Optional[str]) -> List[BucketSpec]:
+        specs = []
+        # default_user 是所有匿名客户端共用的占位符，不按用户限流
+        for dimension, value in (("ip", ip), ("user", None if user_id == "default_user" else user_id),
+                                 ("session", session_id)):
+            rule = RateLimitConfig.RULES.get(dimension)
+            if value and rule:
+                rate = rule["capacity"] / rule["per_seconds"]
+                specs.append((f"{dimension}:{value}", float(rule["capacity"]), rate))
+        return specs
+
+    async def check(self, ip: Optional[str] = None, user_id: Optional[str] = None,
+                    session_id: Optional[str] = None) -> Tuple[bool, float]:
+        """消耗一个令牌，返回 (是否放行, 建议等待秒数)"""
+        specs = self.build_specs(ip, user_id, session_id)
+        if not specs:
+            return True, 0.0
+        if isinstance(self.backend, MemoryBucketBackend):
+            return self.backend.take(specs)
+        return await run_in_threadpool(self.backend.take, specs)
+
+
+    async def purge(self) -> int:
+        """删除闲置的桶；内存后端按 LRU 自行淘汰，无需清理"""
+        if isinstance(self.backend, MemoryBucketBackend):
+            return 0
+        return await run_in_threadpool(self.backend.purge)
+
+
+limiter = RateLimiter() if RateLimitConfig.ENABLED else None
+
+
+async def purge_buckets_loop():
+    """按 RateLimitConfig.PURGE_INTERVAL 定期清理闲置的令牌桶，避免 ratelimit.db 无限增长"""
+    while True:
+        await asyncio.sleep(RateLimitConfig.PURGE_INTERVAL)
+        try:
+            purged = await limiter.purge()
+            if purged:
+                print(f"[RateLimit] 已清理 {purged} 个闲置令牌桶")
+        except Exception as e:
+            print(f"[RateLimit] 清理令牌桶失败: {e}")
+
+
+def client_ip(scope) -> Optional[str]:
+    if RateLimitConfig.TRUST_FORWARDED_FOR:
+        for name, value in scope.get("headers", []):
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else None
+
+
+class RateLimitMiddleware:
+    """
+    对配置的 POST 接口限流。需要读取请求体中的 user_id / session_id，
+    读完后再原样交给下游应用。超限返回 429 和 Retry-After。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (limiter is None or scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"] not in RateLimitConfig.PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+
+        allowed, retry_after = await limiter.check(
+            ip=client_ip(scope),
+            user_id=payload.get("user_id"),
+            session_id=payload.get("session_id")
+        )
+
+        if not allowed:
+            retry_seconds = max(1, math.ceil(retry_after))
+            content = json.dumps({
+                "status": "error",
+                "detail": f"请求过于频繁，请 {retry_seconds} 秒后重试"
+            }, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(content)).encode("latin-1")),
+                    (b"retry-after", str(retry_seconds).encode("latin-1")),
+                ]
+            })
+            await send({"type": "http.response.body", "body": content})
+            return
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay_receive, send)
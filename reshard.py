@@ -0,0 +1,112 @@
+# reshard.py
+# 消息分片迁移工具：把消息和冷会话归档从旧的分片布局搬到新的分片数下
+#
+# 用法：
+#   python reshard.py --from 1 --to 4 --dry-run   # 只统计需要迁移的会话
+#   python reshard.py --from 1 --to 4             # 执行迁移
+# 迁移完成后把 config.py 中的 ShardConfig.SHARD_COUNT 改为新的分片数再启动服务。
+# 迁移期间应停止服务，避免新写入落到旧布局。
+import argparse
+from collections import defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from database import DATABASE_URL, SHARDED_TABLES, engine, _create_engine
+from models import ArchivedSession, Base, ChatMessage
+from sharding import ShardRouter, shard_url
+
+COLUMNS = [c.name for c in ChatMessage.__table__.columns if c.name != "id"]
+ARCHIVE_COLUMNS = [c.name for c in ArchivedSession.__table__.columns]
+
+
+def _engines(shard_count: int):
+    return [
+        engine if shard_count == 1 else _create_engine(shard_url(i, shard_count, DATABASE_URL), echo=False)
+        for i in range(shard_count)
+    ]
+
+
+def plan(old_count: int, new_count: int):
+    """返回 {(源分片, 目标分片): [会话ID]}，只包含需要搬动的会话"""
+    new_router = ShardRouter(new_count)
+    moves = defaultdict(list)
+    for source, source_engine in enumerate(_engines(old_count)):
+        with source_engine.connect() as conn:
+            # 归档会话的消息已从 chat_messages 删除，只剩 archived_sessions 中的一行
+            session_ids = conn.execute(
+                select(ChatMessage.session_id).union(select(ArchivedSession.session_id))
+            ).scalars().all()
+        for session_id in session_ids:
+            # 按会话实际所在的分片处理，上次迁移中断留下的数据也能被搬走
+            target = new_router.shard_for(session_id)
+            if _same_file(old_count, source, new_count, target):
+                continue
+            moves[(source, target)].append(session_id)
+    return moves
+
+
+def _same_file(old_count: int, source: int, new_count: int, target: int) -> bool:
+    return shard_url(source, old_count, DATABASE_URL) == shard_url(target, new_count, DATABASE_URL)
+
+
+def migrate(old_count: int, new_count: int, dry_run: bool = False):
+    moves = plan(old_count, new_count)
+    total_sessions = sum(len(ids) for ids in moves.values())
+    print(f"[Reshard] {old_count} -> {new_count} 个分片，需要迁移 {total_sessions} 个会话")
+    for (source, target), session_ids in sorted(moves.items()):
+        print(f"[Reshard]   分片 {source} -> {target}: {len(session_ids)} 个会话")
+    if dry_run or not moves:
+        return total_sessions
+
+    old_engines, new_engines = _engines(old_count), _engines(new_count)
+    for new_engine in new_engines:
+        tables = None if new_engine is engine else SHARDED_TABLES
+        Base.metadata.create_all(bind=new_engine, tables=tables)
+
+    moved_messages = moved_archives = 0
+    for (source, target), session_ids in sorted(moves.items()):
+        SourceSession = sessionmaker(bind=old_engines[source])
+        TargetSession = sessionmaker(bind=new_engines[target])
+        for session_id in session_ids:
+            src, dst = SourceSession(), TargetSession()
+            try:
+                rows = src.query(ChatMessage).filter(
+                    ChatMessage.session_id == session_id
+                ).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).all()
+                archived = src.get(ArchivedSession, session_id)
+
+                # 先清掉目标分片上可能残留的半成品，保证重复执行是幂等的
+                dst.query(ChatMessage).filter(ChatMessage.session_id == session_id).delete()
+                dst.query(ArchivedSession).filter(ArchivedSession.session_id == session_id).delete()
+                dst.add_all([ChatMessage(**{c: getattr(r, c) for c in COLUMNS}) for r in rows])
+                if archived is not None:
+                    dst.add(ArchivedSession(**{c: getattr(archived, c) for c in ARCHIVE_COLUMNS}))
+                dst.commit()
+
+                # 目标写入成功后再删除源数据
+                src.query(ChatMessage).filter(ChatMessage.session_id == session_id).delete()
+                src.query(ArchivedSession).filter(ArchivedSession.session_id == session_id).delete()
+                src.commit()
+                moved_messages += len(rows)
+                moved_archives += archived is not None
+            except Exception:
+                dst.rollback()
+                src.rollback()
+                raise
+            finally:
+                src.close()
+                dst.close()
+
+    print(f"[Reshard] 迁移完成：{total_sessions} 个会话，{moved_messages} 条消息，{moved_archives} 个归档")
+    return total_sessions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在不同分片数之间迁移聊天消息和冷会话归档")
+    parser.add_argument("--from", dest="old_count", type=int, required=True, help="当前的分片数")
+    parser.add_argument("--to", dest="new_count", type=int, required=True, help="新的分片数")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不迁移")
+    args = parser.parse_args()
+    engine.echo = False
+    migrate(args.old_count, args.new_count, args.dry_run)
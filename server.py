@@ -1,19 +1,41 @@
 # server.py
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request, Response, Depends, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from dotenv import load_dotenv
 import os
+import asyncio
+import heapq
+import itertools
 import uuid
+import json
 from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, func
-from database import get_db,SessionLocal, engine
-from models import ChatMessage
+from database import get_db, get_shards, ShardSet, SessionLocal, engine
+from models import ChatMessage, ChatSession, ArchivedSession, BatchJob, BatchItem, CancelledTurn
 from sqlalchemy.orm import Session
-from llm_client import get_llm_client
+from chat_service import resolve_session_id, run_chat_turn, run_keyed_chat_turn
+from ws_chat import handle_chat_socket
+from session_store import (
+    mark_sessions_deleted, current_seq, session_version, load_session_summaries,
+    wait_for_changes, change_notifier, session_entry, list_user_sessions, user_sessions_query,
+    user_session_stats, prune_tombstones_loop, catalog_writer
+)
+from config import SessionConfig, ArchiveConfig, IdempotencyConfig, ChangeFeedConfig, RateLimitConfig
+from http_cache import make_etag, make_negotiated_etag, etag_matches, not_modified, apply_cache_headers, cache_headers
+from fast_response import FastJSONResponse, CompressionMiddleware, negotiate_response
+from rate_limit import RateLimitMiddleware, limiter, purge_buckets_loop
+from archive import load_archived, delete_archived, auto_archive_loop
+from prompt_cache import cache_stats
+from llm_client import close_clients
+from speech import speech_stats
+from profiling import ProfilingMiddleware
+from deadline import DeadlineMiddleware, DeadlineExceeded, ClientDisconnected, cancel_on_disconnect
+from idempotency import IdempotencyConflict, idempotency_store
+from batch_jobs import batch_runner, create_job, job_entry, item_entry, FINAL_STATUSES
 from database import init_db
 init_db()
 
@@ -43,7 +65,13 @@ else:
 print("==================")
 
 # 创建 FastAPI 应用
-app = FastAPI(title="AI桌面机器人服务器")
+app = FastAPI(title="AI桌面机器人服务器", default_response_class=FastJSONResponse)
+
+# X-Request-Timeout 请求头指定的端到端时限（最内层，时限从进入路由前开始计算）
+app.add_middleware(DeadlineMiddleware)
+
+# 按 IP / 用户 / 会话限流（放在 CORS 内层，429 响应也带跨域头）
+app.add_middleware(RateLimitMiddleware)
 
 # 允许网页跨域访问
 app.add_middleware(
@@ -54,6 +82,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 超过阈值的响应按 Accept-Encoding 做 br / gzip 压缩
+app.add_middleware(CompressionMiddleware)
+
+# 最外层：Server-Timing 耗时分解和按请求开启的 cProfile
+app.add_middleware(ProfilingMiddleware)
+
 # 创建必要的目录
 os.makedirs("templates", exist_ok=True)
 os.makedirs("static/css", exist_ok=True)
@@ -73,11 +107,18 @@ class ChatRequest(BaseModel):
     user_id: str = "default_user"
     session_id: str = None
 
+class SessionSummariesRequest(BaseModel):
+    session_ids: List[str]
+
 class BatchDeleteRequest(BaseModel):
     session_ids: Optional[List[str]] = None
     confirm_password: Optional[str] = None
     keep_latest: Optional[int] = 0  # 保留最近N个会话
 
+class BatchJobRequest(BaseModel):
+    items: List[dict]  # 每项为 {"prompt": "..."} 或 {"messages": [{"role": ..., "content": ...}]}
+    max_tokens: Optional[int] = None
+
 
 
 # 路由
@@ -94,6 +135,57 @@ async def test_page():
         return HTMLResponse(content=f.read())
 
 
+@app.on_event("startup")
+async def start_auto_archive():
+    """按配置启动后台冷会话归档"""
+    if ArchiveConfig.AUTO_ARCHIVE_INTERVAL > 0:
+        asyncio.create_task(auto_archive_loop())
+
+
+@app.on_event("startup")
+async def start_tombstone_pruning():
+    """按配置定期清理过期的删除墓碑"""
+    if ChangeFeedConfig.TOMBSTONE_PRUNE_INTERVAL > 0:
+        asyncio.create_task(prune_tombstones_loop())
+
+
+@app.on_event("startup")
+async def start_rate_limit_purge():
+    """定期清理共享令牌桶中闲置的键"""
+    if limiter is not None and RateLimitConfig.PURGE_INTERVAL > 0:
+        asyncio.create_task(purge_buckets_loop())
+
+
+@app.on_event("startup")
+async def start_catalog_writer():
+    """启动会话元数据的后台合并写入"""
+    catalog_writer.start()
+
+
+@app.on_event("shutdown")
+async def stop_catalog_writer():
+    """写入尚未落库的会话元数据"""
+    await catalog_writer.stop()
+
+
+@app.on_event("startup")
+async def start_batch_runner():
+    """启动批量任务 worker，并恢复未完成的任务"""
+    batch_runner.start()
+
+
+@app.on_event("shutdown")
+async def stop_batch_runner():
+    """停止 worker，并把缓冲中的结果写入数据库"""
+    await batch_runner.stop()
+
+
+@app.on_event("shutdown")
+async def close_llm_clients():
+    """关闭共用的AI客户端连接池"""
+    await close_clients()
+
+
 @app.get("/api/status")
 async def api_status():
     """API 状态检查"""
@@ -107,148 +199,170 @@ async def api_status():
 @app.post("/api/chat")
 async def chat_api(
         request: ChatRequest,
-        db: Session = Depends(get_db)
+        http_request: Request,
+        shards: ShardSet = Depends(get_shards)
 ):
-    """聊天 API 接口"""
-    # 优先使用 session_id，如果没有则使用 user_id
-    session_id = request.session_id or request.user_id
-
-    # 如果是第一次对话，生成一个新的 session_id
-    if session_id == "default_user" or session_id == "test":
-        session_id = str(uuid.uuid4())
-        print(f"[Session] 生成新会话ID: {session_id}")
-
-    # 定义要保留的对话轮数
-    MAX_HISTORY_TURNS = 3
-    query_limit = MAX_HISTORY_TURNS * 2
-
-    # 查询最近的对话消息（按时间正序排列）
-    history_messages = db.query(ChatMessage) \
-        .filter(ChatMessage.session_id == session_id) \
-        .order_by(ChatMessage.created_at.asc()) \
-        .limit(query_limit) \
-        .all()
-
-    # 构建消息列表
-    messages_for_ai = []
-
-    # 如果是第一次对话，添加一个简单的系统提示
-    if len(history_messages) == 0:
-        messages_for_ai.append({
-            "role": "system",
-            "content": "你是一个友好的AI助手，请直接回答用户的问题，保持对话自然流畅。"
+    """
+    聊天 API 接口；客户端断开时取消对话，超过时限返回 504。
+    带 Idempotency-Key 时同一个键只调用一次AI：进行中的重复请求等待同一结果，
+    之后的重试重放保存的响应（响应头 Idempotent-Replayed: true），客户端断开也不取消这一轮。
+    """
+    idempotency_key = http_request.headers.get(IdempotencyConfig.HEADER)
+    session_id = resolve_session_id(request.session_id, request.user_id)
+    try:
+        # 会话元数据在后台合并写入；返回前等它落库，客户端紧接着的条件请求不会拿旧版本命中 304
+        if idempotency_key is None:
+            result = await cancel_on_disconnect(
+                http_request,
+                run_chat_turn(shards, session_id, request.message, user_id=request.user_id)
+            )
+            await catalog_writer.sync()
+            return result
+
+        result, replayed = await cancel_on_disconnect(http_request, run_keyed_chat_turn(
+            idempotency_store.validate_key(idempotency_key), session_id, request.message,
+            user_id=request.user_id, requested_session_id=request.session_id
+        ))
+        await catalog_writer.sync()
+        if replayed:
+            return JSONResponse(content=result, headers={"Idempotent-Replayed": "true"})
+        return result
+    except IdempotencyConflict as e:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        return JSONResponse(status_code=e.status_code, headers=headers, content={
+            "status": "error",
+            "session_id": request.session_id,
+            "error": e.detail
+        })
+    except DeadlineExceeded as e:
+        shards.rollback()
+        return JSONResponse(status_code=status.HTTP_504_GATEWAY_TIMEOUT, content={
+            "status": "error",
+            "session_id": session_id,
+            "error": str(e)
+        })
+    except ClientDisconnected:
+        shards.rollback()
+        # 客户端已经不在了，这个响应不会被读取（499 沿用 nginx 的约定）
+        return Response(status_code=499)
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise  # 本请求自身被取消
+        # 本请求合并到的那一次相同提交被取消了
+        return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={
+            "status": "error",
+            "session_id": session_id,
+            "error": "相同内容的进行中请求已被取消，请重试"
         })
 
-    # 添加历史消息
-    messages_for_ai.extend([
-        {"role": msg.role, "content": msg.content}
-        for msg in history_messages
-    ])
-
-    # 添加当前用户消息
-    messages_for_ai.append({"role": "user", "content": request.message})
-
-    print(f"[Context] 会话ID: {session_id}, 准备 {len(messages_for_ai)} 条上下文消息。")
-
-    # 保存用户消息到数据库
-    user_msg = ChatMessage(
-        session_id=session_id,
-        role="user",
-        content=request.message
-    )
-    db.add(user_msg)
-    db.commit()
-
-    # 4. 调用AI获取回复
-    print(f"[LLM] 调用AI，消息数量: {len(messages_for_ai)}")
-    print(f"[LLM] 最后一条用户消息: {request.message}")
-
-    client = get_llm_client()
-    ai_reply = await client.chat(messages_for_ai)
-
-    print(f"[LLM] AI回复长度: {len(ai_reply)} 字符")
-    print(f"[LLM] AI回复前200字符: {ai_reply[:200]}")
-
-    # 保存AI回复
-    ai_msg = ChatMessage(
-        session_id=session_id,
-        role="assistant",
-        content=ai_reply
-    )
-    db.add(ai_msg)
-    db.commit()
 
-    return {
-        "reply": ai_reply,
-        "session_id": session_id,
-        "history_length": len(history_messages) + 2,
-        "status": "success",
-        "reply_length": len(ai_reply)  # 添加回复长度便于调试
-    }
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """聊天 WebSocket 通道：消息、流式回复和会话列表更新共用一条连接"""
+    await handle_chat_socket(websocket)
 
 
 @app.get("/api/sessions")
 async def get_sessions(
+        request: Request,
         page: int = Query(1, ge=1, description="页码"),
         page_size: int = Query(20, ge=1, le=100, description="每页数量"),
         sort_by: str = Query("last_activity", description="排序字段: last_activity, message_count"),
         order: str = Query("desc", description="排序方向: asc, desc"),
-        db: Session = Depends(get_db)
+        user_id: Optional[str] = Query(None, description="只列出该用户的会话"),
+        shards: ShardSet = Depends(get_shards)
 ):
-    """获取分页会话列表"""
+    """获取分页会话列表（各分片并发聚合后归并）；指定 user_id 时只读该用户的会话索引"""
+    if user_id is not None:
+        return await user_sessions_page(request, shards, user_id, page, page_size, sort_by, order)
+
+    db = shards.catalog
     try:
         # 计算分页
         offset = (page - 1) * page_size
 
-        # 获取会话统计
-        from sqlalchemy import func
+        # 先记下当前变更序号，客户端从这里开始增量同步
+        change_seq = current_seq(db)
 
-        query = db.query(
-            ChatMessage.session_id,
-            func.max(ChatMessage.created_at).label('last_activity'),
-            func.count(ChatMessage.id).label('message_count'),
-            func.max(ChatMessage.content).label('last_message_preview')
-        ).group_by(ChatMessage.session_id)
+        # 全局变更序号未变时列表不可能变化，直接返回 304
+        etag = make_negotiated_etag(request, "sessions", change_seq, page, page_size, sort_by, order)
+        if etag_matches(request, etag):
+            return not_modified(etag)
 
         # 排序
-        if sort_by == "last_activity":
-            order_by_field = func.max(ChatMessage.created_at)
-        elif sort_by == "message_count":
+        if sort_by == "message_count":
             order_by_field = func.count(ChatMessage.id)
+            archived_order_field = ArchivedSession.message_count
+            sort_index = 2
         else:
             order_by_field = func.max(ChatMessage.created_at)
+            archived_order_field = ArchivedSession.last_activity
+            sort_index = 1
+        descending = order.lower() == "desc"
 
-        if order.lower() == "desc":
-            query = query.order_by(order_by_field.desc())
-        else:
-            query = query.order_by(order_by_field.asc())
+        def shard_page(shard_db):
+            # 获取会话统计；每个分片只需返回前 offset + page_size 个会话
+            query = shard_db.query(
+                ChatMessage.session_id,
+                func.max(ChatMessage.created_at).label('last_activity'),
+                func.count(ChatMessage.id).label('message_count'),
+                func.max(ChatMessage.content).label('last_message_preview')
+            ).group_by(ChatMessage.session_id)
+
+            # 已归档的冷会话以存根形式出现在列表中
+            archived_query = shard_db.query(
+                ArchivedSession.session_id,
+                ArchivedSession.last_activity,
+                ArchivedSession.message_count,
+                ArchivedSession.last_message
+            )
+
+            if descending:
+                query = query.order_by(order_by_field.desc())
+                archived_query = archived_query.order_by(archived_order_field.desc())
+            else:
+                query = query.order_by(order_by_field.asc())
+                archived_query = archived_query.order_by(archived_order_field.asc())
+
+            hot = [tuple(row) + (False,) for row in query.limit(offset + page_size).all()]
+            archived = [tuple(row) + (True,) for row in archived_query.limit(offset + page_size).all()]
+            return query.count() + archived_query.count(), hot, archived
 
-        # 分页
-        total_sessions = query.count()
-        sessions = query.offset(offset).limit(page_size).all()
+        results = await shards.scatter(shard_page)
+
+        # 分页：会话在分片间互不重叠，总数直接相加，各分片的有序结果归并
+        total_sessions = sum(count for count, _, _ in results)
+        merged = heapq.merge(
+            *(rows for _, hot, archived in results for rows in (hot, archived)),
+            key=lambda row: (row[sort_index] is not None, row[sort_index] or 0),
+            reverse=descending
+        )
+        sessions = list(itertools.islice(merged, offset, offset + page_size))
 
         # 格式化结果
         formatted_sessions = []
         for session in sessions:
-            session_id, last_activity, message_count, last_message = session
+            session_id, last_activity, message_count, last_message, archived = session
             formatted_sessions.append({
                 "session_id": session_id,
                 "last_activity": last_activity.isoformat() if last_activity else None,
                 "message_count": message_count,
                 "last_message": (last_message[:100] + "...") if last_message and len(last_message) > 100 else (
                             last_message or ""),
-                "created_date": last_activity.date().isoformat() if last_activity else None
+                "created_date": last_activity.date().isoformat() if last_activity else None,
+                "archived": archived
             })
 
-        return {
+        return negotiate_response(request, {
             "status": "success",
             "page": page,
             "page_size": page_size,
             "total_sessions": total_sessions,
             "total_pages": (total_sessions + page_size - 1) // page_size,
             "sessions": formatted_sessions,
-            "sort": {"by": sort_by, "order": order}
-        }
+            "sort": {"by": sort_by, "order": order},
+            "change_seq": change_seq
+        }, headers=cache_headers(etag))
 
     except Exception as e:
         print(f"[会话列表] 错误: {e}")
@@ -258,13 +372,154 @@ async def get_sessions(
             "sessions": []
         }
 
+async def user_sessions_page(request: Request, shards: ShardSet, user_id: str,
+                             page: int, page_size: int, sort_by: str, order: str):
+    """某个用户的会话分页：只读会话元数据的索引区间，不聚合消息表"""
+    db = shards.catalog
+    change_seq = current_seq(db)
+    etag = make_negotiated_etag(request, "user-sessions", user_id, change_seq, page, page_size, sort_by, order)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    total_sessions, rows = list_user_sessions(
+        db, user_id, (page - 1) * page_size, page_size, sort_by, order.lower() == "desc"
+    )
+
+    # 当前页中已归档的冷会话
+    archived = set()
+    for found in await shards.scatter_by_session(
+            [meta.session_id for meta in rows],
+            lambda shard_db, ids: [sid for (sid,) in shard_db.query(ArchivedSession.session_id)
+                                   .filter(ArchivedSession.session_id.in_(ids))]):
+        archived.update(found)
+
+    return negotiate_response(request, {
+        "status": "success",
+        "user_id": user_id,
+        "page": page,
+        "page_size": page_size,
+        "total_sessions": total_sessions,
+        "total_pages": (total_sessions + page_size - 1) // page_size,
+        "sessions": [{**session_entry(meta), "archived": meta.session_id in archived} for meta in rows],
+        "sort": {"by": sort_by, "order": order},
+        "change_seq": change_seq
+    }, headers=cache_headers(etag))
+
+
+@app.get("/api/users/{user_id}/sessions")
+async def get_user_sessions(
+        user_id: str,
+        request: Request,
+        page: int = Query(1, ge=1, description="页码"),
+        page_size: int = Query(20, ge=1, le=100, description="每页数量"),
+        sort_by: str = Query("last_activity", description="排序字段: last_activity, message_count"),
+        order: str = Query("desc", description="排序方向: asc, desc"),
+        shards: ShardSet = Depends(get_shards)
+):
+    """获取某个用户的分页会话列表"""
+    return await user_sessions_page(request, shards, user_id, page, page_size, sort_by, order)
+
+
+@app.get("/api/users/{user_id}/stats")
+async def get_user_statistics(user_id: str, db: Session = Depends(get_db)):
+    """某个用户的会话统计（只读会话元数据）"""
+    return {
+        "status": "success",
+        "statistics": user_session_stats(db, user_id)
+    }
+
+
+@app.delete("/api/users/{user_id}/sessions")
+async def delete_user_sessions(
+        user_id: str,
+        keep_latest: int = Query(0, ge=0, description="保留该用户最近N个会话"),
+        confirm: str = Query(None, description="确认密码"),
+        shards: ShardSet = Depends(get_shards)
+):
+    """删除某个用户的会话（可保留最近N个），其他用户的会话不受影响"""
+    if confirm != "CONFIRM_DELETE":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="需要确认密码 'CONFIRM_DELETE' 才能执行删除操作"
+        )
+
+    try:
+        session_ids = [sid for (sid,) in user_sessions_query(shards.catalog, user_id)
+                       .with_entities(ChatSession.session_id)
+                       .order_by(ChatSession.last_activity.desc())
+                       .offset(keep_latest)]
+
+        def delete_in_shard(shard_db, ids):
+            # 分块删除，避免 IN 列表超过 SQLite 的参数个数上限
+            count = 0
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                count += shard_db.query(ChatMessage).filter(
+                    ChatMessage.session_id.in_(chunk)
+                ).delete(synchronize_session=False)
+                count += delete_archived(shard_db, chunk)
+            return count
+
+        deleted_count = sum(await shards.scatter_by_session(session_ids, delete_in_shard)) if session_ids else 0
+        for i in range(0, len(session_ids), 500):
+            mark_sessions_deleted(shards.catalog, session_ids[i:i + 500])
+        shards.commit()
+        change_notifier.notify()
+
+        message = f"已删除用户 {user_id} 的 {len(session_ids)} 个会话，共 {deleted_count} 条消息"
+        print(f"[会话管理] {message}")
+        return {
+            "status": "success",
+            "user_id": user_id,
+            "deleted_sessions": len(session_ids),
+            "deleted_count": deleted_count,
+            "message": message
+        }
+
+    except Exception as e:
+        shards.rollback()
+        print(f"[会话管理] 删除用户会话失败: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"删除操作失败: {str(e)}"
+        )
+
+
+@app.get("/api/sessions/changes")
+async def get_session_changes(
+        since: int = Query(0, ge=0, description="上次同步到的变更序号"),
+        wait: float = Query(0, ge=0, description="没有变更时最长等待秒数（长轮询），0 表示立即返回"),
+        user_id: Optional[str] = Query(None, description="只同步该用户的会话"),
+        db: Session = Depends(get_db)
+):
+    """获取自 since 以来新建、更新或删除的会话"""
+    try:
+        result = await wait_for_changes(db, since, wait, user_id)
+        return {
+            "status": "success",
+            "since": since,
+            **result
+        }
+
+    except Exception as e:
+        print(f"[会话变更] 错误: {e}")
+        return {
+            "status": "error",
+            "error": str(e),
+            "changes": []
+        }
+
 @app.delete("/api/sessions/{session_id}")
-async def delete_session(session_id: str, db: Session = Depends(get_db)):
+async def delete_session(session_id: str, shards: ShardSet = Depends(get_shards)):
     """删除指定会话"""
-    deleted_count = db.query(ChatMessage).filter(
+    shard_db = shards.for_session(session_id)
+    deleted_count = shard_db.query(ChatMessage).filter(
         ChatMessage.session_id == session_id
     ).delete()
-    db.commit()
+    deleted_count += delete_archived(shard_db, [session_id])
+    mark_sessions_deleted(shards.catalog, [session_id])
+    shards.commit()
+    change_notifier.notify()
 
     return {
         "status": "success",
@@ -278,7 +533,7 @@ async def delete_sessions(
         action: str = Query("all", description="操作类型: all-全部, selected-选择, old-旧会话"),
         keep_latest: int = Query(0, description="保留最近N个会话"),
         confirm: str = Query(None, description="确认密码"),
-        db: Session = Depends(get_db)
+        shards: ShardSet = Depends(get_shards)
 ):
     """
     删除会话 - 多功能接口
@@ -287,6 +542,7 @@ async def delete_sessions(
     2. 保留最近N个会话
     3. 按条件删除（预留）
     """
+    db = shards.catalog
     try:
         # 安全检查
         if confirm != "CONFIRM_DELETE":
@@ -295,32 +551,38 @@ async def delete_sessions(
                 detail="需要确认密码 'CONFIRM_DELETE' 才能执行删除操作"
             )
 
-        total_before = db.query(ChatMessage).count()
-
         if action == "all":
             # 删除所有会话
-            deleted_count = db.query(ChatMessage).delete()
+            deleted_count = sum(await shards.scatter(
+                lambda shard_db: shard_db.query(ChatMessage).delete() + delete_archived(shard_db)
+            ))
+            mark_sessions_deleted(db)
             message = f"已删除所有 {deleted_count} 条消息"
 
         elif action == "keep_latest" and keep_latest > 0:
             # 保留最近N个会话
-            # 1. 先获取所有会话ID及最新消息时间
-            from sqlalchemy import func
-            session_stats = db.query(
+            # 1. 先获取各分片最近活跃的 N 个会话及最新消息时间
+            shard_stats = await shards.scatter(lambda shard_db: shard_db.query(
                 ChatMessage.session_id,
                 func.max(ChatMessage.created_at).label('last_activity')
             ).group_by(ChatMessage.session_id).order_by(
                 func.max(ChatMessage.created_at).desc()
-            ).all()
+            ).limit(keep_latest).all())
 
-            # 2. 确定要保留的会话
-            sessions_to_keep = [s[0] for s in session_stats[:keep_latest]]
+            # 2. 归并后确定要保留的会话
+            session_stats = heapq.merge(
+                *shard_stats,
+                key=lambda row: (row[1] is not None, row[1] or 0),
+                reverse=True
+            )
+            sessions_to_keep = [s[0] for s in itertools.islice(session_stats, keep_latest)]
 
             # 3. 删除其他会话
             if sessions_to_keep:
-                deleted_count = db.query(ChatMessage).filter(
+                deleted_count = sum(await shards.scatter(lambda shard_db: shard_db.query(ChatMessage).filter(
                     ~ChatMessage.session_id.in_(sessions_to_keep)
-                ).delete()
+                ).delete(synchronize_session=False) + delete_archived(shard_db, keep=sessions_to_keep)))
+                mark_sessions_deleted(db, keep=sessions_to_keep)
             else:
                 deleted_count = 0
 
@@ -332,8 +594,9 @@ async def delete_sessions(
                 detail=f"不支持的操作类型: {action}"
             )
 
-        db.commit()
-        total_after = db.query(ChatMessage).count()
+        shards.commit()
+        change_notifier.notify()
+        total_after = sum(await shards.scatter(lambda shard_db: shard_db.query(ChatMessage).count()))
 
         print(f"[会话管理] {message}")
 
@@ -348,7 +611,7 @@ async def delete_sessions(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        shards.rollback()
         print(f"[会话管理] 删除失败: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -359,7 +622,7 @@ async def delete_sessions(
 @app.delete("/api/sessions/batch")
 async def delete_sessions_batch(
         request: BatchDeleteRequest,
-        db: Session = Depends(get_db)
+        shards: ShardSet = Depends(get_shards)
 ):
     """
     批量删除指定会话
@@ -377,15 +640,19 @@ async def delete_sessions_batch(
                 detail="需要确认密码 'CONFIRM_DELETE' 才能执行批量删除"
             )
 
-        deleted_count = 0
-        for session_id in request.session_ids:
-            count = db.query(ChatMessage).filter(
-                ChatMessage.session_id == session_id
-            ).delete()
-            deleted_count += count
-            print(f"[批量删除] 删除会话 {session_id}: {count} 条消息")
+        def delete_in_shard(shard_db, session_ids):
+            count = shard_db.query(ChatMessage).filter(
+                ChatMessage.session_id.in_(session_ids)
+            ).delete(synchronize_session=False)
+            count += delete_archived(shard_db, session_ids)
+            print(f"[批量删除] 删除 {len(session_ids)} 个会话: {count} 条消息")
+            return count
 
-        db.commit()
+        deleted_count = sum(await shards.scatter_by_session(request.session_ids, delete_in_shard))
+
+        mark_sessions_deleted(shards.catalog, request.session_ids)
+        shards.commit()
+        change_notifier.notify()
 
         return {
             "status": "success",
@@ -397,7 +664,7 @@ async def delete_sessions_batch(
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        shards.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"批量删除失败: {str(e)}"
@@ -408,19 +675,59 @@ async def delete_sessions_batch(
 @app.get("/api/sessions/{session_id}/messages")
 async def get_session_messages(
         session_id: str,
-        db: Session = Depends(get_db),
-        limit: int = 100
+        request: Request,
+        shards: ShardSet = Depends(get_shards),
+        limit: int = 100,
+        before_id: Optional[int] = Query(None, ge=1, description="只返回ID小于它的消息（向前翻页）"),
+        tail: bool = Query(False, description="返回最新的 limit 条消息")
 ):
-    """获取特定会话的所有消息"""
+    """
+    获取特定会话的消息。默认从最早的消息开始返回 limit 条；
+    tail=true 返回最新一页，before_id 返回该消息之前的一页（按消息ID分页，每页开销与会话长度无关），
+    这两种方式的结果仍按时间正序排列，并带 has_more 表示是否还有更早的消息。
+    """
     try:
         print(f"[API] 获取会话消息: {session_id}")
-
-        # 查询该会话的所有消息，按时间正序排列
-        messages = db.query(ChatMessage) \
-            .filter(ChatMessage.session_id == session_id) \
-            .order_by(ChatMessage.created_at.asc()) \
-            .limit(limit) \
-            .all()
+        paged = tail or before_id is not None
+
+        # 会话版本未变时不加载消息，直接返回 304
+        etag = make_negotiated_etag(request, "messages", session_id, session_version(shards.catalog, session_id),
+                                    limit, before_id, tail)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        db = shards.for_session(session_id)
+
+        def load_messages():
+            query = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+            if not paged:
+                # 查询该会话的所有消息，按时间正序排列
+                return query.order_by(ChatMessage.created_at.asc()).limit(limit).all()
+            # 从新到旧多取一条判断是否还有更早的消息；会话索引按 rowid 有序，不需要额外排序
+            if before_id is not None:
+                query = query.filter(ChatMessage.id < before_id)
+            return query.order_by(ChatMessage.id.desc()).limit(limit + 1).all()
+
+        def page_archived(archived):
+            """对归档中的消息做与 load_messages 相同的分页"""
+            if not paged:
+                return archived[:limit]
+            if before_id is not None:
+                archived = [m for m in archived if m.id is not None and m.id < before_id]
+            return archived[::-1][:limit + 1]
+
+        messages = load_messages()
+
+        # 冷会话：只读地从归档中取出消息，GET 不写库；继续对话时才还原回热表
+        if not messages:
+            archived = load_archived(db, session_id)
+            if archived is not None:
+                messages = page_archived(archived)
+
+        extra = {}
+        if paged:
+            extra["has_more"] = len(messages) > limit
+            messages = messages[:limit][::-1]
 
         print(f"[API] 找到 {len(messages)} 条消息")
 
@@ -442,12 +749,13 @@ async def get_session_messages(
 
             formatted_messages.append(formatted_msg)
 
-        return {
+        return negotiate_response(request, {
             "session_id": session_id,
             "messages": formatted_messages,
             "count": len(formatted_messages),
+            **extra,
             "status": "success"
-        }
+        }, headers=cache_headers(etag))
 
     except Exception as e:
         print(f"[API] 错误: {str(e)}")
@@ -461,53 +769,19 @@ async def get_session_messages(
 @app.get("/api/sessions/{session_id}/summary")
 async def get_session_summary(
         session_id: str,
+        request: Request,
+        response: Response,
         db: Session = Depends(get_db)
 ):
     """获取会话摘要信息"""
     try:
-        # 获取会话中的消息数量
-        total_messages = db.query(ChatMessage) \
-            .filter(ChatMessage.session_id == session_id) \
-            .count()
-
-        # 获取第一条和最后一条消息的时间
-        first_message = db.query(ChatMessage) \
-            .filter(ChatMessage.session_id == session_id) \
-            .order_by(ChatMessage.created_at.asc()) \
-            .first()
-
-        last_message = db.query(ChatMessage) \
-            .filter(ChatMessage.session_id == session_id) \
-            .order_by(ChatMessage.created_at.desc()) \
-            .first()
-
-        # 获取第一条用户消息作为会话标题
-        first_user_message = db.query(ChatMessage) \
-            .filter(
-            ChatMessage.session_id == session_id,
-            ChatMessage.role == "user"
-        ) \
-            .order_by(ChatMessage.created_at.asc()) \
-            .first()
-
-        # 安全处理时间字段
-        created_at = None
-        if first_message and first_message.created_at:
-            created_at = first_message.created_at.isoformat()
-
-        last_activity = None
-        if last_message and last_message.created_at:
-            last_activity = last_message.created_at.isoformat()
-
-        summary = {
-            "session_id": session_id,
-            "total_messages": total_messages,
-            "created_at": created_at,
-            "last_activity": last_activity,
-            "title": first_user_message.content[:50] + "..." if first_user_message and len(
-                first_user_message.content) > 50 else (first_user_message.content if first_user_message else "新会话")
-        }
+        etag = make_etag("summary", session_id, session_version(db, session_id))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        summary = load_session_summaries(db, [session_id])[session_id]
 
+        apply_cache_headers(response, etag)
         return {
             "session_id": session_id,
             "summary": summary,
@@ -523,47 +797,101 @@ async def get_session_summary(
         }
 
 
+@app.post("/api/sessions/summaries")
+async def get_session_summaries(
+        request: SessionSummariesRequest,
+        db: Session = Depends(get_db)
+):
+    """批量获取会话摘要，所有会话在一次查询中取出"""
+    if len(request.session_ids) > SessionConfig.MAX_SUMMARY_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"单次最多获取 {SessionConfig.MAX_SUMMARY_BATCH} 个会话的摘要"
+        )
+
+    try:
+        summaries = load_session_summaries(db, request.session_ids)
+        return {
+            "summaries": [summaries[sid] for sid in dict.fromkeys(request.session_ids)],
+            "count": len(summaries),
+            "status": "success"
+        }
+
+    except Exception as e:
+        print(f"[API Session Summaries] 错误: {str(e)}")
+        return {
+            "error": str(e),
+            "status": "error"
+        }
+
+
 @app.get("/api/sessions/stats")
-async def get_session_statistics(db: Session = Depends(get_db)):
+async def get_session_statistics(shards: ShardSet = Depends(get_shards)):
     """
-    获取会话统计信息
+    获取会话统计信息（各分片并发统计后汇总）
     """
     try:
-        # 总消息数
-        total_messages = db.query(ChatMessage).count()
-
-        # 总会话数
-        total_sessions = db.query(ChatMessage.session_id).distinct().count()
-
-        # 今日消息数
         from datetime import datetime, timedelta
         today = datetime.utcnow().date()
-        today_messages = db.query(ChatMessage).filter(
-            func.date(ChatMessage.created_at) == today
-        ).count()
-
-        # 消息类型分布
-        user_messages = db.query(ChatMessage).filter(
-            ChatMessage.role == "user"
-        ).count()
-        assistant_messages = db.query(ChatMessage).filter(
-            ChatMessage.role == "assistant"
-        ).count()
-
-        # 最近活跃的会话
-        recent_sessions = db.query(
-            ChatMessage.session_id,
-            func.max(ChatMessage.created_at).label('last_activity'),
-            func.count(ChatMessage.id).label('message_count')
-        ).group_by(ChatMessage.session_id).order_by(
-            func.max(ChatMessage.created_at).desc()
-        ).limit(10).all()
+
+        def shard_stats(db):
+            # 总消息数
+            total_messages = db.query(ChatMessage).count()
+
+            # 总会话数（会话按ID落在唯一分片，可以直接相加）
+            total_sessions = db.query(ChatMessage.session_id).distinct().count()
+
+            # 今日消息数
+            today_messages = db.query(ChatMessage).filter(
+                func.date(ChatMessage.created_at) == today
+            ).count()
+
+            # 消息类型分布
+            user_messages = db.query(ChatMessage).filter(
+                ChatMessage.role == "user"
+            ).count()
+            assistant_messages = db.query(ChatMessage).filter(
+                ChatMessage.role == "assistant"
+            ).count()
+
+            # 最近活跃的会话
+            recent_sessions = db.query(
+                ChatMessage.session_id,
+                func.max(ChatMessage.created_at).label('last_activity'),
+                func.count(ChatMessage.id).label('message_count')
+            ).group_by(ChatMessage.session_id).order_by(
+                func.max(ChatMessage.created_at).desc()
+            ).limit(10).all()
+
+            # 归档层：会话数、消息数、原始 / 压缩后字节数
+            archive = db.query(
+                func.count(ArchivedSession.session_id),
+                func.coalesce(func.sum(ArchivedSession.message_count), 0),
+                func.coalesce(func.sum(ArchivedSession.raw_size), 0),
+                func.coalesce(func.sum(func.length(ArchivedSession.payload)), 0)
+            ).one()
+
+            return (total_messages, total_sessions, today_messages, user_messages,
+                    assistant_messages, [tuple(r) for r in recent_sessions], tuple(archive))
+
+        results = await shards.scatter(shard_stats)
+        total_messages, total_sessions, today_messages, user_messages, assistant_messages = (
+            sum(r[k] for r in results) for k in range(5)
+        )
+        recent_sessions = heapq.nlargest(
+            10,
+            itertools.chain.from_iterable(r[5] for r in results),
+            key=lambda s: s[1] or datetime.min
+        )
+        archived_sessions, archived_messages, archived_raw, archived_stored = (
+            sum(r[6][k] for r in results) for k in range(4)
+        )
 
         return {
             "status": "success",
             "statistics": {
-                "total_messages": total_messages,
-                "total_sessions": total_sessions,
+                "total_messages": total_messages + archived_messages,
+                "total_sessions": total_sessions + archived_sessions,
                 "today_messages": today_messages,
                 "message_distribution": {
                     "user": user_messages,
@@ -576,7 +904,13 @@ async def get_session_statistics(db: Session = Depends(get_db)):
                         "message_count": s[2]
                     }
                     for s in recent_sessions
-                ]
+                ],
+                "archive": {
+                    "sessions": archived_sessions,
+                    "messages": archived_messages,
+                    "raw_bytes": archived_raw,
+                    "stored_bytes": archived_stored
+                }
             }
         }
 
@@ -587,6 +921,141 @@ async def get_session_statistics(db: Session = Depends(get_db)):
             "error": str(e)
         }
 
+@app.get("/api/llm/cache-stats")
+async def get_prompt_cache_stats():
+    """服务端前缀缓存的整体命中情况（进程启动以来）"""
+    return {
+        "status": "success",
+        "cache": cache_stats.overall()
+    }
+
+
+@app.get("/api/sessions/{session_id}/cache-stats")
+async def get_session_prompt_cache_stats(session_id: str):
+    """单个会话的前缀缓存命中情况"""
+    stats = cache_stats.session(session_id)
+    return {
+        "status": "success" if stats else "not_found",
+        "session_id": session_id,
+        "cache": stats
+    }
+
+
+@app.get("/api/chat/cancellations")
+async def get_cancelled_turns(
+        session_id: Optional[str] = Query(None, description="只看某个会话"),
+        limit: int = Query(50, ge=1, le=500, description="返回条数"),
+        db: Session = Depends(get_db)
+):
+    """最近被取消或超时的对话轮次（含未完成的回复片段）"""
+    query = db.query(CancelledTurn)
+    if session_id:
+        query = query.filter(CancelledTurn.session_id == session_id)
+    rows = query.order_by(CancelledTurn.id.desc()).limit(limit).all()
+    return {
+        "status": "success",
+        "cancellations": [
+            {
+                "session_id": row.session_id,
+                "reason": row.reason,
+                "stage": row.stage,
+                "partial_reply": row.partial_reply,
+                "elapsed_ms": row.elapsed_ms,
+                "created_at": row.created_at.isoformat() if row.created_at else None
+            }
+            for row in rows
+        ]
+    }
+
+
+@app.get("/api/speech/stats")
+async def get_speech_stats():
+    """语音输出的首段延迟统计"""
+    return {
+        "status": "success",
+        "speech": speech_stats.summary()
+    }
+
+
+@app.post("/api/batch/jobs")
+async def create_batch_job(request: BatchJobRequest):
+    """提交批量对话任务，立即返回任务ID，结果通过轮询或流式接口获取"""
+    try:
+        job = create_job(request.items, request.max_tokens)
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"无效的批量任务: {e}")
+    batch_runner.enqueue(job)
+    return {"status": "success", "job": job_entry(job)}
+
+
+@app.get("/api/batch/jobs/{job_id}")
+async def get_batch_job(
+        job_id: str,
+        include_results: bool = Query(False, description="是否返回结果"),
+        offset: int = Query(0, ge=0, description="按提交顺序跳过的条数"),
+        limit: int = Query(100, ge=1, le=1000, description="每次返回的结果数"),
+        db: Session = Depends(get_db)
+):
+    """查询批量任务进度，可按提交顺序分页返回结果"""
+    job = db.get(BatchJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    result = {"status": "success", "job": job_entry(job)}
+    if include_results:
+        items = db.query(BatchItem).filter(BatchItem.job_id == job_id) \
+            .order_by(BatchItem.item_index).offset(offset).limit(limit).all()
+        result["results"] = [item_entry(item) for item in items]
+    return result
+
+
+@app.get("/api/batch/jobs/{job_id}/stream")
+async def stream_batch_job(
+        job_id: str,
+        after_seq: int = Query(0, ge=0, description="从这个完成序号之后开始返回（断线续传）")
+):
+    """以 NDJSON 流式返回已完成的结果（按完成顺序），任务结束后输出任务状态并关闭"""
+    db = SessionLocal()
+    try:
+        if db.get(BatchJob, job_id) is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    finally:
+        db.close()
+
+    def read(last_seq):
+        db = SessionLocal()
+        try:
+            job = db.get(BatchJob, job_id)
+            items = db.query(BatchItem).filter(
+                BatchItem.job_id == job_id, BatchItem.done_seq > last_seq
+            ).order_by(BatchItem.done_seq).limit(500).all()
+            return job_entry(job), [item_entry(item) for item in items]
+        finally:
+            db.close()
+
+    async def generate():
+        last_seq = after_seq
+        while True:
+            job, items = read(last_seq)
+            for item in items:
+                last_seq = item["seq"]
+                yield json.dumps({"type": "result", **item}, ensure_ascii=False) + "\n"
+            if not items and job["status"] in FINAL_STATUSES:
+                yield json.dumps({"type": "job", **job}, ensure_ascii=False) + "\n"
+                return
+            if not items:
+                await batch_runner.wait_for_update(timeout=5)
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.delete("/api/batch/jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """取消批量任务，已完成的结果保留"""
+    if not batch_runner.cancel(job_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="任务不存在")
+    return {"status": "success", "message": f"任务 {job_id} 已取消"}
+
+
 if __name__ == "__main__":
     # 初始化数据库
     try:
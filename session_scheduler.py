@@ -0,0 +1,96 @@
+# session_scheduler.py
+# 按会话串行、跨会话并行的调度器：同一会话的对话轮次排队执行，重复提交合并为一次
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+
+class QueueTimeout(Exception):
+    """排队等待会话锁超时"""
+
+
+class _KeyLock:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class SessionScheduler:
+    """
+    每个会话一把带引用计数的锁，最后一个使用者释放后即删除，
+    空闲会话不占内存。不同会话之间互不阻塞。
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, _KeyLock] = {}
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    @property
+    def active_sessions(self) -> int:
+        """正在执行或排队的会话数"""
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def session_lock(self, session_id: str, timeout: Optional[float] = None):
+        """获取会话锁；指定 timeout 时最多等待这么久，超时抛出 QueueTimeout"""
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = _KeyLock()
+        entry.refs += 1
+        try:
+            try:
+                await asyncio.wait_for(entry.lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise QueueTimeout(session_id) from None
+            try:
+                yield
+            finally:
+                entry.lock.release()
+        finally:
+            entry.refs -= 1
+            if entry.refs == 0:
+                del self._locks[session_id]
+
+    async def submit(self, session_id: str, dedup_key: str, factory: Callable[[], Awaitable],
+                     timeout: Optional[float] = None):
+        """
+        在会话锁内执行 factory()。
+        同一会话中 dedup_key 相同且仍在排队或执行的提交会直接等待已有结果，不再重复执行。
+        timeout 限制排队等锁的时间，超时抛出 QueueTimeout，factory 不会执行。
+        """
+        key = (session_id, dedup_key)
+        existing = self._inflight.get(key)
+        if existing is not None:
+            print(f"[Scheduler] 会话 {session_id} 的重复提交已合并")
+            # shield：重复请求被取消时不影响正在执行的那一次
+            return await asyncio.shield(existing)
+
+        future = asyncio.get_running_loop().create_future()
+        # 没有重复请求等待时，避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+
+        try:
+            async with self.session_lock(session_id, timeout):
+                result = await factory()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
+
+
+def message_key(*parts: str) -> str:
+    """由消息内容等生成去重键"""
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+scheduler = SessionScheduler()
@@ -0,0 +1,563 @@
+# session_store.py
+# 会话元数据与全局变更序号：每次消息写入或删除都会推进序号，客户端据此增量同步会话列表。
+# 消息写入产生的元数据更新由 catalog_writer 在后台合并后批量写入主库
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, func, insert, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from config import ChangeFeedConfig, SessionConfig
+from models import ChatMessage, ChatSession, ChangeCounter
+
+
+def _preview(text: Optional[str], length: int) -> str:
+    if not text:
+        return ""
+    return text[:length] + "..." if len(text) > length else text
+
+
+def next_seq(db: Session, count: int = 1) -> int:
+    """在当前事务中把全局变更序号推进 count 个并返回最后一个（本次分配的是 新值-count+1 .. 新值）"""
+    db.execute(
+        update(ChangeCounter)
+        .where(ChangeCounter.id == 1)
+        .values(seq=ChangeCounter.seq + count)
+    )
+    return db.query(ChangeCounter.seq).filter(ChangeCounter.id == 1).scalar()
+
+
+def current_seq(db: Session) -> int:
+    return db.query(ChangeCounter.seq).filter(ChangeCounter.id == 1).scalar() or 0
+
+
+def session_version(db: Session, session_id: str) -> int:
+    """会话的当前版本（最近一次变更序号），不存在的会话为 0；只做一次主键查询"""
+    return db.query(ChatSession.change_seq).filter(ChatSession.session_id == session_id).scalar() or 0
+
+
+def session_update(message: ChatMessage, user_id: Optional[str] = None) -> dict:
+    """一条新消息对会话元数据的更新，可与同一会话的后续更新合并（merge_update）"""
+    now = message.created_at or datetime.utcnow()
+    return {
+        "session_id": message.session_id,
+        "user_id": user_id,
+        "count": 1,
+        "first_at": now,
+        "last_at": now,
+        "title": _preview(message.content, 50) if message.role == "user" else None,
+        "last_message": _preview(message.content, 100)
+    }
+
+
+def merge_update(earlier: dict, later: dict) -> dict:
+    return {
+        "session_id": earlier["session_id"],
+        "user_id": earlier["user_id"] or later["user_id"],
+        "count": earlier["count"] + later["count"],
+        "first_at": earlier["first_at"],
+        "last_at": later["last_at"],
+        "title": earlier["title"] or later["title"],
+        "last_message": later["last_message"]
+    }
+
+
+def apply_session_updates(db: Session, updates: List[dict]) -> int:
+    """
+    在一个事务中写入一批会话更新（调用方负责提交），每个会话分配一个新的变更序号，返回写入的会话数。
+    删除之前写入的消息（删除时间晚于这批消息）不会让墓碑复活。
+    """
+    if not updates:
+        return 0
+    metas = {}
+    session_ids = [u["session_id"] for u in updates]
+    for start in range(0, len(session_ids), 500):
+        metas.update((meta.session_id, meta) for meta in db.query(ChatSession).filter(
+            ChatSession.session_id.in_(session_ids[start:start + 500])))
+
+    applied = []
+    for u in updates:
+        meta = metas.get(u["session_id"])
+        if meta is None:
+            meta = metas[u["session_id"]] = ChatSession(session_id=u["session_id"], message_count=0)
+            db.add(meta)
+        elif meta.deleted and meta.last_activity and u["first_at"] <= meta.last_activity:
+            continue
+
+        if meta.deleted or not meta.message_count:
+            # 新会话，或已删除后又被重新使用的会话
+            meta.deleted = False
+            meta.message_count = 0
+            meta.title = None
+            meta.created_at = u["first_at"]
+            meta.user_id = u["user_id"]
+
+        if meta.user_id is None:
+            meta.user_id = u["user_id"]
+        if meta.title is None:
+            meta.title = u["title"]
+        meta.message_count += u["count"]
+        meta.last_activity = u["last_at"]
+        meta.last_message = u["last_message"]
+        applied.append(meta)
+
+    if applied:
+        last = next_seq(db, len(applied))
+        for seq, meta in enumerate(applied, start=last - len(applied) + 1):
+            meta.change_seq = seq
+    return len(applied)
+
+
+def _write_session_updates(updates: List[dict]) -> int:
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        applied = apply_session_updates(db, updates)
+        db.commit()
+        return applied
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class CatalogWriter:
+    """
+    会话元数据的合并写入。消息只在所属分片的事务中提交，主库中的会话元数据和变更序号
+    由后台协程按批写入：同一会话的多条消息合并成一次更新，一批只取一次主库写锁、
+    只更新一次全局计数行，各分片上的对话不再逐条消息争用主库写锁。
+    未启动时（脚本、测试）在调用处同步写入。
+    """
+
+    def __init__(self):
+        self.pending: Dict[str, dict] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.flush_needed: Optional[asyncio.Event] = None
+        self.flushed: Optional[asyncio.Event] = None  # 每次写库后替换，供 sync 等待
+        self.inflight: Dict[str, Optional[str]] = {}  # 正在写入的会话 -> 所属用户
+        self.recorded = 0  # 已记录的更新数
+        self.written = 0  # 已写入主库的更新数
+
+    @property
+    def started(self) -> bool:
+        return self.task is not None
+
+    def start(self):
+        if self.started:
+            return
+        self.flush_needed = asyncio.Event()
+        self.flushed = asyncio.Event()
+        self.task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self._flush()
+
+    def record(self, message: ChatMessage, user_id: Optional[str] = None):
+        """记录一条已提交消息对会话元数据的更新"""
+        update = session_update(message, user_id)
+        if not self.started:
+            _write_session_updates([update])
+            change_notifier.notify()
+            return
+        pending = self.pending.get(message.session_id)
+        self.pending[message.session_id] = merge_update(pending, update) if pending else update
+        self.recorded += 1
+        if len(self.pending) >= SessionConfig.CATALOG_FLUSH_SIZE:
+            self.flush_needed.set()
+
+    def discard(self, session_ids: Optional[Iterable[str]] = None, keep: Iterable[str] = ()) -> Dict[str, Optional[str]]:
+        """
+        删除会话时丢弃它们尚未写入的更新（session_ids 为 None 时丢弃 keep 以外的全部），
+        返回被丢弃或正在写入的会话及其所属用户：这些会话在主库中可能还没有元数据
+        """
+        keep = set(keep)
+        if session_ids is None:
+            dropped = {sid: u["user_id"] for sid, u in self.pending.items() if sid not in keep}
+            self.pending = {sid: u for sid, u in self.pending.items() if sid in keep}
+            dropped.update((sid, user_id) for sid, user_id in self.inflight.items() if sid not in keep)
+            return dropped
+        dropped = {}
+        for session_id in set(session_ids) - keep:
+            update = self.pending.pop(session_id, None)
+            if update is not None:
+                dropped[session_id] = update["user_id"]
+            if session_id in self.inflight:
+                dropped[session_id] = self.inflight[session_id]
+        return dropped
+
+    async def sync(self, timeout: float = 2.0):
+        """等待此前记录的更新写入主库（最多 timeout 秒），用于需要立即读到最新元数据的场合"""
+        if not self.started:
+            return
+        target = self.recorded
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.written < target and loop.time() < deadline:
+            flushed = self.flushed
+            self.flush_needed.set()
+            try:
+                await asyncio.wait_for(flushed.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_needed.wait(), SessionConfig.CATALOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_needed.clear()
+            await self._flush()
+
+    async def _flush(self):
+        if not self.pending:
+            return
+        updates, self.pending = self.pending, {}
+        recorded = self.recorded
+        self.inflight = {sid: u["user_id"] for sid, u in updates.items()}
+        try:
+            await run_in_threadpool(_write_session_updates, list(updates.values()))
+        except Exception as e:
+            self.inflight = {}
+            print(f"[Sessions] 写入会话元数据失败，下次重试: {type(e).__name__}: {e}")
+            for session_id, update in updates.items():
+                later = self.pending.get(session_id)
+                self.pending[session_id] = merge_update(update, later) if later else update
+            return
+        self.inflight = {}
+        self.written = recorded
+        change_notifier.notify()
+        if self.flushed is not None:
+            self.flushed.set()
+            self.flushed = asyncio.Event()
+
+
+def mark_sessions_deleted(db: Session, session_ids: Optional[Iterable[str]] = None,
+                          keep: Optional[Iterable[str]] = None) -> int:
+    """
+    把会话标记为已删除（墓碑）。
+    session_ids 为 None 时作用于全部会话，keep 中的会话除外。调用方负责提交，
+    提交后这些会话的长期记忆随之清除（回滚时保留）。
+    """
+    query = db.query(ChatSession).filter(ChatSession.deleted.is_(False))
+    if session_ids is not None:
+        session_ids = list(session_ids)
+        if not session_ids:
+            return 0
+        query = query.filter(ChatSession.session_id.in_(session_ids))
+    if keep:
+        query = query.filter(~ChatSession.session_id.in_(list(keep)))
+
+    # 尚未写入的元数据更新直接丢弃；这些会话若还没有元数据先补一行，与其他会话一起写墓碑、
+    # 清除记忆，正在写入、删除之后才落库的更新会因墓碑被忽略
+    unwritten = catalog_writer.discard(session_ids, keep or ())
+    if unwritten:
+        db.execute(insert(ChatSession).prefix_with("OR IGNORE"), [
+            {"session_id": sid, "user_id": user_id, "message_count": 0, "deleted": False}
+            for sid, user_id in unwritten.items()
+        ])
+
+    sessions_by_user: Dict[Optional[str], List[str]] = {}
+    for user_id, session_id in query.with_entities(ChatSession.user_id, ChatSession.session_id):
+        sessions_by_user.setdefault(user_id, []).append(session_id)
+    if sessions_by_user:
+        _after_commit(db, lambda: _forget_memories(sessions_by_user))
+
+    seq = next_seq(db)
+    return query.update({
+        ChatSession.deleted: True,
+        ChatSession.message_count: 0,
+        ChatSession.last_activity: datetime.utcnow(),  # 墓碑的 last_activity 记录删除时间
+        ChatSession.change_seq: seq
+    }, synchronize_session=False)
+
+
+def _after_commit(db: Session, callback):
+    """在 db 的当前事务提交后执行一次 callback，事务回滚则放弃"""
+    def on_commit(session):
+        event.remove(db, "after_soft_rollback", on_rollback)
+        callback()
+
+    def on_rollback(session, previous_transaction):
+        event.remove(db, "after_commit", on_commit)
+
+    event.listen(db, "after_commit", on_commit, once=True)
+    event.listen(db, "after_soft_rollback", on_rollback, once=True)
+
+
+def _forget_memories(sessions_by_user: Dict[Optional[str], List[str]]):
+    from memory import forget_sessions
+    try:
+        forget_sessions(sessions_by_user)
+    except Exception as e:
+        print(f"[Memory] 清除已删除会话的记忆失败: {type(e).__name__}: {e}")
+
+
+def session_entry(meta: ChatSession) -> dict:
+    """会话元数据转换为会话列表条目，格式与 /api/sessions 一致"""
+    last_activity = meta.last_activity
+    return {
+        "session_id": meta.session_id,
+        "user_id": meta.user_id,
+        "last_activity": last_activity.isoformat() if last_activity else None,
+        "message_count": meta.message_count,
+        "last_message": meta.last_message or "",
+        "created_date": last_activity.date().isoformat() if last_activity else None,
+        "title": meta.title or "新会话"
+    }
+
+
+def empty_summary(session_id: str) -> dict:
+    return {
+        "session_id": session_id,
+        "total_messages": 0,
+        "created_at": None,
+        "last_activity": None,
+        "title": "新会话"
+    }
+
+
+def load_session_summaries(db: Session, session_ids: Iterable[str]) -> Dict[str, dict]:
+    """一次查询取出多个会话的摘要；不存在或已删除的会话返回空摘要"""
+    session_ids = list(dict.fromkeys(session_ids))
+    rows = db.query(ChatSession) \
+        .filter(ChatSession.session_id.in_(session_ids), ChatSession.deleted.is_(False)) \
+        .all() if session_ids else []
+
+    summaries = {sid: empty_summary(sid) for sid in session_ids}
+    for meta in rows:
+        summaries[meta.session_id] = {
+            "session_id": meta.session_id,
+            "total_messages": meta.message_count,
+            "created_at": meta.created_at.isoformat() if meta.created_at else None,
+            "last_activity": meta.last_activity.isoformat() if meta.last_activity else None,
+            "title": meta.title or "新会话"
+        }
+    return summaries
+
+
+def user_sessions_query(db: Session, user_id: str):
+    """某个用户未删除的会话，走 (user_id, deleted, ...) 复合索引的区间扫描"""
+    return db.query(ChatSession).filter(ChatSession.user_id == user_id, ChatSession.deleted.is_(False))
+
+
+def list_user_sessions(db: Session, user_id: str, offset: int, limit: int,
+                       sort_by: str = "last_activity", descending: bool = True):
+    """返回 (会话总数, 当前页的会话元数据)"""
+    column = ChatSession.message_count if sort_by == "message_count" else ChatSession.last_activity
+    query = user_sessions_query(db, user_id)
+    rows = query.order_by(column.desc() if descending else column.asc()) \
+        .offset(offset).limit(limit).all()
+    return query.count(), rows
+
+
+def user_session_stats(db: Session, user_id: str, recent: int = 10) -> dict:
+    """只读取会话元数据的用户统计，不扫描消息表"""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    sessions, messages, first_activity, last_activity = db.query(
+        func.count(ChatSession.session_id),
+        func.coalesce(func.sum(ChatSession.message_count), 0),
+        func.min(ChatSession.created_at),
+        func.max(ChatSession.last_activity)
+    ).filter(ChatSession.user_id == user_id, ChatSession.deleted.is_(False)).one()
+    active_today = user_sessions_query(db, user_id).filter(ChatSession.last_activity >= today).count()
+    recent_rows = user_sessions_query(db, user_id).order_by(ChatSession.last_activity.desc()).limit(recent).all()
+    return {
+        "user_id": user_id,
+        "total_sessions": sessions,
+        "total_messages": messages,
+        "active_sessions_today": active_today,
+        "first_activity": first_activity.isoformat() if first_activity else None,
+        "last_activity": last_activity.isoformat() if last_activity else None,
+        "recent_sessions": [session_entry(meta) for meta in recent_rows]
+    }
+
+
+def get_changes(db: Session, since: int, limit: int = ChangeFeedConfig.MAX_CHANGES,
+                user_id: Optional[str] = None) -> dict:
+    """返回序号大于 since 的会话变更；指定 user_id 时只返回该用户的会话"""
+    counter = db.get(ChangeCounter, 1)
+    latest = counter.seq if counter else 0
+
+    # 客户端的位置早于已清理的墓碑，无法保证增量正确，需要全量重新加载
+    if counter and since < counter.pruned_before:
+        return {"reset": True, "latest_seq": latest, "changes": [], "has_more": False}
+
+    query = db.query(ChatSession).filter(ChatSession.change_seq > since)
+    if user_id is not None:
+        query = query.filter(ChatSession.user_id == user_id)
+    rows = query \
+        .order_by(ChatSession.change_seq.asc()) \
+        .limit(limit + 1) \
+        .all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = []
+    for meta in rows:
+        if meta.deleted:
+            changes.append({"op": "delete", "seq": meta.change_seq, "session_id": meta.session_id})
+        else:
+            changes.append({"op": "upsert", "seq": meta.change_seq, "session": session_entry(meta)})
+
+    return {
+        "reset": False,
+        "latest_seq": rows[-1].change_seq if has_more else max(latest, since),
+        "changes": changes,
+        "has_more": has_more
+    }
+
+
+def prune_tombstones(db: Session, retention_days: int = ChangeFeedConfig.TOMBSTONE_RETENTION_DAYS) -> int:
+    """清理过期的删除墓碑，并记录清理位置"""
+    cutoff_seq = db.query(func.max(ChatSession.change_seq)).filter(
+        ChatSession.deleted.is_(True),
+        ChatSession.last_activity < datetime.utcnow() - timedelta(days=retention_days)
+    ).scalar()
+    if not cutoff_seq:
+        return 0
+
+    count = db.query(ChatSession).filter(
+        ChatSession.deleted.is_(True),
+        ChatSession.change_seq <= cutoff_seq
+    ).delete(synchronize_session=False)
+    db.query(ChangeCounter).filter(ChangeCounter.id == 1).update({
+        ChangeCounter.pruned_before: func.max(ChangeCounter.pruned_before, cutoff_seq)
+    }, synchronize_session=False)
+    db.commit()
+    return count
+
+
+async def prune_tombstones_loop():
+    """按 ChangeFeedConfig.TOMBSTONE_PRUNE_INTERVAL 定期清理过期墓碑"""
+    from database import SessionLocal
+
+    def prune() -> int:
+        db = SessionLocal()
+        try:
+            return prune_tombstones(db)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    while True:
+        await asyncio.sleep(ChangeFeedConfig.TOMBSTONE_PRUNE_INTERVAL)
+        try:
+            pruned = await run_in_threadpool(prune)
+            if pruned:
+                print(f"[Sessions] 已清理 {pruned} 个过期墓碑")
+        except Exception as e:
+            print(f"[Sessions] 清理墓碑失败: {e}")
+
+
+def ensure_counter(db: Session):
+    if db.get(ChangeCounter, 1) is None:
+        db.add(ChangeCounter(id=1, seq=0, pruned_before=0))
+        db.commit()
+
+
+def backfill_sessions(db: Session, message_dbs: Optional[List[Session]] = None, force: bool = False) -> int:
+    """
+    为已有消息但尚无元数据的会话补建元数据（旧数据迁移）。
+    message_dbs 为各消息分片的会话，默认消息与元数据在同一个库。
+    元数据表非空时说明已迁移过，除非 force=True 否则跳过全表扫描。
+    """
+    ensure_counter(db)
+
+    if not force and db.query(ChatSession.session_id).first() is not None:
+        return 0
+
+    known = {sid for (sid,) in db.query(ChatSession.session_id)}
+    seq = None
+    created = 0
+
+    for message_db in message_dbs or [db]:
+        stats = message_db.query(
+            ChatMessage.session_id,
+            func.count(ChatMessage.id),
+            func.min(ChatMessage.created_at),
+            func.max(ChatMessage.created_at)
+        ).group_by(ChatMessage.session_id).all()
+
+        for session_id, count, first_at, last_at in stats:
+            if session_id in known:
+                continue
+            seq = seq or next_seq(db)
+
+            first_user = message_db.query(ChatMessage.content) \
+                .filter(ChatMessage.session_id == session_id, ChatMessage.role == "user") \
+                .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()) \
+                .limit(1).scalar()
+            last_content = message_db.query(ChatMessage.content) \
+                .filter(ChatMessage.session_id == session_id) \
+                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()) \
+                .limit(1).scalar()
+
+            db.add(ChatSession(
+                session_id=session_id,
+                title=_preview(first_user, 50) if first_user else None,
+                last_message=_preview(last_content, 100),
+                message_count=count,
+                created_at=first_at,
+                last_activity=last_at,
+                change_seq=seq,
+                deleted=False
+            ))
+            created += 1
+
+    if not created:
+        return 0
+
+    db.commit()
+    print(f"✅ 已为 {created} 个旧会话补建元数据")
+    return created
+
+
+class ChangeNotifier:
+    """进程内的变更通知，用于唤醒长轮询请求"""
+
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def notify(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+change_notifier = ChangeNotifier()
+catalog_writer = CatalogWriter()
+
+
+async def wait_for_changes(db: Session, since: int, wait: float, user_id: Optional[str] = None) -> dict:
+    """长轮询：在 wait 秒内等待新的变更；其他 worker 的写入通过定期查库感知"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, ChangeFeedConfig.MAX_WAIT_SECONDS)
+
+    while True:
+        result = get_changes(db, since, user_id=user_id)
+        # 结束读事务，避免长时间持有连接上的快照
+        db.rollback()
+
+        remaining = deadline - loop.time()
+        if result["changes"] or result["reset"] or remaining <= 0:
+            return result
+
+        await change_notifier.wait(min(remaining, ChangeFeedConfig.POLL_INTERVAL))
+
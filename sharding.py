@@ -0,0 +1,43 @@
+# sharding.py
+# 一致性哈希环：把 session_id 映射到消息分片，分片数变化时只有少量会话需要迁移
+import bisect
+import hashlib
+from typing import List
+
+from config import ShardConfig
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class ShardRouter:
+    def __init__(self, shard_count: int, virtual_nodes: int = ShardConfig.VIRTUAL_NODES):
+        self.shard_count = shard_count
+        ring = []
+        for index in range(shard_count):
+            for v in range(virtual_nodes):
+                ring.append((_hash(f"shard-{index}#{v}"), index))
+        ring.sort()
+        self._keys = [k for k, _ in ring]
+        self._shards = [s for _, s in ring]
+
+    def shard_for(self, session_id: str) -> int:
+        if self.shard_count == 1:
+            return 0
+        pos = bisect.bisect(self._keys, _hash(session_id)) % len(self._keys)
+        return self._shards[pos]
+
+    def group(self, session_ids) -> List[List[str]]:
+        """把会话ID按分片分组，返回每个分片的会话ID列表"""
+        groups = [[] for _ in range(self.shard_count)]
+        for session_id in session_ids:
+            groups[self.shard_for(session_id)].append(session_id)
+        return groups
+
+
+def shard_url(index: int, shard_count: int, main_url: str) -> str:
+    """单分片时就是主库本身，否则使用独立的分片文件"""
+    if shard_count == 1:
+        return main_url
+    return ShardConfig.SHARD_URL_TEMPLATE.format(index=index)
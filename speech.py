@@ -0,0 +1,202 @@
+# speech.py
+# 回复语音输出流水线：流式回复按中英文句子边界切段，经异步队列送给可替换的 TTS 输出端，
+# 并统计从开始生成到第一段送达输出端的延迟
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from config import SpeechConfig
+
+# 句末标点（中文句号、问号、叹号、分号、省略号，英文 . ! ? ; 后须跟空白），以及换行
+_SENTENCE_END = re.compile(r"[。！？；!?;…]+[”’」』）)\"']*|\.(?=\s)|\n+")
+# 句子过长时可以切开的次级标点
+_CLAUSE_END = re.compile(r"[，、,：:]")
+
+
+class SentenceSplitter:
+    """增量切句：不断喂入文本块，返回已经完整的句子"""
+
+    def __init__(self, min_chars: int = SpeechConfig.MIN_SEGMENT_CHARS,
+                 max_chars: int = SpeechConfig.MAX_SEGMENT_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        segments = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self.buffer):
+            end = match.end()
+            if len(self.buffer[start:end].strip()) < self.min_chars:
+                continue  # 太短（如"嗯。"），与后面的句子合并
+            segments.append(self.buffer[start:end])
+            start = end
+        self.buffer = self.buffer[start:]
+
+        # 迟迟没有句末标点的长句，在最后一个次级标点处切开
+        while len(self.buffer) > self.max_chars:
+            clauses = list(_CLAUSE_END.finditer(self.buffer, 0, self.max_chars))
+            cut = clauses[-1].end() if clauses else self.max_chars
+            segments.append(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+
+        return [s.strip() for s in segments if s.strip()]
+
+    def flush(self) -> List[str]:
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class SpeechSink:
+    """TTS 输出端接口。speak 在消费协程中按顺序调用，可以等待合成 / 播放完成"""
+
+    async def start(self, session_id: str):
+        pass
+
+    async def speak(self, segment: str):
+        raise NotImplementedError
+
+    async def finish(self):
+        pass
+
+
+class NullSink(SpeechSink):
+    """丢弃所有片段，只用于测量切段延迟"""
+
+    async def speak(self, segment: str):
+        pass
+
+
+class FileSink(SpeechSink):
+    """把每轮回复的片段逐行写入本地文本文件，便于检查切段效果"""
+
+    def __init__(self, directory: str = SpeechConfig.FILE_DIR):
+        self.directory = directory
+        self.file = None
+
+    async def start(self, session_id: str):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{session_id[:8]}.txt"
+        self.file = open(os.path.join(self.directory, name), "w", encoding="utf-8")
+
+    async def speak(self, segment: str):
+        self.file.write(f"{time.time():.3f}\t{segment}\n")
+        self.file.flush()
+
+    async def finish(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+# 输出端注册表：接入真实 TTS 时调用 register_sink 注册，再修改 SpeechConfig.SINK
+SINKS: Dict[str, Callable[[], SpeechSink]] = {
+    "null": NullSink,
+    "file": FileSink,
+}
+
+
+def register_sink(name: str, factory: Callable[[], SpeechSink]):
+    SINKS[name] = factory
+
+
+class SpeechStats:
+    """最近若干轮的首段延迟（从开始生成到第一段送达输出端）"""
+
+    def __init__(self, window: int = SpeechConfig.STATS_WINDOW):
+        self.first_segment_ms = deque(maxlen=window)
+        self.turns = 0
+        self.segments = 0
+        self.lock = threading.Lock()
+
+    def record(self, first_segment_ms: Optional[float], segments: int):
+        with self.lock:
+            self.turns += 1
+            self.segments += segments
+            if first_segment_ms is not None:
+                self.first_segment_ms.append(first_segment_ms)
+
+    def summary(self) -> dict:
+        with self.lock:
+            samples = sorted(self.first_segment_ms)
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))], 1) if samples else None
+        return {
+            "turns": self.turns,
+            "segments": self.segments,
+            "time_to_first_segment_ms": {
+                "samples": len(samples),
+                "avg": round(sum(samples) / len(samples), 1) if samples else None,
+                "p50": pct(0.5),
+                "p95": pct(0.95),
+            },
+            "sink": SpeechConfig.SINK
+        }
+
+
+speech_stats = SpeechStats()
+
+
+class SpeechPipeline:
+    """
+    单轮回复的语音流水线。feed() 在生成回复的协程中调用，只做切句和入队；
+    消费协程按顺序把片段交给输出端，慢的 TTS 不会拖慢回复生成。
+    """
+
+    def __init__(self, session_id: str, sink: SpeechSink):
+        self.session_id = session_id
+        self.sink = sink
+        self.splitter = SentenceSplitter()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.started_at = time.perf_counter()
+        self.first_segment_ms: Optional[float] = None
+        self.segments = 0
+        self.task = asyncio.create_task(self._consume())
+
+    def feed(self, text: str):
+        for segment in self.splitter.feed(text):
+            self.queue.put_nowait(segment)
+
+    def close(self):
+        """回复结束：送出剩余文本并结束队列，不等待输出端播放完成"""
+        for segment in self.splitter.flush():
+            self.queue.put_nowait(segment)
+        self.queue.put_nowait(None)
+
+    async def _consume(self):
+        try:
+            await self.sink.start(self.session_id)
+            while True:
+                segment = await self.queue.get()
+                if segment is None:
+                    break
+                # 在交给输出端之前计时：首段延迟只衡量切段和排队，不含 TTS 合成 / 播放本身
+                if self.first_segment_ms is None:
+                    self.first_segment_ms = (time.perf_counter() - self.started_at) * 1000
+                    print(f"[Speech] 会话 {self.session_id} 首段语音延迟 {self.first_segment_ms:.0f} ms")
+                await self.sink.speak(segment)
+                self.segments += 1
+        except Exception as e:
+            print(f"[Speech] 语音输出失败: {type(e).__name__}: {e}")
+        finally:
+            try:
+                await self.sink.finish()
+            finally:
+                speech_stats.record(self.first_segment_ms, self.segments)
+
+
+def open_speech(session_id: str) -> Optional[SpeechPipeline]:
+    """按配置为本轮回复创建语音流水线，未启用时返回 None"""
+    if not SpeechConfig.ENABLED:
+        return None
+    factory = SINKS.get(SpeechConfig.SINK)
+    if factory is None:
+        print(f"[Speech] 未知的语音输出端 '{SpeechConfig.SINK}'，已跳过")
+        return None
+    return SpeechPipeline(session_id, factory())
@@ -1,3 +1,143 @@
+// 聊天 WebSocket 通道：心跳、断线重连与续传
+class ChatSocket {
+    constructor(handlers) {
+        this.handlers = handlers;
+        this.ws = null;
+        this.clientId = sessionStorage.getItem('ai_chat_ws_client_id');
+        this.resumeToken = sessionStorage.getItem('ai_chat_ws_resume_token');
+        this.lastSeq = 0;
+        this.retryDelay = 1000;
+        this.lastMessageAt = 0;
+        this.heartbeatTimer = null;
+        this.closedByUser = false;
+    }
+
+    isOpen() {
+        return this.ws !== null && this.ws.readyState === WebSocket.OPEN;
+    }
+
+    connect() {
+        if (!('WebSocket' in window)) return;
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        // 通道绑定到当前用户，服务端只推送该用户的会话更新
+        const params = new URLSearchParams({ user_id: currentUserId() });
+        if (this.clientId) {
+            params.set('client_id', this.clientId);
+            params.set('resume_token', this.resumeToken || '');
+            params.set('last_seq', this.lastSeq);
+        }
+
+        const ws = new WebSocket(`${protocol}//${window.location.host}/ws/chat?${params}`);
+        this.ws = ws;
+
+        ws.onopen = () => {
+            this.retryDelay = 1000;
+            this.lastMessageAt = Date.now();
+        };
+
+        ws.onmessage = (e) => {
+            this.lastMessageAt = Date.now();
+            const event = JSON.parse(e.data);
+
+            if (event.seq) {
+                // 重连后可能收到已处理过的事件，按序号去重
+                if (event.seq <= this.lastSeq) return;
+                this.lastSeq = event.seq;
+            }
+
+            switch (event.type) {
+                case 'hello':
+                    this.clientId = event.client_id;
+                    this.resumeToken = event.resume_token;
+                    sessionStorage.setItem('ai_chat_ws_client_id', event.client_id);
+                    sessionStorage.setItem('ai_chat_ws_resume_token', event.resume_token);
+                    // 服务端通道是新建的（例如服务端重启），序号从头开始
+                    if (!event.resumed) this.lastSeq = 0;
+                    this.startHeartbeat(event.heartbeat_interval * 1000);
+                    this.emit('open', event);
+                    break;
+                case 'ping':
+                    this.send({ type: 'pong' });
+                    break;
+                case 'pong':
+                    break;
+                case 'resync':
+                    this.lastSeq = event.last_seq;
+                    this.emit('resync', event);
+                    break;
+                default:
+                    this.emit(event.type, event);
+            }
+        };
+
+        ws.onclose = (e) => {
+            this.stopHeartbeat();
+            this.ws = null;
+            this.emit('close');
+            if (e.code === 1008) {
+                // 续传凭证被拒绝：丢弃旧通道，下次连接建立新通道
+                this.clientId = null;
+                this.resumeToken = null;
+                this.lastSeq = 0;
+                sessionStorage.removeItem('ai_chat_ws_client_id');
+                sessionStorage.removeItem('ai_chat_ws_resume_token');
+            }
+            if (!this.closedByUser) {
+                // 指数退避重连
+                setTimeout(() => this.connect(), this.retryDelay);
+                this.retryDelay = Math.min(this.retryDelay * 2, 30000);
+            }
+        };
+    }
+
+    startHeartbeat(intervalMs) {
+        this.stopHeartbeat();
+        this.heartbeatTimer = setInterval(() => {
+            // 超过三个心跳周期没收到任何消息，认为连接已失效
+            if (Date.now() - this.lastMessageAt > intervalMs * 3) {
+                this.ws.close();
+                return;
+            }
+            this.send({ type: 'ping' });
+        }, intervalMs);
+    }
+
+    stopHeartbeat() {
+        if (this.heartbeatTimer) {
+            clearInterval(this.heartbeatTimer);
+            this.heartbeatTimer = null;
+        }
+    }
+
+    send(data) {
+        if (!this.isOpen()) return false;
+        this.ws.send(JSON.stringify(data));
+        return true;
+    }
+
+    emit(type, event) {
+        const handler = this.handlers[type];
+        if (handler) handler(event);
+    }
+}
+
+// 当前用户（机器人）ID：可通过 URL 参数 ?user_id= 指定并记住，默认与服务端的 default_user 一致
+function currentUserId() {
+    const urlUserId = new URLSearchParams(window.location.search).get('user_id');
+    if (urlUserId) {
+        localStorage.setItem('ai_chat_user_id', urlUserId);
+        return urlUserId;
+    }
+    return localStorage.getItem('ai_chat_user_id') || 'default_user';
+}
+
+// 历史消息按页加载（每页 MESSAGE_PAGE_SIZE 条），聊天区最多保留 MAX_RENDERED_MESSAGES 条历史消息节点，
+// 滚动到距边缘 SCROLL_EDGE_PX 以内时在两端增删，长会话的 DOM 大小和单次请求大小都不随会话长度增长
+const MESSAGE_PAGE_SIZE = 50;
+const MAX_RENDERED_MESSAGES = 150;
+const SCROLL_EDGE_PX = 200;
+
 // AI桌面机器人前端应用
 class AIChatApp {
     constructor() {
@@ -5,6 +145,10 @@ class AIChatApp {
         this.messageCount = 0;
         this.isConnected = true;
         this.apiEndpoint = '/api/chat';
+        this.sessionMap = new Map();
+        this.changeSeq = null;
+        this.pendingTurns = {};
+        this.history = null;
 
         this.init();
     }
@@ -33,15 +177,38 @@ class AIChatApp {
         // 绑定事件
         this.bindEvents();
 
-        // 加载历史会话
-        this.loadSessions();
+        // 加载历史会话，之后通过变更流增量同步
+        this.loadSessions().then(() => this.watchSessionChanges());
 
         // 测试连接
         this.testConnection();
+
+        // 建立 WebSocket 通道（不可用时自动回退到 HTTP）
+        this.initSocket();
+    }
+
+    // 初始化 WebSocket 通道
+    initSocket() {
+        this.socket = new ChatSocket({
+            open: () => this.updateConnectionStatus(true),
+            resync: () => this.loadSessions(),
+            start: (e) => this.onTurnStart(e),
+            chunk: (e) => this.onTurnChunk(e),
+            reply: (e) => this.onTurnReply(e),
+            error: (e) => this.onTurnError(e),
+            busy: (e) => this.onTurnError({ ...e, error: '上一条消息还在处理中，请稍候' }),
+            rate_limited: (e) => this.onTurnError({ ...e, error: `请求过于频繁，请 ${Math.ceil(e.retry_after)} 秒后重试` }),
+            timeout: (e) => this.onTurnError({ ...e, error: '回复超时，请稍后重试' }),
+            cancelled: (e) => this.onTurnError({ ...e, error: '回复已取消' }),
+            session_updated: (e) => this.upsertSession(e.session)
+        });
+        this.socket.connect();
     }
 
     // 初始化会话
     initSession() {
+        this.userId = currentUserId();
+
         // 尝试从URL参数获取session_id
         const urlParams = new URLSearchParams(window.location.search);
         const urlSessionId = urlParams.get('session_id');
@@ -92,6 +259,10 @@ class AIChatApp {
 
     // 绑定事件
     bindEvents() {
+        // 历史消息窗口：滚动位置由 setHistoryRange 自行修正，关闭浏览器的滚动锚定
+        this.elements.chatContainer.style.overflowAnchor = 'none';
+        this.elements.chatContainer.addEventListener('scroll', () => this.onChatScroll());
+
         // 发送消息
         this.elements.sendBtn.addEventListener('click', () => this.sendMessage());
 
@@ -148,6 +319,32 @@ class AIChatApp {
         });
     }
 
+    // 发送一次 HTTP 对话请求；网络错误或同一键仍在处理（409 + Retry-After）时按退避重试
+    async postChat(body, maxRetries = 3) {
+        const idempotencyKey = 'chat_' + Date.now() + '_' + Math.random().toString(36).substr(2, 10);
+        for (let attempt = 0; ; attempt++) {
+            try {
+                const response = await fetch(this.apiEndpoint, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Idempotency-Key': idempotencyKey
+                    },
+                    body: JSON.stringify(body)
+                });
+                const retryAfter = response.headers.get('Retry-After');
+                if (response.status !== 409 || !retryAfter || attempt >= maxRetries) {
+                    return response;
+                }
+                await new Promise(resolve => setTimeout(resolve, parseFloat(retryAfter) * 1000));
+            } catch (error) {
+                if (attempt >= maxRetries) throw error;
+                console.warn(`对话请求失败，第 ${attempt + 1} 次重试:`, error);
+                await new Promise(resolve => setTimeout(resolve, 500 * Math.pow(2, attempt)));
+            }
+        }
+    }
+
     // 自动调整输入框高度
     autoResizeTextarea() {
         const textarea = this.elements.messageInput;
@@ -170,17 +367,27 @@ class AIChatApp {
         // 显示思考中指示器
         const thinkingId = this.showThinkingIndicator();
 
+        // 优先通过 WebSocket 发送，回复会以流式事件返回
+        if (this.socket && this.socket.isOpen()) {
+            const requestId = 'req_' + Date.now() + '_' + Math.random().toString(36).substr(2, 6);
+            this.pendingTurns[requestId] = { thinkingId: thinkingId, messageId: null, content: '' };
+            this.socket.send({
+                type: 'chat',
+                request_id: requestId,
+                message: message,
+                session_id: this.currentSessionId,
+                user_id: this.userId
+            });
+            this.elements.messageInput.focus();
+            return;
+        }
+
         try {
-            // 发送请求到服务器
-            const response = await fetch(this.apiEndpoint, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    message: message,
-                    session_id: this.currentSessionId
-                })
+            // 发送请求到服务器（网络中断时用同一个幂等键重试，服务端不会重复调用AI）
+            const response = await this.postChat({
+                message: message,
+                session_id: this.currentSessionId,
+                user_id: this.userId
             });
 
             if (!response.ok) {
@@ -202,13 +409,8 @@ class AIChatApp {
             // 更新连接状态
             this.updateConnectionStatus(true);
 
-            // 更新会话列表
-            this.loadSessions();
-
-            // 可以添加一个延迟，确保数据库已更新
-            setTimeout(() => {
-    this.loadSessions();
-}, 500);
+            // 增量同步会话列表
+            this.syncSessions().catch(error => console.error('会话同步失败:', error));
 
         } catch (error) {
             // 移除思考中指示器
@@ -226,10 +428,84 @@ class AIChatApp {
         this.elements.messageInput.focus();
     }
 
+    // WebSocket：开始生成回复
+    onTurnStart(event) {
+        const turn = this.pendingTurns[event.request_id];
+        if (!turn) return;
+        // 服务端可能为首次对话分配了新的会话ID
+        if (event.session_id && event.session_id !== this.currentSessionId) {
+            this.currentSessionId = event.session_id;
+            localStorage.setItem('ai_chat_session_id', event.session_id);
+            this.updateSessionDisplay();
+        }
+    }
+
+    // WebSocket：收到一块流式回复
+    onTurnChunk(event) {
+        const turn = this.pendingTurns[event.request_id];
+        if (!turn) return;
+
+        if (!turn.messageId) {
+            this.removeThinkingIndicator(turn.thinkingId);
+            turn.messageId = this.addMessageToUI('assistant', '');
+        }
+        turn.content += event.delta;
+        this.setMessageContent(turn.messageId, turn.content);
+    }
+
+    // WebSocket：回复完成
+    onTurnReply(event) {
+        const turn = this.pendingTurns[event.request_id];
+        if (!turn) return;
+        delete this.pendingTurns[event.request_id];
+
+        this.removeThinkingIndicator(turn.thinkingId);
+        if (turn.messageId) {
+            this.setMessageContent(turn.messageId, event.reply);
+        } else {
+            this.addMessageToUI('assistant', event.reply);
+        }
+
+        this.messageCount += 2;
+        this.updateConnectionStatus(true);
+    }
+
+    // WebSocket：回复失败
+    onTurnError(event) {
+        const turn = this.pendingTurns[event.request_id];
+        if (turn) {
+            delete this.pendingTurns[event.request_id];
+            this.removeThinkingIndicator(turn.thinkingId);
+        }
+        this.addMessageToUI('system', `发送失败: ${event.error}`);
+    }
+
+    // 更新已有消息的内容
+    setMessageContent(messageId, content) {
+        const messageElement = document.getElementById(messageId);
+        if (!messageElement) return;
+        messageElement.querySelector('.message-content').textContent = content;
+        this.scrollToBottom();
+    }
+
     // 添加消息到UI（支持时间戳）
     addMessageToUI(role, content, showTimestamp = true, timestamp = null) {
-    const messageId = 'msg_' + Date.now();
+    const messageId = 'msg_' + Date.now() + '_' + Math.random().toString(36).substr(2, 6);
+
+    // 添加到聊天容器
+    this.elements.chatContainer.insertAdjacentHTML('beforeend',
+        this.buildMessageHTML(role, content, showTimestamp, timestamp, messageId));
+
+    // 滚动到底部（如果是新消息）
+    if (!timestamp) {
+        this.scrollToBottom();
+    }
+
+    return messageId;
+}
 
+    // 生成一条消息的HTML
+    buildMessageHTML(role, content, showTimestamp, timestamp, messageId) {
     // 使用传入的时间戳，如果没有则使用当前时间
     const msgTime = timestamp ? new Date(timestamp) : new Date();
     const timeStr = showTimestamp ? msgTime.toLocaleTimeString([], {
@@ -293,15 +569,7 @@ class AIChatApp {
         </div>
     `;
 
-    // 添加到聊天容器
-    this.elements.chatContainer.insertAdjacentHTML('beforeend', messageHTML);
-
-    // 滚动到底部（如果是新消息）
-    if (!timestamp) {
-        this.scrollToBottom();
-    }
-
-    return messageId;
+    return messageHTML;
 }
 
     // 添加展开消息的方法
@@ -359,6 +627,141 @@ class AIChatApp {
         }
     }
 
+    // 请求一页历史消息：beforeId 为空时取最新一页，否则取该消息之前的一页（按时间正序返回）
+    async fetchMessagePage(sessionId, beforeId) {
+        const params = new URLSearchParams({ limit: MESSAGE_PAGE_SIZE });
+        if (beforeId) {
+            params.set('before_id', beforeId);
+        } else {
+            params.set('tail', 'true');
+        }
+        const response = await fetch(`/api/sessions/${sessionId}/messages?${params}`);
+        if (!response.ok) {
+            const errorText = await response.text();
+            console.error('获取消息失败:', errorText);
+            throw new Error(`获取消息失败: ${response.status}`);
+        }
+        const data = await response.json();
+        if (data.status === 'error') {
+            throw new Error(`获取消息失败: ${data.error}`);
+        }
+        return data;
+    }
+
+    // 用最新一页初始化历史窗口；messages 保存已加载的消息数据，[start, end) 是当前渲染在 DOM 中的部分
+    initHistoryWindow(sessionId, page) {
+        this.elements.chatContainer.insertAdjacentHTML('beforeend', `
+            <div id="history-top" class="text-center text-xs text-gray-400 py-2"></div>
+            <div id="history-window"></div>
+        `);
+        this.history = {
+            sessionId: sessionId,
+            messages: page.messages,
+            hasMore: page.has_more,
+            start: 0,
+            end: 0,
+            loading: false
+        };
+        const end = page.messages.length;
+        this.setHistoryRange(Math.max(0, end - MAX_RENDERED_MESSAGES), end);
+    }
+
+    historyMessageHTML(msg) {
+        const timestamp = msg.created_at ? new Date(msg.created_at) : null;
+        return this.buildMessageHTML(msg.role, msg.content, true, timestamp, 'hist_' + msg.id);
+    }
+
+    // 把历史窗口调整为 messages[start, end)：只在两端增删节点，顶部变化后按高度差修正滚动位置
+    setHistoryRange(start, end) {
+        const h = this.history;
+        const container = this.elements.chatContainer;
+        const windowEl = document.getElementById('history-window');
+        const render = (from, to) => h.messages.slice(from, to).map(msg => this.historyMessageHTML(msg)).join('');
+
+        if (start >= h.end || end <= h.start) {
+            windowEl.innerHTML = render(start, end);
+        } else {
+            const heightBefore = container.scrollHeight;
+            if (start < h.start) {
+                windowEl.insertAdjacentHTML('afterbegin', render(start, h.start));
+            }
+            for (let i = h.start; i < start; i++) {
+                windowEl.firstElementChild.remove();
+            }
+            container.scrollTop += container.scrollHeight - heightBefore;
+
+            if (end > h.end) {
+                windowEl.insertAdjacentHTML('beforeend', render(h.end, end));
+            }
+            for (let i = end; i < h.end; i++) {
+                windowEl.lastElementChild.remove();
+            }
+        }
+        h.start = start;
+        h.end = end;
+        this.updateHistoryTop();
+    }
+
+    updateHistoryTop() {
+        const h = this.history;
+        const top = document.getElementById('history-top');
+        if (!h || !top) return;
+        if (h.loading) {
+            top.textContent = '正在加载更早的消息...';
+        } else if (h.start > 0 || h.hasMore) {
+            top.textContent = '向上滚动加载更早的消息';
+        } else {
+            top.textContent = '已经是最早的消息';
+        }
+    }
+
+    // 滚动到历史窗口顶部时向前翻页（内存中没有时向服务端请求），回到底部时重新渲染被移出的较新消息
+    async onChatScroll() {
+        const h = this.history;
+        if (!h || h.loading) return;
+        const container = this.elements.chatContainer;
+
+        if (container.scrollTop < SCROLL_EDGE_PX) {
+            if (h.start === 0 && h.hasMore) {
+                await this.loadOlderMessages();
+            }
+            if (this.history === h && h.start > 0) {
+                const start = Math.max(0, h.start - MESSAGE_PAGE_SIZE);
+                this.setHistoryRange(start, Math.min(h.end, start + MAX_RENDERED_MESSAGES));
+            }
+            return;
+        }
+
+        if (h.end < h.messages.length) {
+            const windowEl = document.getElementById('history-window');
+            const gap = windowEl.getBoundingClientRect().bottom - container.getBoundingClientRect().bottom;
+            if (gap < SCROLL_EDGE_PX) {
+                const end = Math.min(h.messages.length, h.end + MESSAGE_PAGE_SIZE);
+                this.setHistoryRange(Math.max(h.start, end - MAX_RENDERED_MESSAGES), end);
+            }
+        }
+    }
+
+    // 加载当前最早一条消息之前的一页，放到已加载消息的前面
+    async loadOlderMessages() {
+        const h = this.history;
+        h.loading = true;
+        this.updateHistoryTop();
+        try {
+            const page = await this.fetchMessagePage(h.sessionId, h.messages[0].id);
+            if (this.history !== h) return;  // 加载期间已切换会话
+            h.messages = page.messages.concat(h.messages);
+            h.start += page.messages.length;
+            h.end += page.messages.length;
+            h.hasMore = page.has_more;
+        } catch (error) {
+            console.error('加载更早消息失败:', error);
+        } finally {
+            h.loading = false;
+            this.updateHistoryTop();
+        }
+    }
+
     // 滚动到底部
     scrollToBottom() {
         this.elements.chatContainer.scrollTop = this.elements.chatContainer.scrollHeight;
@@ -379,6 +782,7 @@ class AIChatApp {
 
         // 清空聊天界面
         this.elements.chatContainer.innerHTML = '';
+        this.history = null;
 
         // 显示欢迎消息
         this.showWelcomeMessage();
@@ -441,14 +845,16 @@ class AIChatApp {
         });
     }
 
-    // 加载历史会话
+    // 加载当前用户的历史会话（全量），并记录变更序号作为增量同步的起点
     async loadSessions() {
     try {
-        const response = await fetch('/api/sessions');
+        const response = await fetch(`/api/sessions?user_id=${encodeURIComponent(this.userId)}`);
         if (!response.ok) throw new Error('加载会话列表失败');
 
         const data = await response.json();
-        this.updateSessionsList(data.sessions);
+        this.sessionMap = new Map((data.sessions || []).map(s => [s.session_id, s]));
+        this.changeSeq = data.change_seq ?? null;
+        this.renderSessions();
     } catch (error) {
         console.error('加载会话列表失败:', error);
         // 如果API不可用，显示本地存储的会话
@@ -456,6 +862,74 @@ class AIChatApp {
     }
 }
 
+    // 拉取自上次同步以来的会话变更并应用到本地会话表
+    async syncSessions(wait = 0) {
+        if (this.changeSeq === null) {
+            return this.loadSessions();
+        }
+
+        const response = await fetch(`/api/sessions/changes?since=${this.changeSeq}&wait=${wait}&user_id=${encodeURIComponent(this.userId)}`);
+        if (!response.ok) throw new Error('同步会话列表失败');
+        const data = await response.json();
+        if (data.status !== 'success') throw new Error(data.error || '同步会话列表失败');
+
+        if (data.reset) {
+            return this.loadSessions();
+        }
+        this.applySessionChanges(data.changes);
+        // 并发的同步请求可能乱序返回，序号只前进不后退
+        this.changeSeq = Math.max(this.changeSeq, data.latest_seq);
+
+        if (data.has_more) {
+            return this.syncSessions();
+        }
+    }
+
+    // 应用一批会话变更
+    applySessionChanges(changes) {
+        if (!changes || changes.length === 0) return;
+
+        changes.forEach(change => {
+            if (change.op === 'delete') {
+                this.sessionMap.delete(change.session_id);
+            } else {
+                this.sessionMap.set(change.session.session_id, change.session);
+            }
+        });
+        this.renderSessions();
+    }
+
+    // 长轮询变更流，保持会话列表与服务器同步
+    async watchSessionChanges() {
+        while (true) {
+            try {
+                await this.syncSessions(25);
+                if (this.changeSeq === null) {
+                    // 全量加载失败（服务器不可用），稍后重试
+                    throw new Error('会话列表不可用');
+                }
+            } catch (error) {
+                console.error('会话同步失败:', error);
+                await new Promise(resolve => setTimeout(resolve, 5000));
+            }
+        }
+    }
+
+    // 根据 WebSocket 推送的会话条目就地更新会话列表，无需重新请求
+    upsertSession(session) {
+        // 服务端只推送本用户的会话；切换用户后旧通道上迟到的事件直接忽略
+        if (!session || (session.user_id && session.user_id !== this.userId)) return;
+        this.sessionMap.set(session.session_id, session);
+        this.renderSessions();
+    }
+
+    // 按最近活动时间排序后渲染本地会话表
+    renderSessions() {
+        const sessions = Array.from(this.sessionMap.values());
+        sessions.sort((a, b) => (b.last_activity || '').localeCompare(a.last_activity || ''));
+        this.updateSessionsList(sessions);
+    }
+
     // 更新会话列表
     updateSessionsList(sessions) {
         const sessionsListEl = this.elements.sessionsList;
@@ -569,59 +1043,43 @@ class AIChatApp {
         this.elements.chatContainer.innerHTML = '<div class="text-center py-12"><div class="loading-spinner mx-auto mb-4"></div><p class="text-gray-600">正在加载会话历史...</p></div>';
 
         try {
-            // 1. 先获取会话的所有消息
+            // 1. 先获取最新一页消息，更早的消息在向上滚动时按需加载
             console.log(`正在加载会话: ${sessionId}`);
-            const messagesResponse = await fetch(`/api/sessions/${sessionId}/messages`);
-
-            if (!messagesResponse.ok) {
-                const errorText = await messagesResponse.text();
-                console.error('获取消息失败:', errorText);
-                throw new Error(`获取消息失败: ${messagesResponse.status}`);
-            }
-
-            const messagesData = await messagesResponse.json();
-            console.log(`收到消息数据: ${messagesData.count} 条消息`);
+            const page = await this.fetchMessagePage(sessionId, null);
+            console.log(`收到消息数据: ${page.count} 条消息`);
 
             // 2. 清空聊天界面
             this.elements.chatContainer.innerHTML = '';
+            this.history = null;
 
-            // 3. 显示会话信息标题
-            if (messagesData.count > 0 && messagesData.messages && messagesData.messages.length > 0) {
-                // 使用第一条用户消息作为标题
-                const firstUserMsg = messagesData.messages.find(msg => msg.role === 'user');
-                const title = firstUserMsg ?
-                    (firstUserMsg.content.substring(0, 30) + (firstUserMsg.content.length > 30 ? '...' : '')) :
-                    '历史对话';
+            if (page.messages && page.messages.length > 0) {
+                // 3. 显示会话信息标题（来自会话列表，不依赖已加载的消息）
+                const session = this.sessionMap.get(sessionId);
+                const firstUserMsg = page.messages.find(msg => msg.role === 'user');
+                const rawTitle = (session && session.title) || (firstUserMsg && firstUserMsg.content) || '历史对话';
+                const title = rawTitle.substring(0, 30) + (rawTitle.length > 30 ? '...' : '');
+                const total = session ? session.message_count : page.count;
 
                 const sessionInfoHTML = `
                     <div class="message-system text-center max-w-md mx-auto">
                         <div class="font-medium">${this.escapeHtml(title)}</div>
                         <div class="text-xs text-gray-500 mt-1">
-                            共 ${messagesData.count} 条消息
+                            共 ${total} 条消息
                         </div>
                     </div>
                 `;
                 this.elements.chatContainer.insertAdjacentHTML('beforeend', sessionInfoHTML);
-            }
-
-            // 4. 显示所有历史消息
-            if (messagesData.messages && messagesData.messages.length > 0) {
-                console.log(`显示 ${messagesData.messages.length} 条消息`);
 
-                messagesData.messages.forEach((msg, index) => {
-                    // 为每条消息添加显示时间戳
-                    const timestamp = msg.created_at ? new Date(msg.created_at) : null;
-                    const showTimestamp = true; // 历史消息显示时间戳
-
-                    // 使用原始的时间戳，不要使用当前时间
-                    this.addMessageToUI(msg.role, msg.content, showTimestamp, timestamp);
-                });
+                // 4. 在历史窗口中显示这一页消息
+                this.initHistoryWindow(sessionId, page);
 
                 // 更新消息计数
-                this.messageCount = messagesData.count;
+                this.messageCount = total;
 
                 // 添加系统消息
-                this.addMessageToUI('system', `已加载 ${messagesData.count} 条历史消息。`, false);
+                this.addMessageToUI('system', page.has_more ?
+                    `已加载最近 ${page.count} 条历史消息，向上滚动查看更早的消息。` :
+                    `已加载 ${page.count} 条历史消息。`, false);
 
                 // 滚动到底部
                 this.scrollToBottom();
@@ -631,14 +1089,15 @@ class AIChatApp {
                 this.addMessageToUI('system', '这是一个新的或空的会话，开始对话吧！', false);
             }
 
-            // 5. 重新加载会话列表（更新高亮状态）
-            this.loadSessions();
+            // 5. 重新渲染会话列表（更新高亮状态）
+            this.renderSessions();
 
         } catch (error) {
             console.error('加载会话失败:', error);
 
             // 清空聊天界面并显示错误
             this.elements.chatContainer.innerHTML = '';
+            this.history = null;
             this.addMessageToUI('system', `加载会话失败: ${error.message}`, false);
             this.showWelcomeMessage();
 
@@ -667,8 +1126,8 @@ class AIChatApp {
             this.startNewSession();
         }
 
-        // 重新加载会话列表
-        this.loadSessions();
+        // 同步会话列表
+        this.syncSessions().catch(error => console.error('会话同步失败:', error));
 
         // 显示成功消息
         this.addMessageToUI('system', data.message || '会话已删除');
@@ -808,7 +1267,7 @@ function closeSessionManager() {
 // 加载会话列表用于批量删除
 async function loadSessionsForDeletion() {
     try {
-        const response = await fetch('/api/sessions?page_size=50');
+        const response = await fetch(`/api/sessions?page_size=50&user_id=${encodeURIComponent(currentUserId())}`);
         const data = await response.json();
 
         if (data.status === 'success') {
@@ -861,7 +1320,7 @@ function getSelectedSessionIds() {
 
 // 删除所有会话
 async function deleteAllSessions() {
-    if (!confirm('⚠️ 危险操作！\n\n这将删除所有聊天记录，包括所有会话中的所有消息。\n\n此操作不可恢复！\n\n请输入确认密码 "CONFIRM_DELETE" 继续。')) {
+    if (!confirm('⚠️ 危险操作！\n\n这将删除当前用户的所有聊天记录，包括所有会话中的所有消息。\n\n此操作不可恢复！\n\n请输入确认密码 "CONFIRM_DELETE" 继续。')) {
         return;
     }
 
@@ -872,7 +1331,7 @@ async function deleteAllSessions() {
     }
 
     try {
-        const response = await fetch(`/api/sessions?action=all&confirm=CONFIRM_DELETE`, {
+        const response = await fetch(`/api/users/${encodeURIComponent(currentUserId())}/sessions?confirm=CONFIRM_DELETE`, {
             method: 'DELETE'
         });
 
@@ -909,7 +1368,7 @@ async function keepLatestSessions() {
     }
 
     try {
-        const response = await fetch(`/api/sessions?action=keep_latest&keep_latest=${keepCount}&confirm=CONFIRM_DELETE`, {
+        const response = await fetch(`/api/users/${encodeURIComponent(currentUserId())}/sessions?keep_latest=${keepCount}&confirm=CONFIRM_DELETE`, {
             method: 'DELETE'
         });
 
@@ -0,0 +1,84 @@
+# tests/conftest.py
+# 测试环境：数据库和数据文件都放在临时目录，消息分两个分片存放，AI 使用模拟客户端。
+# 配置必须在导入 database / server 之前修改（分片数、文件路径在导入时确定）
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # server 按相对路径挂载 static / templates
+
+WORKDIR = tempfile.mkdtemp(prefix="robot-tests-")
+os.environ["ROBOT_DATABASE_URL"] = f"sqlite:///{WORKDIR}/robot.db"
+os.environ["LLM_PROVIDER"] = "mock"
+
+import config  # noqa: E402
+
+config.ShardConfig.SHARD_COUNT = 2
+config.ShardConfig.SHARD_URL_TEMPLATE = f"sqlite:///{WORKDIR}/robot_shard_{{index}}.db"
+config.RateLimitConfig.ENABLED = False
+config.RateLimitConfig.SQLITE_PATH = os.path.join(WORKDIR, "ratelimit.db")
+config.MemoryConfig.DIR = os.path.join(WORKDIR, "memory")
+config.SpeechConfig.FILE_DIR = os.path.join(WORKDIR, "speech_out")
+config.ProfilingConfig.DIR = os.path.join(WORKDIR, "profiles")
+
+import pytest  # noqa: E402
+
+import database  # noqa: E402
+from models import Base  # noqa: E402
+
+database.engine.echo = False
+for _engine in database.shard_engines:
+    _engine.echo = False
+
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    """每个测试使用空库和空的记忆索引"""
+    for engine in {database.engine, *database.shard_engines}:
+        Base.metadata.drop_all(bind=engine)
+    database.init_db()
+    shutil.rmtree(config.MemoryConfig.DIR, ignore_errors=True)
+    import memory
+    if memory.long_term_memory is not None:
+        memory.long_term_memory.indexes.clear()
+    yield
+
+
+@pytest.fixture
+def client():
+    """启动服务（含后台任务）的测试客户端"""
+    from fastapi.testclient import TestClient
+    import server
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def llm():
+    """注册可控的模拟AI：replies 中的回复依次返回，calls 记录收到的消息"""
+    import llm_client
+
+    class FakeClient:
+        calls = []
+        replies = []
+
+        def __init__(self, **options):
+            pass
+
+        async def chat(self, messages, max_tokens=None):
+            FakeClient.calls.append(messages)
+            return FakeClient.replies.pop(0) if FakeClient.replies else "好的"
+
+        async def stream_chat(self, messages, max_tokens=None):
+            reply = await self.chat(messages, max_tokens)
+            for i in range(0, len(reply), 2):
+                yield reply[i:i + 2]
+
+    llm_client.register_provider("fake", FakeClient)
+    os.environ["LLM_PROVIDER"] = "fake"
+    yield FakeClient
+    os.environ["LLM_PROVIDER"] = "mock"
+    llm_client._clients.pop("fake", None)
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+import admin
+import database
+from database import ShardSet
+from models import ChatMessage, ChatSession
+from session_store import apply_session_updates, session_update
+
+
+def add_session(session_id, count, user_id=None, catalog=True):
+    shards = ShardSet()
+    try:
+        messages = [ChatMessage(session_id=session_id, role="user" if i % 2 == 0 else "assistant",
+                                content=f"{session_id}-{i}", created_at=datetime.utcnow()) for i in range(count)]
+        shards.for_session(session_id).add_all(messages)
+        if catalog:
+            apply_session_updates(shards.catalog, [session_update(m, user_id) for m in messages])
+        shards.commit()
+    finally:
+        shards.close()
+
+
+def hot_count(session_id):
+    shards = ShardSet()
+    try:
+        return shards.for_session(session_id).query(ChatMessage).filter(ChatMessage.session_id == session_id).count()
+    finally:
+        shards.close()
+
+
+def catalog_rows():
+    with database.engine.connect() as conn:
+        return {sid: (count, deleted, user_id) for sid, count, deleted, user_id in conn.execute(text(
+            "SELECT session_id, message_count, deleted, user_id FROM chat_sessions"))}
+
+
+def test_clean_deletes_in_batches_across_shards():
+    for sid in ("a", "b", "c", "keep"):
+        add_session(sid, 5)
+
+    assert admin.main(["clean", "--sessions", "a", "b", "c", "--dry-run"]) == 0
+    assert hot_count("a") == 5
+
+    assert admin.main(["clean", "--sessions", "a", "b", "c", "--batch", "2", "--sleep", "0"]) == 0
+    assert [hot_count(sid) for sid in ("a", "b", "c", "keep")] == [0, 0, 0, 5]
+    rows = catalog_rows()
+    assert all(rows[sid][1] for sid in ("a", "b", "c")) and not rows["keep"][1]
+
+
+def test_integrity_finds_and_repairs_metadata_drift(capsys):
+    add_session("ok", 2)
+    add_session("drifted", 4)
+    add_session("orphan", 3, catalog=False)
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE chat_sessions SET message_count = 1 WHERE session_id = 'drifted'"))
+
+    assert admin.main(["integrity"]) == 1
+    assert "缺少元数据 1 个，消息数不一致 1 个" in capsys.readouterr().out
+
+    assert admin.main(["integrity", "--repair"]) == 0
+    assert "补建会话元数据 1 个，修正 1 个" in capsys.readouterr().out
+    rows = catalog_rows()
+    assert (rows["drifted"][0], rows["orphan"][0], rows["ok"][0]) == (4, 3, 2)
+    assert admin.main(["integrity"]) == 0
+
+
+def test_backfill_users_uses_session_ids_and_default():
+    add_session("robot-1", 2)
+    add_session("anon", 2)
+    add_session("owned", 2, user_id="alice")
+
+    assert admin.main(["backfill-users", "--known", "robot-1", "--sleep", "0"]) == 0
+    rows = catalog_rows()
+    assert rows["robot-1"][2] == "robot-1"
+    assert rows["anon"][2] == "default_user"
+    assert rows["owned"][2] == "alice"
+
+
+def test_stats_and_vacuum_run(capsys):
+    add_session("s1", 3)
+    assert admin.main(["stats"]) == 0
+    assert "chat_messages" in capsys.readouterr().out
+    assert admin.main(["vacuum", "--sleep", "0"]) == 0
+    assert admin.main(["reindex", "--sleep", "0"]) == 0
+    assert hot_count("s1") == 3
+    db = database.SessionLocal()
+    try:
+        assert db.get(ChatSession, "s1").message_count == 3
+    finally:
+        db.close()
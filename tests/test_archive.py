@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import archive
+import database
+from archive import archive_inactive, pack_messages, unpack_messages
+from database import ShardSet
+from models import ArchivedSession, ChatMessage
+from session_store import apply_session_updates, session_update
+
+OLD = datetime.utcnow() - timedelta(days=30)
+
+
+def add_old_session(session_id, count=4):
+    """写入一个 30 天前的会话（分片中的消息和主库中的元数据）"""
+    shards = ShardSet()
+    try:
+        messages = [
+            ChatMessage(session_id=session_id, role="user" if i % 2 == 0 else "assistant",
+                        content=f"{session_id} 第{i}条", created_at=OLD + timedelta(seconds=i))
+            for i in range(count)
+        ]
+        shards.for_session(session_id).add_all(messages)
+        apply_session_updates(shards.catalog, [session_update(m, "u1") for m in messages])
+        shards.commit()
+    finally:
+        shards.close()
+
+
+def run_archive(**kwargs):
+    shards = ShardSet()
+    try:
+        return asyncio.run(archive_inactive(shards, **kwargs))
+    finally:
+        shards.close()
+
+
+def session_state(session_id):
+    shards = ShardSet()
+    try:
+        db = shards.for_session(session_id)
+        hot = [m.content for m in db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+               .order_by(ChatMessage.id)]
+        return hot, db.get(ArchivedSession, session_id) is not None
+    finally:
+        shards.close()
+
+
+def test_pack_round_trip_keeps_ids_and_order():
+    messages = [
+        ChatMessage(id=i, session_id="s1", role="user", content=f"消息{i}", created_at=OLD + timedelta(seconds=i))
+        for i in range(1, 4)
+    ]
+    codec, payload, raw_size = pack_messages(messages)
+    restored = unpack_messages(codec, payload, "s1")
+    assert [(m.id, m.content, m.created_at) for m in restored] == \
+        [(m.id, m.content, m.created_at) for m in messages]
+    assert len(payload) < raw_size or raw_size < 200
+
+
+def test_dry_run_changes_nothing():
+    add_old_session("s1")
+    assert [item["session_id"] for item in run_archive(dry_run=True)] == ["s1"]
+    assert session_state("s1") == (["s1 第0条", "s1 第1条", "s1 第2条", "s1 第3条"], False)
+
+
+def test_only_cold_sessions_are_archived(client):
+    add_old_session("cold")
+    client.post("/api/chat", json={"message": "你好", "session_id": "warm"})
+
+    assert [item["session_id"] for item in run_archive()] == ["cold"]
+    assert session_state("cold") == ([], True)
+    assert session_state("warm")[1] is False
+
+
+def test_reading_an_archived_session_does_not_rehydrate_it(client):
+    add_old_session("s1")
+    run_archive()
+
+    body = client.get("/api/sessions/s1/messages").json()
+    assert [m["content"] for m in body["messages"]] == ["s1 第0条", "s1 第1条", "s1 第2条", "s1 第3条"]
+    page = client.get("/api/sessions/s1/messages?tail=true&limit=2").json()
+    assert [m["content"] for m in page["messages"]] == ["s1 第2条", "s1 第3条"] and page["has_more"] is True
+    assert session_state("s1") == ([], True)
+
+
+def test_chatting_rehydrates_with_original_ids(client, llm):
+    add_old_session("s1")
+    before = [m["id"] for m in client.get("/api/sessions/s1/messages").json()["messages"]]
+    run_archive()
+
+    client.post("/api/chat", json={"message": "我回来了", "session_id": "s1"})
+    hot, still_archived = session_state("s1")
+    assert hot == ["s1 第0条", "s1 第1条", "s1 第2条", "s1 第3条", "我回来了", "好的"]
+    assert not still_archived
+    # 历史消息作为上下文发给了AI
+    assert any(m["content"] == "s1 第3条" for m in llm.calls[-1])
+    after = [m["id"] for m in client.get("/api/sessions/s1/messages").json()["messages"]]
+    assert after[:4] == before
+
+
+def test_message_written_while_packing_is_not_lost(monkeypatch):
+    add_old_session("s1")
+    pack = archive.pack_messages
+
+    def pack_then_insert(messages):
+        # 模拟打包期间另一个连接写入新消息
+        with database.shard_engines[database.router.shard_for("s1")].begin() as conn:
+            conn.execute(ChatMessage.__table__.insert().values(
+                session_id="s1", role="user", content="新消息", created_at=datetime.utcnow()))
+        return pack(messages)
+
+    monkeypatch.setattr(archive, "pack_messages", pack_then_insert)
+    assert run_archive() == []
+    hot, archived = session_state("s1")
+    assert hot[-1] == "新消息" and len(hot) == 5
+    assert not archived
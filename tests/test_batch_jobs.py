@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from batch_jobs import BatchRunner, create_job
+from config import BatchConfig
+from models import BatchJob
+
+
+def wait_for_job(client, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"/api/batch/jobs/{job_id}?include_results=true").json()
+        if job["job"]["status"] in ("completed", "cancelled") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def idle_runner():
+    """只有队列、不启动 worker 的执行器，用于观察认领了哪些条目"""
+    runner = BatchRunner()
+    runner.queue = asyncio.Queue()
+    return runner
+
+
+def set_lease(job_id, **values):
+    db = database.SessionLocal()
+    try:
+        if values:
+            db.query(BatchJob).filter(BatchJob.job_id == job_id).update(values)
+            db.commit()
+        return db.get(BatchJob, job_id)
+    finally:
+        db.close()
+
+
+def test_job_runs_to_completion(client, llm, monkeypatch):
+    monkeypatch.setattr(BatchConfig, "FLUSH_SIZE", 1)
+    llm.replies = ["一", "二"]
+    created = client.post("/api/batch/jobs", json={"items": [{"prompt": "第一题"}, {"prompt": "第二题"}]}).json()
+    job = wait_for_job(client, created["job"]["job_id"])
+
+    assert job["job"]["status"] == "completed"
+    assert (job["job"]["succeeded"], job["job"]["failed"]) == (2, 0)
+    assert sorted(r["reply"] for r in job["results"]) == ["一", "二"]
+    assert sorted(r["seq"] for r in job["results"]) == [1, 2]
+    # 批量请求和交互式对话共用系统提示前缀
+    assert all(call[0]["role"] == "system" for call in llm.calls)
+
+    lines = client.get(f"/api/batch/jobs/{created['job']['job_id']}/stream").text.splitlines()
+    assert [json.loads(line)["type"] for line in lines] == ["result", "result", "job"]
+
+
+def test_invalid_items_are_rejected(client):
+    assert client.post("/api/batch/jobs", json={"items": [{"foo": 1}]}).status_code == 400
+    assert client.post("/api/batch/jobs", json={"items": []}).status_code == 400
+
+
+def test_a_claimed_job_is_not_resumed_by_another_runner():
+    job = create_job([{"prompt": "1"}, {"prompt": "2"}])
+    first, second = idle_runner(), idle_runner()
+
+    assert first.enqueue(job)
+    second._resume()
+    assert (first.queue.qsize(), second.queue.qsize()) == (2, 0)
+    assert second.enqueue(job) is False
+
+    # 重复执行 _resume 也不会把自己持有的任务再入队一次
+    first._resume()
+    assert first.queue.qsize() == 2
+
+
+def test_expired_lease_is_taken_over():
+    job = create_job([{"prompt": "1"}])
+    first, second = idle_runner(), idle_runner()
+    first.enqueue(job)
+
+    set_lease(job.job_id, lease_until=datetime.utcnow() - timedelta(seconds=1))
+    second._resume()
+    assert second.queue.qsize() == 1
+    assert set_lease(job.job_id).owner == second.owner
+
+
+def test_stop_releases_leases_for_a_restart():
+    job = create_job([{"prompt": "1"}])
+    first = idle_runner()
+    first.enqueue(job)
+    asyncio.run(first.stop())
+
+    released = set_lease(job.job_id)
+    assert (released.owner, released.lease_until) == (None, None)
+    restarted = idle_runner()
+    restarted._resume()
+    assert restarted.queue.qsize() == 1
+
+
+@pytest.mark.parametrize("status", ["completed", "cancelled"])
+def test_finished_jobs_are_never_claimed(status):
+    job = create_job([{"prompt": "1"}])
+    set_lease(job.job_id, status=status)
+    runner = idle_runner()
+    runner._resume()
+    assert runner.queue.qsize() == 0
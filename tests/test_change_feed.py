@@ -0,0 +1,95 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+from config import ChangeFeedConfig
+from models import ChatSession
+from session_store import get_changes, prune_tombstones
+
+
+def changes(client, since=0, **params):
+    return client.get("/api/sessions/changes", params={"since": since, **params}).json()
+
+
+def test_new_sessions_and_deletes_show_up_in_order(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+    client.post("/api/chat", json={"message": "你好", "session_id": "s2"})
+    feed = changes(client)
+    assert [(c["op"], c["session"]["session_id"]) for c in feed["changes"]] == [("upsert", "s1"), ("upsert", "s2")]
+    assert feed["changes"][0]["session"]["message_count"] == 2
+
+    client.delete("/api/sessions/s1")
+    later = changes(client, feed["latest_seq"])
+    assert later["changes"] == [{"op": "delete", "seq": later["latest_seq"], "session_id": "s1"}]
+    assert changes(client, later["latest_seq"])["changes"] == []
+
+
+def test_a_session_appears_once_with_its_latest_state(client):
+    client.post("/api/chat", json={"message": "第一条", "session_id": "s1"})
+    client.post("/api/chat", json={"message": "第二条", "session_id": "s1"})
+    feed = changes(client)
+    assert len(feed["changes"]) == 1
+    assert feed["changes"][0]["session"]["message_count"] == 4
+
+
+def test_feed_can_be_scoped_to_a_user(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "a1", "user_id": "alice"})
+    client.post("/api/chat", json={"message": "你好", "session_id": "b1", "user_id": "bob"})
+    feed = changes(client, user_id="alice")
+    assert [c["session"]["session_id"] for c in feed["changes"]] == ["a1"]
+
+
+def test_large_feeds_are_paged(monkeypatch):
+    monkeypatch.setattr(ChangeFeedConfig, "MAX_CHANGES", 2)
+    db = database.SessionLocal()
+    try:
+        for i in range(5):
+            db.add(ChatSession(session_id=f"s{i}", change_seq=i + 1, message_count=1))
+        db.commit()
+        seen, since = [], 0
+        while True:
+            page = get_changes(db, since, limit=ChangeFeedConfig.MAX_CHANGES)
+            seen += [c["session"]["session_id"] for c in page["changes"]]
+            since = page["latest_seq"]
+            if not page["has_more"]:
+                break
+    finally:
+        db.close()
+    assert seen == [f"s{i}" for i in range(5)]
+
+
+def test_long_poll_returns_when_a_change_arrives(client):
+    since = changes(client)["latest_seq"]
+
+    def chat_later():
+        time.sleep(0.2)
+        client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+
+    writer = threading.Thread(target=chat_later)
+    writer.start()
+    start = time.monotonic()
+    feed = changes(client, since, wait=5)
+    writer.join()
+    assert [c["session"]["session_id"] for c in feed["changes"]] == ["s1"]
+    assert time.monotonic() - start < 3
+
+
+def test_client_behind_pruned_tombstones_must_reload(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+    client.post("/api/chat", json={"message": "你好", "session_id": "s2"})
+    client.delete("/api/sessions/s1")
+
+    db = database.SessionLocal()
+    try:
+        db.query(ChatSession).filter(ChatSession.session_id == "s1").update(
+            {ChatSession.last_activity: datetime.utcnow() - timedelta(days=30)})
+        db.commit()
+        assert prune_tombstones(db) == 1
+        db.commit()
+    finally:
+        db.close()
+
+    assert changes(client, 0)["reset"] is True
+    latest = changes(client, 0)["latest_seq"]
+    assert changes(client, latest)["reset"] is False
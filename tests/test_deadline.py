@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+import database
+from chat_service import run_chat_turn
+from config import DeadlineConfig
+from database import ShardSet
+from deadline import Deadline, parse_timeout
+from models import CancelledTurn
+
+
+@pytest.fixture
+def slow_llm(llm, monkeypatch):
+    chat = llm.chat
+
+    async def slow_chat(self, messages, max_tokens=None):
+        await asyncio.sleep(0.5)
+        return await chat(self, messages, max_tokens)
+
+    monkeypatch.setattr(llm, "chat", slow_chat)
+    return llm
+
+
+def cancelled_turns():
+    db = database.SessionLocal()
+    try:
+        return [(t.session_id, t.reason, t.stage) for t in db.query(CancelledTurn)]
+    finally:
+        db.close()
+
+
+def test_timeout_header_is_parsed_and_capped():
+    assert parse_timeout("2.5") == 2.5
+    assert parse_timeout("abc") is None and parse_timeout("0") is None
+    assert Deadline(10_000).timeout == DeadlineConfig.MAX_TIMEOUT
+    assert Deadline(1).cap(30) <= 1
+
+
+def test_llm_past_the_deadline_returns_504(client, slow_llm):
+    response = client.post("/api/chat", json={"message": "你好", "session_id": "s1"},
+                           headers={"X-Request-Timeout": "0.1"})
+    assert response.status_code == 504 and response.json()["status"] == "error"
+    assert cancelled_turns() == [("s1", "deadline", "llm")]
+    # 未完成的回复不保存为AI消息
+    messages = client.get("/api/sessions/s1/messages").json()["messages"]
+    assert all(m["role"] != "assistant" for m in messages)
+
+
+def test_cancelled_turn_stops_the_llm_call(slow_llm):
+    async def run():
+        shards = ShardSet()
+        try:
+            task = asyncio.ensure_future(run_chat_turn(shards, "s1", "你好"))
+            await asyncio.sleep(0.1)
+            task.cancel("disconnect")
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        finally:
+            shards.rollback()
+            shards.close()
+
+    asyncio.run(run())
+    assert slow_llm.calls == []
+    assert cancelled_turns() == [("s1", "disconnect", "llm")]
@@ -0,0 +1,37 @@
+from sqlalchemy import text
+
+import admin
+import database
+import gen_dataset
+
+
+def message_count():
+    total = 0
+    for shard_engine in database.shard_engines:
+        with shard_engine.connect() as conn:
+            total += conn.execute(text("SELECT COUNT(*) FROM chat_messages")).scalar()
+    return total
+
+
+def test_generated_dataset_is_consistent(tmp_path, client):
+    # database 已按测试配置导入，数据写入测试库；--db 只决定目录
+    args = ["--db", str(tmp_path / "robot.db"), "--sessions", "40", "--messages", "400", "--users", "3"]
+    assert gen_dataset.main(args) == 0
+    total = message_count()
+    assert 200 < total < 800
+
+    # 会话元数据与分片中的消息一致，消息落在路由指定的分片上
+    assert admin.main(["integrity"]) == 0
+    for index, shard_engine in enumerate(database.shard_engines):
+        with shard_engine.connect() as conn:
+            sessions = conn.execute(text("SELECT DISTINCT session_id FROM chat_messages")).scalars()
+            assert all(database.router.shard_for(sid) == index for sid in sessions)
+
+    listed = client.get("/api/sessions?page_size=100").json()
+    assert listed["total_sessions"] == 40
+    changes = client.get("/api/sessions/changes").json()["changes"]
+    assert {c["session"]["user_id"] for c in changes} <= {"robot-0", "robot-1", "robot-2"}
+
+    # 已有数据时不加 --append 拒绝写入
+    assert gen_dataset.main(args) == 1
+    assert message_count() == total
@@ -0,0 +1,92 @@
+import msgpack
+from starlette.requests import Request
+
+from http_cache import etag_matches, make_etag
+
+MSGPACK = {"Accept": "application/x-msgpack"}
+
+
+def request_with(if_none_match):
+    return Request({"type": "http", "headers": [(b"if-none-match", if_none_match.encode("latin-1"))]})
+
+
+def test_weak_comparison_and_lists():
+    etag = make_etag("messages", "s1", 3)
+    assert etag.startswith('W/"')
+    assert etag_matches(request_with(etag[2:]), etag)
+    assert etag_matches(request_with(f'"other", {etag}'), etag)
+    assert etag_matches(request_with("*"), etag)
+    assert not etag_matches(request_with(make_etag("messages", "s1", 4)), etag)
+
+
+def test_unchanged_list_is_not_modified(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+    first = client.get("/api/sessions")
+    again = client.get("/api/sessions", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304 and again.content == b""
+    assert again.headers["etag"] == first.headers["etag"]
+
+    client.post("/api/chat", json={"message": "再来", "session_id": "s2"})
+    changed = client.get("/api/sessions", headers={"If-None-Match": first.headers["etag"]})
+    assert changed.status_code == 200 and changed.json()["total_sessions"] == 2
+
+
+def test_json_and_msgpack_have_different_etags(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+    as_json = client.get("/api/sessions/s1/messages")
+    as_msgpack = client.get("/api/sessions/s1/messages", headers=MSGPACK)
+    assert as_msgpack.headers["content-type"] == "application/x-msgpack"
+    assert as_json.headers["etag"] != as_msgpack.headers["etag"]
+    assert msgpack.unpackb(as_msgpack.content)["messages"] == as_json.json()["messages"]
+
+    # 拿 JSON 的 ETag 请求 MessagePack，不能得到 304（缓存里是 JSON 正文）
+    crossed = client.get("/api/sessions/s1/messages",
+                         headers={**MSGPACK, "If-None-Match": as_json.headers["etag"]})
+    assert crossed.status_code == 200
+    assert msgpack.unpackb(crossed.content)["count"] == 2
+
+
+def test_not_modified_keeps_vary(client):
+    first = client.get("/api/sessions", headers=MSGPACK)
+    again = client.get("/api/sessions", headers={**MSGPACK, "If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert "accept" in [v.strip().lower() for v in again.headers["vary"].split(",")]
+
+
+def test_large_responses_are_compressed_with_vary(client):
+    client.post("/api/chat", json={"message": "很长的消息" * 400, "session_id": "s1"})
+    response = client.get("/api/sessions/s1/messages", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    vary = [v.strip().lower() for v in response.headers["vary"].split(",")]
+    assert "accept" in vary and "accept-encoding" in vary
+    assert response.json()["count"] == 2
+
+
+def revalidate(client, url, etag):
+    return client.get(url, headers={"If-None-Match": etag}).status_code
+
+
+def test_messages_and_summary_revalidate_until_the_session_changes(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+    urls = ["/api/sessions/s1/messages", "/api/sessions/s1/summary", "/api/users/default_user/sessions"]
+    etags = {url: client.get(url).headers["etag"] for url in urls}
+    assert all(revalidate(client, url, etags[url]) == 304 for url in urls)
+
+    # 其他会话的变化不影响本会话的消息和摘要
+    client.post("/api/chat", json={"message": "你好", "session_id": "s2"})
+    assert revalidate(client, urls[0], etags[urls[0]]) == 304
+    assert revalidate(client, urls[1], etags[urls[1]]) == 304
+    assert revalidate(client, urls[2], etags[urls[2]]) == 200
+
+    client.delete("/api/sessions/s1")
+    assert revalidate(client, urls[0], etags[urls[0]]) == 200
+    assert revalidate(client, urls[1], etags[urls[1]]) == 200
+
+
+def test_each_page_has_its_own_etag(client):
+    for i in range(3):
+        client.post("/api/chat", json={"message": f"第{i}条", "session_id": "s1"})
+    tail = client.get("/api/sessions/s1/messages?tail=true&limit=2")
+    older = client.get(f"/api/sessions/s1/messages?limit=2&before_id={tail.json()['messages'][0]['id']}")
+    assert tail.headers["etag"] != older.headers["etag"]
+    assert revalidate(client, "/api/sessions/s1/messages?tail=true&limit=2", older.headers["etag"]) == 200
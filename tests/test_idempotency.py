@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from config import IdempotencyConfig
+from idempotency import idempotency_store
+from models import IdempotencyRecord
+from session_scheduler import message_key
+
+BODY = {"message": "你好", "session_id": "s1", "user_id": "alice"}
+
+
+def post(client, body=BODY, key="k1"):
+    return client.post("/api/chat", json=body, headers={"Idempotency-Key": key})
+
+
+def add_record(key, status, created_ago=0, expires_in=3600, body=BODY, response=None):
+    now = datetime.utcnow()
+    db = database.SessionLocal()
+    try:
+        db.add(IdempotencyRecord(
+            user_id=body["user_id"], key=key, status=status, response=response,
+            fingerprint=message_key(body["user_id"], body["session_id"], body["message"]),
+            created_at=now - timedelta(seconds=created_ago), expires_at=now + timedelta(seconds=expires_in)
+        ))
+        db.commit()
+    finally:
+        db.close()
+
+
+def stored_keys():
+    db = database.SessionLocal()
+    try:
+        return {record.key: record.status for record in db.query(IdempotencyRecord)}
+    finally:
+        db.close()
+
+
+@pytest.fixture(autouse=True)
+def purge_now(monkeypatch):
+    # 每个测试的第一次登记都会清理过期记录
+    monkeypatch.setattr(idempotency_store, "last_purge", 0.0)
+
+
+def test_retry_replays_the_saved_response(client, llm):
+    first = post(client)
+    retry = post(client)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true" and "idempotent-replayed" not in first.headers
+    assert len(llm.calls) == 1
+    assert client.get("/api/sessions/s1/messages").json()["count"] == 2
+    assert stored_keys() == {"k1": "completed"}
+
+
+def test_key_cannot_be_reused_for_another_request(client, llm):
+    post(client)
+    conflict = post(client, {**BODY, "message": "再见"})
+    assert conflict.status_code == 422 and conflict.json()["status"] == "error"
+    # 键属于用户：别的用户用同一个键是另一个请求
+    assert post(client, {**BODY, "user_id": "bob", "session_id": "s2"}).status_code == 200
+    assert len(llm.calls) == 2
+
+
+def test_invalid_key_is_rejected(client, llm):
+    assert post(client, key="x" * (IdempotencyConfig.MAX_KEY_LENGTH + 1)).status_code == 400
+    assert llm.calls == []
+
+
+def test_key_held_by_another_worker(client, llm):
+    add_record("busy", "processing")
+    busy = post(client, key="busy")
+    assert busy.status_code == 409 and busy.headers["retry-after"] == "1"
+
+    # 超过处理时限仍未完成，视为该 worker 已退出，接管执行
+    add_record("stale", "processing", created_ago=IdempotencyConfig.PROCESSING_TIMEOUT + 1)
+    assert post(client, key="stale").status_code == 200
+    assert len(llm.calls) == 1 and stored_keys()["stale"] == "completed"
+
+
+def test_expired_records_are_purged_and_processed_again(client, llm):
+    add_record("old", "completed", expires_in=-1, response='{"reply": "旧的回复"}',
+               body={**BODY, "session_id": "s0"})
+    add_record("k1", "completed", expires_in=-1, response='{"reply": "旧的回复"}')
+
+    fresh = post(client)
+    assert fresh.json()["reply"] != "旧的回复" and len(llm.calls) == 1
+    assert stored_keys() == {"k1": "completed"}
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import sys
+
+import httpx
+import pytest
+
+import llm_client
+from llm_client import DeepSeekClient, LLMError, MockAIClient, get_llm_client, record_usage, track_usage
+
+
+@pytest.fixture(autouse=True)
+def isolated_registry(monkeypatch):
+    """注册表和客户端缓存是模块级的，每个测试结束后恢复"""
+    monkeypatch.setattr(llm_client, "_providers", dict(llm_client._providers))
+    monkeypatch.setattr(llm_client, "_clients", {})
+
+
+def deepseek_with(handler, monkeypatch):
+    monkeypatch.setenv("DEEPSEEK_API_KEY", "test-key")
+    client = DeepSeekClient()
+    client.http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_string_targets_are_imported_on_first_use(tmp_path, monkeypatch):
+    (tmp_path / "echo_provider.py").write_text(
+        "class EchoClient:\n"
+        "    def __init__(self, **options):\n"
+        "        self.options = options\n",
+        encoding="utf-8")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setitem(llm_client.LLMConfig.PROVIDERS, "echo", {"model": "e1"})
+
+    llm_client.register_provider("Echo", "echo_provider:EchoClient")
+    assert "echo_provider" not in sys.modules
+    client = get_llm_client("echo")
+    assert type(client).__name__ == "EchoClient" and client.options == {"model": "e1"}
+    assert get_llm_client("ECHO ") is client
+
+
+def test_unknown_provider_and_missing_key_fall_back_to_mock(monkeypatch):
+    monkeypatch.delenv("DEEPSEEK_API_KEY", raising=False)
+    assert isinstance(get_llm_client("no-such-provider"), MockAIClient)
+    assert isinstance(get_llm_client("deepseek"), MockAIClient)
+
+
+def test_registering_again_replaces_the_cached_client():
+    class First:
+        def __init__(self, **options):
+            pass
+
+    class Second(First):
+        pass
+
+    llm_client.register_provider("custom", First)
+    assert isinstance(get_llm_client("custom"), First)
+    llm_client.register_provider("custom", Second)
+    assert isinstance(get_llm_client("custom"), Second)
+
+
+def test_usage_is_tracked_per_task():
+    async def call(n):
+        usage = track_usage()
+        await asyncio.sleep(0.01 * (3 - n))
+        record_usage({"prompt_tokens": n})
+        await asyncio.sleep(0.01)
+        return usage
+
+    async def run():
+        return await asyncio.gather(*(call(n) for n in range(3)))
+
+    assert asyncio.run(run()) == [{"prompt_tokens": 0}, {"prompt_tokens": 1}, {"prompt_tokens": 2}]
+
+
+def test_deepseek_chat_records_usage(monkeypatch):
+    def handler(request):
+        body = json.loads(request.content)
+        assert body["stream"] is False and body["messages"][-1]["content"] == "你好"
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": "你好呀"}}],
+            "usage": {"prompt_tokens": 10, "prompt_cache_hit_tokens": 8, "prompt_cache_miss_tokens": 2}
+        })
+
+    async def run():
+        client = deepseek_with(handler, monkeypatch)
+        usage = track_usage()
+        reply = await client.chat([{"role": "user", "content": "你好"}])
+        await client.aclose()
+        return reply, usage
+
+    reply, usage = asyncio.run(run())
+    assert reply == "你好呀" and usage["prompt_cache_hit_tokens"] == 8
+
+
+def test_deepseek_stream_parses_sse(monkeypatch):
+    events = [
+        {"choices": [{"delta": {"content": "你好"}}]},
+        {"choices": [{"delta": {"content": "呀"}}]},
+        {"choices": [], "usage": {"prompt_tokens": 3}},
+    ]
+    sse = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+
+    async def run():
+        client = deepseek_with(lambda request: httpx.Response(200, text=sse), monkeypatch)
+        usage = track_usage()
+        chunks = [chunk async for chunk in client.stream_chat([{"role": "user", "content": "hi"}])]
+        await client.aclose()
+        return chunks, usage
+
+    chunks, usage = asyncio.run(run())
+    assert chunks == ["你好", "呀"] and usage == {"prompt_tokens": 3}
+
+
+def test_http_errors_become_llm_errors(monkeypatch):
+    async def run():
+        client = deepseek_with(lambda request: httpx.Response(503), monkeypatch)
+        try:
+            with pytest.raises(LLMError) as exc:
+                await client.chat([{"role": "user", "content": "hi"}])
+            return str(exc.value)
+        finally:
+            await client.aclose()
+
+    assert "503" in asyncio.run(run())
+
+
+def test_provider_error_is_shown_as_the_reply(client, llm, monkeypatch):
+    async def failing_chat(self, messages, max_tokens=None):
+        raise LLMError("请求超时，请稍后重试。")
+
+    monkeypatch.setattr(llm, "chat", failing_chat)
+    body = client.post("/api/chat", json={"message": "你好", "session_id": "s1"}).json()
+    assert body["reply"] == "请求超时，请稍后重试。"
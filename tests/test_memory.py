@@ -0,0 +1,54 @@
+import memory
+from memory import LongTermMemory, build_memory_message
+
+
+def memory_prompt(messages):
+    """取出上下文中注入的记忆消息"""
+    return [m["content"] for m in messages if m["role"] == "system" and "之前对话" in m["content"]]
+
+
+def test_recall_finds_related_messages():
+    store = LongTermMemory()
+    store.remember("alice", "s1", "user", "我的猫叫小花，今年三岁")
+    store.remember("alice", "s1", "user", "明天要去北京出差")
+    results = store.recall("alice", "我的猫叫什么名字")
+    assert results[0]["text"] == "我的猫叫小花，今年三岁"
+    assert store.recall("bob", "我的猫叫什么名字") == []
+
+
+def test_default_user_recall_is_scoped_to_the_session():
+    store = LongTermMemory()
+    store.remember("default_user", "s1", "user", "我的猫叫小花，今年三岁")
+    assert store.recall("default_user", "我的猫叫什么名字", session_id="s2") == []
+    assert len(store.recall("default_user", "我的猫叫什么名字", session_id="s1")) == 1
+
+
+def test_anonymous_clients_do_not_see_each_others_memories(client, llm):
+    client.post("/api/chat", json={"message": "我的猫叫小花，今年三岁", "session_id": "a1"})
+    client.post("/api/chat", json={"message": "我的猫叫什么名字", "session_id": "b1"})
+    assert memory_prompt(llm.calls[-1]) == []
+
+
+def test_named_user_recalls_across_sessions(client, llm):
+    client.post("/api/chat", json={"message": "我的猫叫小花，今年三岁", "session_id": "a1", "user_id": "alice"})
+    client.post("/api/chat", json={"message": "我的猫叫什么名字", "session_id": "a2", "user_id": "alice"})
+    assert "小花" in memory_prompt(llm.calls[-1])[0]
+
+    client.post("/api/chat", json={"message": "我的猫叫什么名字", "session_id": "b1", "user_id": "bob"})
+    assert memory_prompt(llm.calls[-1]) == []
+
+
+def test_deleted_session_is_forgotten():
+    store = LongTermMemory()
+    store.remember("alice", "s1", "user", "我的猫叫小花，今年三岁")
+    store.remember("alice", "s2", "user", "我的狗叫旺财")
+    assert store.forget({"alice": ["s1"]}) == 1
+    assert [m["text"] for m in store.recall("alice", "我的猫叫小花")] == []
+    assert store.index_for("alice").count == 1
+
+
+def test_memory_message_respects_token_budget():
+    memories = [{"text": "很长的一段话" * 40}, {"text": "另一条"}]
+    message = build_memory_message(memories, budget=60)
+    assert memory.estimate_tokens(message["content"]) <= 60
+    assert build_memory_message([]) is None
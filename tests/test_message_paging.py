@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from archive import archive_inactive
+from database import ShardSet
+from models import ChatMessage
+from session_store import apply_session_updates, session_update
+
+OLD = datetime.utcnow() - timedelta(days=30)
+
+
+def add_session(session_id, count):
+    shards = ShardSet()
+    try:
+        messages = [
+            ChatMessage(session_id=session_id, role="user" if i % 2 == 0 else "assistant",
+                        content=f"第{i}条", created_at=OLD + timedelta(seconds=i))
+            for i in range(count)
+        ]
+        shards.for_session(session_id).add_all(messages)
+        apply_session_updates(shards.catalog, [session_update(m, "u1") for m in messages])
+        shards.commit()
+    finally:
+        shards.close()
+
+
+def archive_all():
+    shards = ShardSet()
+    try:
+        return asyncio.run(archive_inactive(shards))
+    finally:
+        shards.close()
+
+
+def contents(page):
+    return [m["content"] for m in page["messages"]]
+
+
+@pytest.mark.parametrize("archived", [False, True])
+def test_pages_walk_backwards_from_the_newest(client, archived):
+    add_session("s1", 7)
+    if archived:
+        assert [item["session_id"] for item in archive_all()] == ["s1"]
+
+    url = "/api/sessions/s1/messages?limit=3"
+    page = client.get(url + "&tail=true").json()
+    assert contents(page) == ["第4条", "第5条", "第6条"] and page["has_more"]
+
+    page = client.get(url + f"&before_id={page['messages'][0]['id']}").json()
+    assert contents(page) == ["第1条", "第2条", "第3条"] and page["has_more"]
+
+    page = client.get(url + f"&before_id={page['messages'][0]['id']}").json()
+    assert contents(page) == ["第0条"] and not page["has_more"]
+
+    # 不分页时从最早的消息开始，不带 has_more
+    first = client.get(url).json()
+    assert contents(first) == ["第0条", "第1条", "第2条"] and "has_more" not in first
+
+
+def test_tail_of_a_short_session_has_no_more(client):
+    add_session("s1", 2)
+    page = client.get("/api/sessions/s1/messages?limit=3&tail=true").json()
+    assert contents(page) == ["第0条", "第1条"] and not page["has_more"]
+    assert client.get("/api/sessions/missing/messages?tail=true").json()["messages"] == []
@@ -0,0 +1,28 @@
+import os
+
+from config import ProfilingConfig
+
+
+def test_timings_are_not_exposed_by_default(client):
+    response = client.get("/api/sessions")
+    assert "server-timing" not in response.headers
+    assert "x-profile-file" not in response.headers
+
+
+def test_server_timing_when_enabled(client, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "SERVER_TIMING", True)
+    timing = client.get("/api/sessions").headers["server-timing"]
+    names = [part.split(";")[0].strip() for part in timing.split(",")]
+    assert "db" in names and "total" in names
+
+
+def test_profiling_needs_the_token(client, monkeypatch):
+    monkeypatch.setattr(ProfilingConfig, "ALLOW_PROFILING", True)
+    monkeypatch.setattr(ProfilingConfig, "TOKEN", "secret")
+
+    denied = client.get("/api/sessions", headers={"X-Profile": "1"})
+    assert "server-timing" not in denied.headers and "x-profile-file" not in denied.headers
+
+    allowed = client.get("/api/sessions?profile=secret")
+    assert "server-timing" in allowed.headers
+    assert os.path.exists(os.path.join(ProfilingConfig.DIR, allowed.headers["x-profile-file"]))
@@ -0,0 +1,57 @@
+import json
+
+from config import PromptConfig
+from prompt_cache import CacheStats, history_window_start, normalize_usage
+
+
+def request_bytes(messages):
+    """按 httpx 发送 JSON 请求体的方式序列化消息列表"""
+    return json.dumps(messages, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def test_consecutive_turns_share_a_byte_identical_prefix(client, llm):
+    turns = PromptConfig.MIN_HISTORY_MESSAGES // 2 + PromptConfig.HISTORY_BLOCK // 2
+    for i in range(turns):
+        client.post("/api/chat", json={"message": f"第{i}个问题", "session_id": "s1", "user_id": "alice"})
+
+    requests = [request_bytes(call) for call in llm.calls]
+    for previous, current in zip(requests, requests[1:]):
+        # 上一轮的整个请求（去掉列表结尾的 "]"）原样出现在下一轮开头
+        assert current.startswith(previous[:-1])
+
+
+def test_recalled_memory_does_not_break_the_prefix(client, llm):
+    client.post("/api/chat", json={"message": "我的猫叫小花，今年三岁", "session_id": "old", "user_id": "alice"})
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1", "user_id": "alice"})
+    client.post("/api/chat", json={"message": "我的猫叫什么名字", "session_id": "s1", "user_id": "alice"})
+
+    second, third = llm.calls[1], llm.calls[2]
+    assert third[-2]["role"] == "system" and "小花" in third[-2]["content"]
+    # 记忆放在历史之后：上一轮的系统提示和历史仍是这一轮的前缀
+    assert request_bytes(third[:len(second)]) == request_bytes(second)
+
+
+def test_window_start_moves_in_blocks():
+    block, keep = PromptConfig.HISTORY_BLOCK, PromptConfig.MIN_HISTORY_MESSAGES
+    starts = [history_window_start(total) for total in range(keep + 3 * block)]
+    assert starts[:keep + block] == [0] * (keep + block)
+    assert set(starts) == {0, block, 2 * block}
+    assert all(total - start >= keep for total, start in enumerate(starts) if total >= keep)
+
+
+def test_usage_from_different_providers_is_normalized():
+    deepseek = {"prompt_tokens": 100, "prompt_cache_hit_tokens": 80, "prompt_cache_miss_tokens": 20,
+                "completion_tokens": 5}
+    openai = {"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 80}, "completion_tokens": 5}
+    expected = {"prompt_tokens": 100, "hit_tokens": 80, "miss_tokens": 20, "completion_tokens": 5}
+    assert normalize_usage(deepseek) == normalize_usage(openai) == expected
+    assert normalize_usage(None) is None
+
+
+def test_cache_stats_evict_the_oldest_session():
+    stats = CacheStats(max_sessions=2)
+    usage = {"prompt_tokens": 10, "prompt_cache_hit_tokens": 5, "prompt_cache_miss_tokens": 5}
+    for session_id in ("a", "b", "c"):
+        stats.record(session_id, usage, 10.0)
+    assert stats.session("a") is None
+    assert stats.overall()["requests"] == 3 and stats.overall()["hit_ratio"] == 0.5
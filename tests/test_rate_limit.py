@@ -0,0 +1,107 @@
+import pytest
+
+import rate_limit
+import ws_chat
+from config import RateLimitConfig
+from rate_limit import MemoryBucketBackend, RateLimiter, SQLiteBucketBackend
+
+RULES = {
+    "ip": {"capacity": 100, "per_seconds": 60},
+    "user": {"capacity": 3, "per_seconds": 60},
+    "session": {"capacity": 2, "per_seconds": 60},
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBucketBackend()
+    return SQLiteBucketBackend(str(tmp_path / "ratelimit.db"))
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    """启用限流（测试环境默认关闭），使用内存后端"""
+    monkeypatch.setattr(RateLimitConfig, "RULES", RULES)
+    limiter = RateLimiter(MemoryBucketBackend())
+    monkeypatch.setattr(rate_limit, "limiter", limiter)
+    monkeypatch.setattr(ws_chat, "limiter", limiter)
+    return limiter
+
+
+def test_bucket_empties_and_refills(backend, clock):
+    spec = [("session:s1", 2.0, 1.0)]
+    assert backend.take(spec) == (True, 0.0)
+    assert backend.take(spec) == (True, 0.0)
+    allowed, retry_after = backend.take(spec)
+    assert not allowed and retry_after == pytest.approx(1.0)
+
+    clock.now += 1.0
+    assert backend.take(spec)[0] is True
+
+
+def test_all_buckets_must_allow_and_none_is_charged_otherwise(backend, clock):
+    user, session = ("user:u1", 5.0, 0.1), ("session:s1", 1.0, 0.1)
+    assert backend.take([user, session])[0] is True
+    assert backend.take([user, session])[0] is False
+    # 会话桶拒绝时用户桶没有被扣减：换一个会话还能用满剩余的 4 个令牌
+    other = ("session:s2", 10.0, 0.1)
+    assert [backend.take([user, other])[0] for _ in range(5)] == [True] * 4 + [False]
+
+
+def test_sqlite_buckets_are_shared_between_workers(tmp_path, clock):
+    path = str(tmp_path / "ratelimit.db")
+    first, second = SQLiteBucketBackend(path), SQLiteBucketBackend(path)
+    spec = [("user:u1", 2.0, 0.1)]
+    assert first.take(spec)[0] and second.take(spec)[0]
+    assert first.take(spec)[0] is False
+
+    clock.now += RateLimitConfig.PURGE_IDLE_SECONDS + 1
+    assert second.purge() == 1
+
+
+def test_shared_default_user_is_not_limited_as_one_user(monkeypatch):
+    monkeypatch.setattr(RateLimitConfig, "RULES", RULES)
+    keys = [key for key, _, _ in RateLimiter.build_specs("1.2.3.4", "default_user", "s1")]
+    assert keys == ["ip:1.2.3.4", "session:s1"]
+
+
+def test_chat_gets_429_with_retry_after(client, llm, enabled):
+    body = {"message": "你好", "session_id": "s1", "user_id": "alice"}
+    assert [client.post("/api/chat", json=body).status_code for _ in range(3)] == [200, 200, 429]
+    limited = client.post("/api/chat", json=body)
+    assert limited.status_code == 429 and int(limited.headers["retry-after"]) >= 1
+    assert len(llm.calls) == 2
+
+    # 请求体被限流中间件读过之后仍然完整地交给接口
+    other = client.post("/api/chat", json={**body, "session_id": "s2"})
+    assert other.status_code == 200 and other.json()["session_id"] == "s2"
+
+
+def test_websocket_chat_is_limited_too(client, llm, enabled):
+    with client.websocket_connect("/ws/chat?user_id=alice") as ws:
+        ws.receive_json()
+        outcomes = []
+        for i in range(3):
+            ws.send_json({"type": "chat", "message": f"第{i}条", "session_id": "s1", "request_id": f"r{i}"})
+            event = ws.receive_json()
+            while event["type"] not in ("reply", "rate_limited"):
+                event = ws.receive_json()
+            outcomes.append(event)
+    assert [e["type"] for e in outcomes] == ["reply", "reply", "rate_limited"]
+    assert outcomes[-1]["request_id"] == "r2" and outcomes[-1]["retry_after"] > 0
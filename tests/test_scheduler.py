@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import database
+from chat_service import run_chat_turn
+from database import ShardSet
+from deadline import Deadline, DeadlineExceeded
+from models import CancelledTurn, ChatMessage
+from session_scheduler import QueueTimeout, SessionScheduler, scheduler
+
+
+def test_same_session_runs_in_order_and_sessions_run_in_parallel():
+    events = []
+
+    async def turn(name, delay):
+        events.append(f"{name} start")
+        await asyncio.sleep(delay)
+        events.append(f"{name} end")
+        return name
+
+    async def run():
+        s = SessionScheduler()
+        results = await asyncio.gather(
+            s.submit("a", "1", lambda: turn("a1", 0.02)),
+            s.submit("a", "2", lambda: turn("a2", 0)),
+            s.submit("b", "1", lambda: turn("b1", 0)),
+        )
+        assert s.active_sessions == 0
+        return results
+
+    assert asyncio.run(run()) == ["a1", "a2", "b1"]
+    assert events.index("a1 end") < events.index("a2 start")
+    assert events.index("b1 end") < events.index("a1 end")
+
+
+def test_duplicate_submissions_share_one_result():
+    calls = []
+
+    async def turn():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def run():
+        s = SessionScheduler()
+        return await asyncio.gather(s.submit("a", "k", turn), s.submit("a", "k", turn))
+
+    assert asyncio.run(run()) == [1, 1]
+    assert calls == [1]
+
+
+def test_lock_wait_is_bounded():
+    async def run():
+        s = SessionScheduler()
+        async with s.session_lock("a"):
+            with pytest.raises(QueueTimeout):
+                await s.submit("a", "k", lambda: asyncio.sleep(0), timeout=0.05)
+        # 超时的等待者不会留下锁
+        assert s.active_sessions == 0
+        await s.submit("a", "k", lambda: asyncio.sleep(0), timeout=0.05)
+
+    asyncio.run(run())
+
+
+def test_chat_turn_gives_up_when_queued_past_the_deadline(llm):
+    async def run():
+        shards = ShardSet()
+        try:
+            async with scheduler.session_lock("s1"):
+                with pytest.raises(DeadlineExceeded) as exc:
+                    await run_chat_turn(shards, "s1", "你好", deadline=Deadline(0.05))
+            return exc.value.stage
+        finally:
+            shards.close()
+
+    assert asyncio.run(run()) == "queued"
+    assert llm.calls == []
+    db = database.SessionLocal()
+    try:
+        cancelled = db.query(CancelledTurn).one()
+        assert (cancelled.session_id, cancelled.reason, cancelled.stage) == ("s1", "deadline", "queued")
+    finally:
+        db.close()
+    shards = ShardSet()
+    try:
+        assert shards.for_session("s1").query(ChatMessage).count() == 0
+    finally:
+        shards.close()
+
+
+def post_concurrently(client, bodies):
+    results = [None] * len(bodies)
+
+    def post(i):
+        results[i] = client.post("/api/chat", json=bodies[i]).json()
+
+    threads = [threading.Thread(target=post, args=(i,)) for i in range(len(bodies))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@pytest.fixture
+def slow_llm(llm, monkeypatch):
+    chat = llm.chat
+
+    async def slow_chat(self, messages, max_tokens=None):
+        await asyncio.sleep(0.3)
+        return await chat(self, messages, max_tokens)
+
+    monkeypatch.setattr(llm, "chat", slow_chat)
+    return llm
+
+
+def test_concurrent_duplicate_posts_call_the_llm_once(client, slow_llm):
+    body = {"message": "你好", "session_id": "s1"}
+    first, second = post_concurrently(client, [body, body])
+    assert first["reply"] == second["reply"]
+    assert len(slow_llm.calls) == 1
+    assert client.get("/api/sessions/s1/messages").json()["count"] == 2
+
+
+def test_different_sessions_do_not_wait_for_each_other(client, slow_llm):
+    start = time.monotonic()
+    post_concurrently(client, [{"message": "你好", "session_id": f"s{i}"} for i in range(3)])
+    assert time.monotonic() - start < 0.8
+    assert len(slow_llm.calls) == 3
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import text
+
+import database
+import reshard
+from database import ShardSet, router
+from models import ChatMessage, ChatSession, ArchivedSession
+from session_store import CatalogWriter, apply_session_updates, mark_sessions_deleted, session_update
+from sharding import ShardRouter
+
+
+def shard_sessions(index):
+    with database.shard_engines[index].connect() as conn:
+        return set(conn.execute(text("SELECT DISTINCT session_id FROM chat_messages")).scalars())
+
+
+def test_router_is_stable_and_spreads_sessions():
+    ids = [f"s{i}" for i in range(400)]
+    a, b = ShardRouter(4), ShardRouter(4)
+    assert [a.shard_for(s) for s in ids] == [b.shard_for(s) for s in ids]
+    counts = [len(group) for group in a.group(ids)]
+    assert sum(counts) == 400 and min(counts) > 50
+
+
+def test_growing_the_ring_moves_only_some_sessions():
+    ids = [f"s{i}" for i in range(1000)]
+    old, new = ShardRouter(4), ShardRouter(5)
+    moved = sum(old.shard_for(s) != new.shard_for(s) for s in ids)
+    assert moved < 400
+
+
+def test_messages_go_to_the_session_shard_and_metadata_to_the_catalog(client):
+    session_ids = [f"s{i}" for i in range(8)]
+    for sid in session_ids:
+        assert client.post("/api/chat", json={"message": "你好", "session_id": sid}).status_code == 200
+
+    for index in range(2):
+        assert shard_sessions(index) == {s for s in session_ids if router.shard_for(s) == index}
+    db = database.SessionLocal()
+    try:
+        counts = dict(db.query(ChatSession.session_id, ChatSession.message_count))
+    finally:
+        db.close()
+    assert counts == {sid: 2 for sid in session_ids}
+
+
+def test_etag_changes_as_soon_as_chat_returns(client):
+    client.post("/api/chat", json={"message": "第一条", "session_id": "s1"})
+    first = client.get("/api/sessions/s1/messages")
+    summary = client.get("/api/sessions/s1/summary")
+
+    client.post("/api/chat", json={"message": "第二条", "session_id": "s1"})
+    again = client.get("/api/sessions/s1/messages", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 200
+    assert again.json()["count"] == 4
+    summary_again = client.get("/api/sessions/s1/summary", headers={"If-None-Match": summary.headers["etag"]})
+    assert summary_again.status_code == 200
+
+
+def test_catalog_writer_merges_updates_per_session():
+    async def run():
+        writer = CatalogWriter()
+        writer.start()
+        for i in range(5):
+            writer.record(ChatMessage(session_id="s1", role="user", content=f"m{i}", created_at=datetime.utcnow()), "u1")
+        await writer.sync()
+        await writer.stop()
+
+    asyncio.run(run())
+    db = database.SessionLocal()
+    try:
+        meta = db.get(ChatSession, "s1")
+        assert (meta.message_count, meta.user_id, meta.title, meta.last_message) == (5, "u1", "m0", "m4")
+    finally:
+        db.close()
+
+
+def test_late_update_does_not_revive_a_deleted_session():
+    db = database.SessionLocal()
+    try:
+        message = ChatMessage(session_id="s1", role="user", content="hi", created_at=datetime.utcnow())
+        apply_session_updates(db, [session_update(message, "u1")])
+        db.commit()
+        mark_sessions_deleted(db, ["s1"])
+        db.commit()
+        # 删除之前写入分片、删除之后才到达主库的更新
+        assert apply_session_updates(db, [session_update(message, "u1")]) == 0
+        db.commit()
+        assert db.get(ChatSession, "s1").deleted is True
+    finally:
+        db.close()
+
+
+def test_reshard_moves_messages_and_archives():
+    shards = ShardSet()
+    try:
+        for i in range(6):
+            sid = f"s{i}"
+            db = shards.for_session(sid)
+            db.add(ChatMessage(session_id=sid, role="user", content=sid, created_at=datetime.utcnow()))
+        shards.for_session("cold").add(ArchivedSession(session_id="cold", codec="zlib", payload=b"x", message_count=1))
+        shards.commit()
+    finally:
+        shards.close()
+
+    reshard.migrate(2, 1)
+
+    with database.engine.connect() as conn:
+        moved = set(conn.execute(text("SELECT session_id FROM chat_messages")).scalars())
+        archived = set(conn.execute(text("SELECT session_id FROM archived_sessions")).scalars())
+    assert moved == {f"s{i}" for i in range(6)}
+    assert archived == {"cold"}
+    assert shard_sessions(0) == shard_sessions(1) == set()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import speech
+from config import SpeechConfig
+from speech import SentenceSplitter, SpeechPipeline, SpeechSink, SpeechStats
+
+
+class RecordingSink(SpeechSink):
+    """记录收到的片段；每段模拟 delay 秒的合成时间"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.segments = []
+        self.finished = False
+
+    async def speak(self, segment):
+        await asyncio.sleep(self.delay)
+        self.segments.append(segment)
+
+    async def finish(self):
+        self.finished = True
+
+
+def test_splits_on_sentence_ends_across_chunks():
+    splitter = SentenceSplitter(min_chars=2, max_chars=80)
+    segments = []
+    for chunk in ["你好", "呀。今天", "天气不错！Hello ", "world. ok"]:
+        segments += splitter.feed(chunk)
+    assert segments == ["你好呀。", "今天天气不错！", "Hello world."]
+    assert splitter.flush() == ["ok"]
+
+
+def test_short_sentences_merge_and_long_ones_are_cut():
+    splitter = SentenceSplitter(min_chars=3, max_chars=10)
+    assert splitter.feed("嗯。好的，我知道了。") == ["嗯。好的，我知道了。"]
+    assert splitter.feed("这是一段很长，没有句号的话还在继续") == ["这是一段很长，"]
+
+
+def test_first_segment_latency_excludes_the_sink():
+    sink = RecordingSink(delay=0.2)
+
+    async def run():
+        pipeline = SpeechPipeline("s1", sink)
+        pipeline.feed("第一句。第二句。")
+        pipeline.close()
+        await pipeline.task
+        return pipeline
+
+    pipeline = asyncio.run(run())
+    assert sink.segments == ["第一句。", "第二句。"] and sink.finished
+    assert pipeline.segments == 2
+    assert pipeline.first_segment_ms < 100
+
+
+def test_failing_sink_does_not_break_the_pipeline(monkeypatch):
+    class BrokenSink(RecordingSink):
+        async def speak(self, segment):
+            raise RuntimeError("tts down")
+
+    stats = SpeechStats()
+    monkeypatch.setattr(speech, "speech_stats", stats)
+    sink = BrokenSink()
+
+    async def run():
+        pipeline = SpeechPipeline("s1", sink)
+        pipeline.feed("第一句。")
+        pipeline.close()
+        await pipeline.task
+
+    asyncio.run(run())
+    assert sink.finished
+    assert stats.summary()["turns"] == 1
+
+
+def test_chat_reply_is_spoken_when_enabled(client, llm, monkeypatch):
+    sink = RecordingSink()
+    monkeypatch.setitem(speech.SINKS, "recording", lambda: sink)
+    monkeypatch.setattr(SpeechConfig, "ENABLED", True)
+    monkeypatch.setattr(SpeechConfig, "SINK", "recording")
+    llm.replies = ["你好呀。很高兴见到你！"]
+
+    assert client.post("/api/chat", json={"message": "你好", "session_id": "s1"}).json()["reply"] == \
+        "你好呀。很高兴见到你！"
+    # 语音在后台消费，回复返回时不一定已经播放完
+    for _ in range(100):
+        if sink.finished:
+            break
+        time.sleep(0.01)
+    assert sink.segments == ["你好呀。", "很高兴见到你！"]
@@ -0,0 +1,47 @@
+from sqlalchemy import event
+
+import database
+from config import SessionConfig
+from session_store import load_session_summaries
+
+
+def test_batch_summaries_follow_the_request_order(client):
+    client.post("/api/chat", json={"message": "第一个会话", "session_id": "s1"})
+    client.post("/api/chat", json={"message": "第二个会话", "session_id": "s2"})
+    client.post("/api/chat", json={"message": "再说一句", "session_id": "s2"})
+
+    body = client.post("/api/sessions/summaries", json={"session_ids": ["s2", "missing", "s1", "s2"]}).json()
+    summaries = body["summaries"]
+    assert [s["session_id"] for s in summaries] == ["s2", "missing", "s1"]
+    assert [s["total_messages"] for s in summaries] == [4, 0, 2]
+    assert summaries[0]["title"] == "第二个会话"
+    assert summaries[1]["title"] == "新会话" and summaries[1]["last_activity"] is None
+
+
+def test_deleted_sessions_have_empty_summaries(client):
+    client.post("/api/chat", json={"message": "你好", "session_id": "s1"})
+    client.delete("/api/sessions/s1")
+    summary = client.get("/api/sessions/s1/summary").json()["summary"]
+    assert summary["total_messages"] == 0
+
+
+def test_batch_size_is_limited(client):
+    too_many = [f"s{i}" for i in range(SessionConfig.MAX_SUMMARY_BATCH + 1)]
+    assert client.post("/api/sessions/summaries", json={"session_ids": too_many}).status_code == 400
+
+
+def test_summaries_are_loaded_in_one_query():
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", count)
+    db = database.SessionLocal()
+    try:
+        summaries = load_session_summaries(db, [f"s{i}" for i in range(100)])
+    finally:
+        db.close()
+        event.remove(database.engine, "before_cursor_execute", count)
+    assert len(summaries) == 100
+    assert len([s for s in statements if s.lstrip().upper().startswith("SELECT")]) == 1
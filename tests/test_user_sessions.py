@@ -0,0 +1,51 @@
+import memory
+
+
+def chat(client, session_id, user_id, times=1):
+    for i in range(times):
+        client.post("/api/chat", json={"message": f"我的猫叫小花 {i}", "session_id": session_id, "user_id": user_id})
+
+
+def test_user_sessions_are_listed_and_sorted(client, llm):
+    chat(client, "a1", "alice", times=2)
+    chat(client, "a2", "alice")
+    chat(client, "b1", "bob")
+
+    listed = client.get("/api/users/alice/sessions").json()
+    assert listed["total_sessions"] == 2
+    assert [s["session_id"] for s in listed["sessions"]] == ["a2", "a1"]
+    assert not any(s["archived"] for s in listed["sessions"])
+
+    by_count = client.get("/api/users/alice/sessions?sort_by=message_count&order=desc").json()
+    assert [(s["session_id"], s["message_count"]) for s in by_count["sessions"]] == [("a1", 4), ("a2", 2)]
+
+    paged = client.get("/api/users/alice/sessions?page=2&page_size=1").json()
+    assert paged["total_pages"] == 2 and [s["session_id"] for s in paged["sessions"]] == ["a1"]
+
+
+def test_user_stats_read_only_that_user(client, llm):
+    chat(client, "a1", "alice", times=2)
+    chat(client, "b1", "bob")
+
+    stats = client.get("/api/users/alice/stats").json()["statistics"]
+    assert (stats["total_sessions"], stats["total_messages"], stats["active_sessions_today"]) == (1, 4, 1)
+    assert [s["session_id"] for s in stats["recent_sessions"]] == ["a1"]
+    assert client.get("/api/users/nobody/stats").json()["statistics"]["total_sessions"] == 0
+
+
+def test_delete_user_sessions_keeps_latest_and_other_users(client, llm):
+    for sid in ("a1", "a2", "a3"):
+        chat(client, sid, "alice")
+    chat(client, "b1", "bob")
+
+    assert client.delete("/api/users/alice/sessions").status_code == 400
+
+    body = client.delete("/api/users/alice/sessions?confirm=CONFIRM_DELETE&keep_latest=1").json()
+    assert (body["deleted_sessions"], body["deleted_count"]) == (2, 4)
+    assert [s["session_id"] for s in client.get("/api/users/alice/sessions").json()["sessions"]] == ["a3"]
+    assert client.get("/api/sessions/a1/messages").json()["count"] == 0
+    assert client.get("/api/users/bob/sessions").json()["total_sessions"] == 1
+
+    # 被删除会话里的记忆一并清除
+    remembered = {m["session_id"] for m in memory.long_term_memory.recall("alice", "我的猫叫小花", k=10)}
+    assert remembered == {"a3"}
@@ -0,0 +1,100 @@
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+
+def receive_until(ws, event_type):
+    """读取事件直到出现 event_type，返回途中收到的全部事件"""
+    events = []
+    while True:
+        event = ws.receive_json()
+        events.append(event)
+        if event["type"] == event_type:
+            return events
+
+
+def chat(ws, message, session_id, request_id="r1"):
+    ws.send_json({"type": "chat", "message": message, "session_id": session_id, "request_id": request_id})
+    return receive_until(ws, "reply")
+
+
+def test_streams_chunks_and_reply(client, llm):
+    llm.replies = ["你好呀朋友"]
+    with client.websocket_connect("/ws/chat") as ws:
+        hello = ws.receive_json()
+        assert hello["type"] == "hello" and hello["resumed"] is False
+
+        events = chat(ws, "你好", "s1")
+        chunks = [e["delta"] for e in events if e["type"] == "chunk"]
+        assert "".join(chunks) == "你好呀朋友"
+        assert events[-1]["reply"] == "你好呀朋友"
+        seqs = [e["seq"] for e in events]
+        assert seqs == sorted(seqs)
+
+
+def test_resume_replays_missed_events(client, llm):
+    with client.websocket_connect("/ws/chat") as ws:
+        hello = ws.receive_json()
+        events = chat(ws, "第一条", "s1")
+    last_seen = events[0]["seq"]
+
+    query = f"client_id={hello['client_id']}&resume_token={hello['resume_token']}&last_seq={last_seen}"
+    with client.websocket_connect(f"/ws/chat?{query}") as ws:
+        hello2 = ws.receive_json()
+        assert hello2["resumed"] is True
+        replayed = [ws.receive_json() for _ in range(len(events) - 1)]
+    assert [e["seq"] for e in replayed] == [e["seq"] for e in events[1:]]
+
+
+def test_resume_with_wrong_token_is_rejected(client):
+    with client.websocket_connect("/ws/chat") as ws:
+        hello = ws.receive_json()
+
+    with client.websocket_connect(f"/ws/chat?client_id={hello['client_id']}&resume_token=wrong") as ws:
+        assert ws.receive_json()["type"] == "error"
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+    assert exc.value.code == 1008
+
+
+def test_non_object_frames_get_an_error(client):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.receive_json()
+        for frame in ("[1, 2]", "\"text\"", "not json"):
+            ws.send_text(frame)
+            assert ws.receive_json() == {"type": "error", "error": "消息必须是 JSON 对象"}
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json()["type"] == "pong"
+
+
+def test_session_updates_only_reach_the_owner(client, llm):
+    with client.websocket_connect("/ws/chat?user_id=alice") as alice, \
+            client.websocket_connect("/ws/chat?user_id=bob") as bob:
+        alice.receive_json()
+        bob.receive_json()
+
+        alice.send_json({"type": "chat", "message": "你好", "session_id": "alice-1", "request_id": "r1"})
+        update = receive_until(alice, "session_updated")[-1]
+        assert update["session"]["session_id"] == "alice-1"
+        assert update["session"]["user_id"] == "alice"
+
+        # bob 的通道上只有自己的事件
+        bob.send_json({"type": "ping"})
+        assert bob.receive_json()["type"] == "pong"
+
+
+def test_chat_as_another_user_is_rejected(client, llm):
+    with client.websocket_connect("/ws/chat?user_id=alice") as ws:
+        ws.receive_json()
+        ws.send_json({"type": "chat", "message": "hi", "user_id": "bob", "request_id": "r1"})
+        event = ws.receive_json()
+    assert event["type"] == "error" and event["request_id"] == "r1"
+    assert llm.calls == []
+
+
+def test_resume_as_another_user_is_rejected(client):
+    with client.websocket_connect("/ws/chat?user_id=alice") as ws:
+        hello = ws.receive_json()
+
+    query = f"client_id={hello['client_id']}&resume_token={hello['resume_token']}&user_id=bob"
+    with client.websocket_connect(f"/ws/chat?{query}") as ws:
+        assert ws.receive_json()["type"] == "error"
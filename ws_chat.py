@@ -0,0 +1,327 @@
+# ws_chat.py
+# /ws/chat WebSocket 通道：在一条长连接上承载用户消息、流式回复块和会话列表更新事件
+import asyncio
+import hmac
+import json
+import secrets
+import time
+import uuid
+from collections import deque
+from typing import Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from config import WebSocketConfig
+from database import ShardSet
+from chat_service import resolve_session_id, run_chat_turn, get_session_entry
+from deadline import Deadline, DeadlineExceeded, parse_timeout
+from rate_limit import limiter, client_ip
+from session_store import catalog_writer
+
+# 发送队列满时可以直接丢弃的事件类型（后续同类事件会覆盖它）
+COALESCIBLE_EVENTS = {"session_updated"}
+
+
+class ChatChannel:
+    """
+    按 client_id 区分的逻辑通道，生命周期长于单个 WebSocket 连接。
+    每个事件带递增的 seq 并进入重放缓冲区，客户端断线重连时凭 last_seq 续传。
+    创建时生成续传凭证，只有持有凭证的连接才能接管通道、读取缓冲区中的回复。
+    通道绑定一个用户，只在该用户名下对话，也只收到该用户的会话更新。
+    """
+
+    def __init__(self, client_id: str, user_id: str = "default_user"):
+        self.client_id = client_id
+        self.user_id = user_id
+        self.resume_token = secrets.token_urlsafe(24)
+        self.seq = 0
+        self.buffer = deque(maxlen=WebSocketConfig.REPLAY_BUFFER_SIZE)
+        self.websocket: Optional[WebSocket] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.detached_at: Optional[float] = time.monotonic()
+        self.tasks = set()
+        self.turns: Dict[str, asyncio.Task] = {}  # request_id -> 进行中的对话任务，供客户端取消
+
+    def attach(self, websocket: WebSocket, last_seq: int):
+        """绑定新连接，返回需要重放的事件；缓冲区已无法覆盖 last_seq 时返回 None"""
+        replay = [e for e in self.buffer if e["seq"] > last_seq]
+        if last_seq < self.seq and (not replay or replay[0]["seq"] != last_seq + 1):
+            replay = None
+
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=WebSocketConfig.SEND_QUEUE_SIZE)
+        self.detached_at = None
+        return replay
+
+    def detach(self, websocket: WebSocket):
+        if self.websocket is websocket:
+            self.websocket = None
+            self.queue = None
+            self.detached_at = time.monotonic()
+
+    def send_control(self, event: dict):
+        """发送不进入重放缓冲区的控制消息（心跳等），队列满时直接放弃"""
+        if self.queue is not None:
+            try:
+                self.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+    async def publish(self, event: dict):
+        """发布一个带序号的事件；连接断开期间事件只进入缓冲区"""
+        self.seq += 1
+        event["seq"] = self.seq
+        self.buffer.append(event)
+
+        queue, websocket = self.queue, self.websocket
+        if queue is None:
+            return
+
+        if event.get("type") in COALESCIBLE_EVENTS:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+            return
+
+        try:
+            # 队列满时在这里等待，从而减慢上游（LLM流）的消费速度
+            await asyncio.wait_for(queue.put(event), timeout=WebSocketConfig.SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            # 慢客户端：断开连接，客户端重连后从缓冲区续传
+            print(f"[WebSocket] 客户端 {self.client_id} 接收过慢，断开连接")
+            self.detach(websocket)
+            asyncio.create_task(_close_quietly(websocket, code=1013))
+
+    def is_idle(self) -> bool:
+        return self.websocket is None and not self.tasks
+
+
+class ChannelRegistry:
+    """管理所有通道，过期的断线通道会被清理以限制内存"""
+
+    def __init__(self):
+        self.channels: Dict[str, ChatChannel] = {}
+
+    def get_or_create(self, client_id: str, user_id: str = "default_user"):
+        self.sweep()
+        channel = self.channels.get(client_id)
+        if channel is not None:
+            return channel, True
+        channel = ChatChannel(client_id, user_id)
+        self.channels[client_id] = channel
+        return channel, False
+
+    def sweep(self):
+        now = time.monotonic()
+        expired = [
+            cid for cid, ch in self.channels.items()
+            if ch.is_idle() and now - ch.detached_at > WebSocketConfig.RESUME_TTL
+        ]
+        for cid in expired:
+            del self.channels[cid]
+
+    async def broadcast(self, event: dict, user_id: str):
+        """只发给绑定到 user_id 的通道，会话条目不会泄露给其他用户"""
+        for channel in list(self.channels.values()):
+            if channel.user_id == user_id:
+                await channel.publish(dict(event))
+
+
+registry = ChannelRegistry()
+
+
+async def _close_quietly(websocket: WebSocket, code: int = 1000):
+    try:
+        await websocket.close(code=code)
+    except Exception:
+        pass
+
+
+async def _sender(websocket: WebSocket, queue: asyncio.Queue):
+    while True:
+        event = await queue.get()
+        await websocket.send_json(event)
+
+
+async def _heartbeat(channel: ChatChannel):
+    while True:
+        await asyncio.sleep(WebSocketConfig.HEARTBEAT_INTERVAL)
+        channel.send_control({"type": "ping", "ts": time.time()})
+
+
+async def _run_turn(channel: ChatChannel, data: dict, request_id: str):
+    session_id = resolve_session_id(data.get("session_id"), channel.user_id)
+    timeout = parse_timeout(data.get("timeout"))
+
+    await channel.publish({"type": "start", "request_id": request_id, "session_id": session_id})
+
+    shards = ShardSet()
+    try:
+        async def on_chunk(delta: str):
+            await channel.publish({
+                "type": "chunk",
+                "request_id": request_id,
+                "session_id": session_id,
+                "delta": delta
+            })
+
+        result = await run_chat_turn(
+            shards, session_id, data["message"],
+            on_chunk=on_chunk, user_id=channel.user_id,
+            deadline=Deadline(timeout) if timeout else None
+        )
+        await channel.publish({"type": "reply", "request_id": request_id, **result})
+
+        # 会话元数据在后台合并写入，广播前等它落库
+        await catalog_writer.sync()
+        entry = get_session_entry(shards.catalog, session_id)
+        if entry:
+            await registry.broadcast({"type": "session_updated", "session": entry},
+                                     entry.get("user_id") or channel.user_id)
+
+    except DeadlineExceeded as e:
+        shards.rollback()
+        await channel.publish({
+            "type": "timeout",
+            "request_id": request_id,
+            "session_id": session_id,
+            "error": str(e)
+        })
+    except asyncio.CancelledError:
+        shards.rollback()
+        await channel.publish({"type": "cancelled", "request_id": request_id, "session_id": session_id})
+        raise
+    except Exception as e:
+        shards.rollback()
+        print(f"[WebSocket] 对话失败: {e}")
+        await channel.publish({
+            "type": "error",
+            "request_id": request_id,
+            "session_id": session_id,
+            "error": str(e)
+        })
+    finally:
+        shards.close()
+
+
+async def handle_chat_socket(websocket: WebSocket):
+    """处理一条 /ws/chat 连接"""
+    client_id = websocket.query_params.get("client_id") or str(uuid.uuid4())
+    user_id = websocket.query_params.get("user_id") or "default_user"
+    try:
+        last_seq = int(websocket.query_params.get("last_seq", 0))
+    except ValueError:
+        last_seq = 0
+
+    await websocket.accept()
+
+    channel, resumed = registry.get_or_create(client_id, user_id)
+    if resumed and (channel.user_id != user_id or not hmac.compare_digest(
+            websocket.query_params.get("resume_token") or "", channel.resume_token)):
+        # 通道属于另一个连接者或另一个用户：拒绝接管，客户端应丢弃 client_id 重新建立通道
+        print(f"[WebSocket] 客户端 {client_id} 的续传凭证或用户不匹配，拒绝连接")
+        await websocket.send_json({"type": "error", "error": "续传凭证无效，请重新建立通道"})
+        await _close_quietly(websocket, code=1008)
+        return
+    replay = channel.attach(websocket, last_seq)
+
+    await websocket.send_json({
+        "type": "hello",
+        "client_id": client_id,
+        "user_id": channel.user_id,
+        "resume_token": channel.resume_token,
+        "resumed": resumed,
+        "last_seq": channel.seq,
+        "heartbeat_interval": WebSocketConfig.HEARTBEAT_INTERVAL
+    })
+
+    if replay is None:
+        # 缓冲区已覆盖不到客户端的位置，让客户端通过 HTTP 重新拉取
+        await websocket.send_json({"type": "resync", "last_seq": channel.seq})
+    else:
+        for event in replay:
+            await websocket.send_json(event)
+
+    print(f"[WebSocket] 客户端 {client_id} 已连接 (续传: {resumed}, 重放 {len(replay or [])} 条事件)")
+
+    sender = asyncio.create_task(_sender(websocket, channel.queue))
+    heartbeat = asyncio.create_task(_heartbeat(channel))
+
+    try:
+        while True:
+            receive = asyncio.ensure_future(websocket.receive_text())
+            done, _ = await asyncio.wait(
+                {receive, sender},
+                timeout=WebSocketConfig.HEARTBEAT_TIMEOUT,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if sender in done or not done:
+                # 发送失败或心跳超时
+                receive.cancel()
+                if not done:
+                    print(f"[WebSocket] 客户端 {client_id} 心跳超时")
+                break
+
+            try:
+                data = json.loads(receive.result())
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                channel.send_control({"type": "error", "error": "消息必须是 JSON 对象"})
+                continue
+            msg_type = data.get("type")
+
+            if msg_type == "ping":
+                channel.send_control({"type": "pong", "ts": time.time()})
+
+            elif msg_type == "cancel":
+                # 客户端主动取消：停止上游生成，已生成的部分记入取消记录
+                task = channel.turns.get(data.get("request_id"))
+                if task is not None:
+                    task.cancel("client_cancel")
+
+            elif msg_type == "chat":
+                if not (data.get("message") or "").strip():
+                    channel.send_control({"type": "error", "request_id": data.get("request_id"), "error": "消息不能为空"})
+                    continue
+                if data.get("user_id") and data["user_id"] != channel.user_id:
+                    channel.send_control({"type": "error", "request_id": data.get("request_id"),
+                                          "error": "user_id 与连接所属用户不一致"})
+                    continue
+                if len(channel.tasks) >= WebSocketConfig.MAX_INFLIGHT_TURNS:
+                    channel.send_control({"type": "busy", "request_id": data.get("request_id")})
+                    continue
+                if limiter is not None:
+                    allowed, retry_after = await limiter.check(
+                        ip=client_ip(websocket.scope),
+                        user_id=channel.user_id,
+                        session_id=data.get("session_id")
+                    )
+                    if not allowed:
+                        channel.send_control({
+                            "type": "rate_limited",
+                            "request_id": data.get("request_id"),
+                            "retry_after": retry_after
+                        })
+                        continue
+
+                # 对话任务独立于连接运行，断线期间产生的事件进入缓冲区等待续传
+                request_id = data.get("request_id") or str(uuid.uuid4())
+                task = asyncio.create_task(_run_turn(channel, data, request_id))
+                channel.tasks.add(task)
+                channel.turns[request_id] = task
+                task.add_done_callback(channel.tasks.discard)
+                task.add_done_callback(lambda _, rid=request_id: channel.turns.pop(rid, None))
+
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    except Exception as e:
+        print(f"[WebSocket] 连接错误: {type(e).__name__}: {e}")
+    finally:
+        sender.cancel()
+        heartbeat.cancel()
+        channel.detach(websocket)
+        await _close_quietly(websocket)
+        print(f"[WebSocket] 客户端 {client_id} 已断开")